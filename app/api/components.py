@@ -3,6 +3,8 @@ This module contains definitions of the science payload components. Functions
 that turn blast database scheme into a flat science payload to be served through
 the API.
 """
+from collections import defaultdict
+from typing import Dict
 from typing import List
 
 from host import models
@@ -137,6 +139,73 @@ def sed_fit_component(transient_name: str) -> List[DataModelComponent]:
     return components
 
 
+def prefetch_science_objects(transient_names: List[str]) -> Dict[str, dict]:
+    """
+    Fetches the objects of all the science payload components of several
+    transients in bulk, with a fixed number of queries however many filters
+    and transients there are.
+
+    parameters:
+        transient_names (List[str]): names of the transients.
+    returns:
+        objects (Dict[str, dict]): transient name to the objects of its
+            components, see prefetch_component_objects. Transients that do not
+            exist are left out.
+    """
+    objects = defaultdict(lambda: defaultdict(list))
+
+    transients = (
+        models.Transient.objects.filter(name__in=transient_names)
+        .select_related("host", "added_by")
+        .prefetch_related("added_by__groups", "added_by__user_permissions")
+    )
+    for transient in transients:
+        objects[transient.name]["transient_"].append(transient)
+        if transient.host is not None:
+            objects[transient.name]["host_"].append(transient.host)
+
+    apertures = models.Aperture.objects.filter(
+        transient__name__in=transient_names
+    ).select_related("cutout", "transient")
+    for aperture in apertures:
+        prefix = f"{aperture.type}_aperture_"
+        objects[aperture.transient.name][prefix].append(aperture)
+
+    photometry = models.AperturePhotometry.objects.filter(
+        transient__name__in=transient_names
+    ).select_related("aperture", "filter", "transient")
+    for datapoint in photometry:
+        prefix = f"{datapoint.aperture.type}_aperture_{datapoint.filter.name}_"
+        objects[datapoint.transient.name][prefix].append(datapoint)
+
+    sed_results = (
+        models.SEDFittingResult.objects.filter(transient__name__in=transient_names)
+        .select_related("transient", "aperture")
+        .prefetch_related("logsfh")
+    )
+    for sed_result in sed_results:
+        if sed_result.aperture is not None:
+            prefix = f"{sed_result.aperture.type}_aperture_host_"
+            objects[sed_result.transient.name][prefix].append(sed_result)
+
+    return objects
+
+
+def prefetch_component_objects(transient_name: str) -> Dict[str, list]:
+    """
+    Fetches the objects of all the science payload components of a transient
+    in bulk, with a fixed number of queries however many filters there are.
+
+    parameters:
+        transient_name (str): name of the transient.
+    returns:
+        objects (Dict[str, list]): component prefix to the objects matching
+            the query of that component, to be passed to
+            serialize_blast_science_data.
+    """
+    return prefetch_science_objects([transient_name]).get(transient_name, {})
+
+
 data_model_components = [
     transient_component,
     host_component,
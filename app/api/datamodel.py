@@ -4,7 +4,9 @@ science payload to be delivered by the blast web API.
 """
 import itertools
 from dataclasses import dataclass
+from typing import Dict
 from typing import List
+from typing import Optional
 
 import django
 from host import models
@@ -34,12 +36,18 @@ class DataModelComponent:
     serializer: serializers.Serializer
 
 
-def serialize_blast_science_data(datamodel: List[DataModelComponent]) -> dict:
+def serialize_blast_science_data(
+    datamodel: List[DataModelComponent], objects: Optional[Dict[str, list]] = None
+) -> dict:
     """
     Serializes all data associated with a transient into a flat structure.
 
     parameters:
         datamodel: (List[DataModelComponent]): datamodel to be serialized.
+        objects: (Dict[str, list], optional): objects matching the query of
+            each component, keyed by component prefix, e.g. from
+            api.components.prefetch_component_objects. If not given, each
+            component is queried separately.
     returns:
         science_payload: Flat dictionary containing science data fields and
             values.
@@ -48,13 +56,20 @@ def serialize_blast_science_data(datamodel: List[DataModelComponent]) -> dict:
     for component in datamodel:
         prefix, serializer = component.prefix, component.serializer
         try:
-            object = component.model.objects.get(**component.query)
+            if objects is None:
+                object = component.model.objects.get(**component.query)
+            else:
+                # same outcome as get: no data unless exactly one object matches
+                matches = objects.get(prefix, [])
+                if len(matches) != 1:
+                    raise component.model.DoesNotExist
+                object = matches[0]
             object_data = serializer(object).data
             object_dict = {prefix + name: value for name, value in object_data.items()}
         except:
             object_dict = {prefix + name: None for name in serializer().fields}
 
-        science_payload = {**science_payload, **object_dict}
+        science_payload.update(object_dict)
     return science_payload
 
 
@@ -0,0 +1,266 @@
+"""
+Bulk export of the science payloads of many transients as CSV or Parquet.
+
+Transients are read in batches ordered by primary key, each batch starting
+after the last key of the one before (keyset pagination). The payloads of a
+batch are fetched with a fixed number of queries and written out before the
+next batch is read, so only one batch is held in memory however many
+transients are exported.
+"""
+import csv
+import io
+import json
+from typing import Iterator
+from typing import List
+
+from host import models
+from rest_framework import serializers
+
+from . import datamodel
+from .components import data_model_components
+from .components import prefetch_science_objects
+
+EXPORT_FORMATS = ["csv", "parquet"]
+CONTENT_TYPES = {"csv": "text/csv", "parquet": "application/vnd.apache.parquet"}
+BATCH_SIZE = 200
+
+
+def export_transients(
+    names: List[str] = None,
+    redshift_gte: float = None,
+    redshift_lte: float = None,
+    processing_status: str = None,
+):
+    """
+    Selects the transients to export. Without any selection all transients are
+    exported.
+
+    parameters:
+        names (List[str], optional): names of the transients.
+        redshift_gte (float, optional): minimum transient redshift.
+        redshift_lte (float, optional): maximum transient redshift.
+        processing_status (str, optional): processing status of the transients,
+            "processing", "blocked" or "completed".
+    returns:
+        transients (QuerySet): the selected transients.
+    """
+    transients = models.Transient.objects.all()
+    if names:
+        transients = transients.filter(name__in=names)
+    if redshift_gte is not None:
+        transients = transients.filter(redshift__gte=redshift_gte)
+    if redshift_lte is not None:
+        transients = transients.filter(redshift__lte=redshift_lte)
+    if processing_status:
+        transients = transients.filter(processing_status=processing_status)
+    return transients
+
+
+def parse_export_request(params) -> dict:
+    """
+    Reads the transient selection and file format of an export request.
+
+    parameters:
+        params (QueryDict or dict): query parameters or request body, with the
+            optional keys name (repeated or comma separated), redshift_gte,
+            redshift_lte, processing_status and file_format.
+    returns:
+        export_request (dict): keyword arguments of export_transients and the
+            file_format.
+    raises:
+        ValueError: if a redshift is not a number or the format is unknown.
+    """
+    names = params.getlist("name") if hasattr(params, "getlist") else params.get("name")
+    if isinstance(names, str):
+        names = [names]
+    names = [name for value in names or [] for name in value.split(",") if name]
+
+    redshifts = {}
+    for key in ["redshift_gte", "redshift_lte"]:
+        value = params.get(key)
+        if value not in (None, ""):
+            try:
+                redshifts[key] = float(value)
+            except (TypeError, ValueError):
+                raise ValueError(f"{key} must be a number, got {value}")
+
+    file_format = params.get("file_format") or "csv"
+    if file_format not in EXPORT_FORMATS:
+        raise ValueError(
+            f"file_format must be one of {', '.join(EXPORT_FORMATS)}, got {file_format}"
+        )
+
+    return {
+        "names": names,
+        "processing_status": params.get("processing_status") or None,
+        "file_format": file_format,
+        **redshifts,
+    }
+
+
+def payload_components() -> List[datamodel.DataModelComponent]:
+    """
+    Components of the science payload. The objects of the components are
+    prefetched for each batch, so only their prefixes and serializers are used
+    and they are built once for all transients.
+    """
+    component_groups = [
+        component_group(None) for component_group in data_model_components
+    ]
+    return datamodel.unpack_component_groups(component_groups)
+
+
+def payload_columns(components: List[datamodel.DataModelComponent]) -> List[str]:
+    """Column names of the flat science payload, in payload order."""
+    return list(datamodel.serialize_blast_science_data(components, {}).keys())
+
+
+def iter_name_batches(transients, batch_size: int = BATCH_SIZE) -> Iterator[List[str]]:
+    """
+    Names of the transients in batches, using keyset pagination on the primary
+    key so each batch costs one indexed query however deep into the table it is.
+    """
+    transients = transients.order_by("pk")
+    last_pk = None
+    while True:
+        batch = transients if last_pk is None else transients.filter(pk__gt=last_pk)
+        batch = list(batch.values_list("pk", "name")[:batch_size])
+        if not batch:
+            return
+        yield [name for _, name in batch]
+        last_pk = batch[-1][0]
+
+
+def iter_payload_batches(
+    transients, components, batch_size: int = BATCH_SIZE
+) -> Iterator[List[dict]]:
+    """Flat science payloads of the transients, one list per batch."""
+    for names in iter_name_batches(transients, batch_size):
+        objects = prefetch_science_objects(names)
+        # skip transients deleted since their batch was read
+        yield [
+            datamodel.serialize_blast_science_data(components, objects[name])
+            for name in names
+            if name in objects
+        ]
+
+
+def _cell(value):
+    """Nested payload values, e.g. the cutout of an aperture, as JSON."""
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return json.dumps(value)
+
+
+class _StreamBuffer(io.RawIOBase):
+    """Write-only file that hands back what was written since the last pop."""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def pop(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def iter_csv(transients, batch_size: int = BATCH_SIZE) -> Iterator[bytes]:
+    """The payloads as CSV, one chunk per batch."""
+    components = payload_components()
+    text = io.StringIO()
+    writer = csv.DictWriter(text, fieldnames=payload_columns(components))
+    writer.writeheader()
+    for payloads in iter_payload_batches(transients, components, batch_size):
+        writer.writerows(
+            {column: _cell(value) for column, value in payload.items()}
+            for payload in payloads
+        )
+        yield text.getvalue().encode()
+        text.seek(0)
+        text.truncate()
+    yield text.getvalue().encode()
+
+
+def _arrow_type(field):
+    import pyarrow as pa
+
+    if isinstance(field, serializers.BooleanField):
+        return pa.bool_()
+    if isinstance(field, serializers.IntegerField):
+        return pa.int64()
+    if isinstance(field, serializers.FloatField):
+        return pa.float64()
+    return pa.string()
+
+
+def parquet_schema(components: List[datamodel.DataModelComponent]):
+    """Arrow schema of the payload, typed from the component serializers."""
+    import pyarrow as pa
+
+    return pa.schema(
+        [
+            pa.field(component.prefix + name, _arrow_type(field))
+            for component in components
+            for name, field in component.serializer().fields.items()
+        ]
+    )
+
+
+def iter_parquet(transients, batch_size: int = BATCH_SIZE) -> Iterator[bytes]:
+    """The payloads as a Parquet file, with one row group per batch."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    components = payload_components()
+    schema = parquet_schema(components)
+    string_columns = [field.name for field in schema if pa.types.is_string(field.type)]
+    buffer = _StreamBuffer()
+    with pq.ParquetWriter(buffer, schema) as writer:
+        for payloads in iter_payload_batches(transients, components, batch_size):
+            columns = {column: [] for column in schema.names}
+            for payload in payloads:
+                for column, value in payload.items():
+                    columns[column].append(value)
+            for column in string_columns:
+                columns[column] = [
+                    None if value is None else str(_cell(value))
+                    for value in columns[column]
+                ]
+            writer.write_table(pa.table(columns, schema=schema))
+            yield buffer.pop()
+    yield buffer.pop()
+
+
+def iter_export(transients, file_format: str = "csv", batch_size: int = BATCH_SIZE):
+    """
+    Streams the science payloads of transients.
+
+    parameters:
+        transients (QuerySet): transients to export, see export_transients.
+        file_format (str): "csv" or "parquet".
+        batch_size (int): number of transients fetched and written at a time.
+    returns:
+        chunks (Iterator[bytes]): the export file, chunk by chunk.
+    raises:
+        ValueError: if the format is parquet and pyarrow is not installed.
+    """
+    if file_format == "parquet":
+        # check before streaming starts, when an error can still be returned
+        try:
+            import pyarrow
+        except ImportError:
+            raise ValueError("Parquet export needs pyarrow to be installed")
+        return iter_parquet(transients, batch_size)
+    return iter_csv(transients, batch_size)
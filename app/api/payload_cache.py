@@ -0,0 +1,70 @@
+"""
+Cache of the science payloads served by the API.
+
+Payloads are cached under the transient and the version of its payload (see
+host.models.SciencePayloadVersion), which is bumped whenever data in the
+payload is written. A payload is therefore never served once it is out of
+date, whichever process wrote the data, and entries of old versions expire on
+their own. The version also makes the ETag of the payload, so clients polling
+with If-None-Match get a 304 response after a single query.
+"""
+from typing import Callable
+from typing import Optional
+from typing import Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.http import parse_etags
+from host.models import Transient
+
+
+def payload_version(transient_name: str) -> Optional[Tuple[int, Optional[int]]]:
+    """
+    Looks up the payload version of a transient.
+
+    parameters:
+        transient_name (str): name of the transient.
+    returns:
+        version (Tuple[int, int] or None): primary key of the transient and the
+            version of its payload, None if the transient does not exist. The
+            version is None if the transient has no version yet.
+    """
+    return (
+        Transient.objects.filter(name__exact=transient_name)
+        .values_list("pk", "payload_version__version")
+        .first()
+    )
+
+
+def payload_etag(transient_id: int, version: int, renderer_format: str) -> str:
+    """Strong ETag of a payload version in one of the API formats."""
+    return f'"{transient_id}-{version}-{renderer_format}"'
+
+
+def etag_matches(etag: str, if_none_match: Optional[str]) -> bool:
+    """Whether an If-None-Match header matches the ETag, by weak comparison."""
+    etags = parse_etags(if_none_match or "")
+    return "*" in etags or etag in [tag.removeprefix("W/") for tag in etags]
+
+
+def cached_payload(transient_id: int, version: int, build: Callable[[], dict]) -> dict:
+    """
+    Gets the payload of a transient from the cache, building and caching it if
+    it is not there.
+
+    parameters:
+        transient_id (int): primary key of the transient.
+        version (int): version of the payload, nothing is cached if None.
+        build (Callable[[], dict]): builds the payload.
+    returns:
+        payload (dict): the science payload.
+    """
+    if version is None:
+        return build()
+
+    key = f"science_payload:{transient_id}:{version}"
+    payload = cache.get(key)
+    if payload is None:
+        payload = build()
+        cache.set(key, payload, settings.SCIENCE_PAYLOAD_CACHE_SECONDS)
+    return payload
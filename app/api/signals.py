@@ -0,0 +1,73 @@
+"""
+Signal receivers that bump the science payload version of a transient whenever
+data in its payload is saved or deleted, which invalidates its cached payload
+and ETag (see api.payload_cache).
+"""
+from django.db.models.signals import m2m_changed
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from host.models import Aperture
+from host.models import AperturePhotometry
+from host.models import Cutout
+from host.models import Filter
+from host.models import Host
+from host.models import SciencePayloadVersion
+from host.models import SEDFittingResult
+from host.models import TaskRegister
+from host.models import Transient
+
+# models in the payload that belong to a single transient
+TRANSIENT_PAYLOAD_MODELS = [
+    Aperture,
+    AperturePhotometry,
+    Cutout,
+    SEDFittingResult,
+    TaskRegister,
+]
+
+
+@receiver(post_save, sender=Transient)
+def transient_saved(sender, instance, created, raw=False, **kwargs):
+    # raw saves load fixtures, possibly before the payload versions exist
+    if raw:
+        return
+    if created:
+        SciencePayloadVersion.objects.get_or_create(transient=instance)
+    else:
+        SciencePayloadVersion.bump([instance.pk])
+
+
+@receiver(post_save, sender=Host)
+@receiver(post_delete, sender=Host)
+def host_changed(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    SciencePayloadVersion.bump(Transient.objects.filter(host=instance).values("pk"))
+
+
+@receiver(post_save, sender=Filter)
+@receiver(post_delete, sender=Filter)
+def filter_changed(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    # the photometry columns of every payload follow the filters
+    SciencePayloadVersion.bump_all()
+
+
+def transient_data_changed(sender, instance, raw=False, **kwargs):
+    if not raw and instance.transient_id is not None:
+        SciencePayloadVersion.bump([instance.transient_id])
+
+
+for model in TRANSIENT_PAYLOAD_MODELS:
+    post_save.connect(transient_data_changed, sender=model)
+    post_delete.connect(transient_data_changed, sender=model)
+
+
+@receiver(m2m_changed, sender=SEDFittingResult.logsfh.through)
+def star_formation_history_changed(sender, instance, action, **kwargs):
+    # instance is the SED fitting result or the star formation history result,
+    # both belong to the transient
+    if action in ("post_add", "post_remove", "post_clear"):
+        SciencePayloadVersion.bump([instance.transient_id])
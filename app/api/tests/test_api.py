@@ -1,12 +1,22 @@
+import csv
+import io
 import json
 
+from django.core.cache import cache
 from django.test import TestCase
+from host.models import AperturePhotometry
+from host.models import SciencePayloadVersion
+from host.models import Transient
 from rest_framework.test import APIClient
 
 
 class APITest(TestCase):
     fixtures = ["../fixtures/test/test_transient_data.yaml"]
 
+    def setUp(self):
+        # cached payloads outlive the test database transactions
+        cache.clear()
+
     def test_transient_get(self):
         client = APIClient()
         request = client.get("/api/transient/get/2022testone?format=json")
@@ -75,6 +85,68 @@ class APITest(TestCase):
 
         self.assertTrue(request.status_code == 200)
 
+    def test_transient_get_etag(self):
+        client = APIClient()
+        url = "/api/transient/get/2022testone?format=json"
+        request = client.get(url)
+        etag = request["ETag"]
+        self.assertTrue(request.status_code == 200)
+
+        request = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertTrue(request.status_code == 304)
+        self.assertTrue(request["ETag"] == etag)
+        self.assertTrue(request.content == b"")
+
+        # new results invalidate the cached payload and its etag
+        photometry = AperturePhotometry.objects.get(
+            transient__name="2022testone",
+            aperture__type="local",
+            filter__name="2MASS_H",
+        )
+        photometry.flux = 1.5
+        photometry.save()
+
+        request = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        data = json.loads(request.content)
+        self.assertTrue(request.status_code == 200)
+        self.assertTrue(request["ETag"] != etag)
+        self.assertTrue(data["local_aperture_2MASS_H_flux"] == 1.5)
+
+    def test_transient_export(self):
+        client = APIClient()
+        response = client.get(
+            "/api/transient/export?name=2022testone,notInDatabase&file_format=csv"
+        )
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue(response["Content-Type"] == "text/csv")
+
+        content = b"".join(response.streaming_content).decode()
+        rows = list(csv.DictReader(io.StringIO(content)))
+        self.assertTrue(len(rows) == 1)
+        self.assertTrue(rows[0]["transient_name"] == "2022testone")
+        self.assertTrue(float(rows[0]["local_aperture_2MASS_H_flux"]) == 2183.8)
+        self.assertTrue(float(rows[0]["global_aperture_host_log_mass_50"]) == 2.0)
+
+        payload = json.loads(
+            client.get("/api/transient/get/2022testone?format=json").content
+        )
+        self.assertTrue(list(rows[0].keys()) == list(payload.keys()))
+
+    def test_transient_export_selection(self):
+        client = APIClient()
+        response = client.post(
+            "/api/transient/export",
+            {"name": ["2022testone"], "redshift_gte": 10.0},
+            format="json",
+        )
+        content = b"".join(response.streaming_content).decode()
+        self.assertTrue(len(list(csv.DictReader(io.StringIO(content)))) == 0)
+
+        response = client.get("/api/transient/export?redshift_gte=low")
+        self.assertTrue(response.status_code == 400)
+        response = client.get("/api/transient/export?file_format=xlsx")
+        self.assertTrue(response.status_code == 400)
+
     def test_transient_post(self):
         client = APIClient()
         request = client.post("/api/transient/post/name=2022testnew&ra=-1.0&dec=-5.0")
@@ -85,6 +157,51 @@ class APITest(TestCase):
             == "transient successfully posted: 2022testnew: ra = -1.0, dec= -5.0"
         )
 
+    def test_transient_batch_post(self):
+        client = APIClient()
+        transients = [
+            {"name": "2022batchone", "ra": 10.5, "dec": -5.0, "redshift": 0.02},
+            {"name": "2022testone", "ra": 121.6, "dec": 1.03},
+            {"name": "2022batchone", "ra": 11.0, "dec": -5.0},
+            {"name": "2022batchtwo", "ra": 10.5, "dec": 95.0},
+            {"name": "2022batchthree", "ra": "-*1.0", "dec": -5.0},
+            {"ra": 10.5, "dec": -5.0},
+        ]
+        with self.captureOnCommitCallbacks() as callbacks:
+            request = client.post(
+                "/api/transient/post/batch", {"transients": transients}, format="json"
+            )
+        data = json.loads(request.content)
+
+        self.assertTrue(request.status_code == 201)
+        self.assertTrue(len(callbacks) == 1)
+        statuses = [transient["status"] for transient in data["transients"]]
+        self.assertTrue(
+            statuses
+            == ["created", "exists", "duplicate", "invalid", "invalid", "invalid"]
+        )
+        self.assertTrue(data["created"] == 1 and data["invalid"] == 3)
+
+        transient = Transient.objects.get(name="2022batchone")
+        self.assertTrue(transient.ra_deg == 10.5 and transient.redshift == 0.02)
+        self.assertTrue(
+            SciencePayloadVersion.objects.filter(transient=transient).exists()
+        )
+
+    def test_transient_batch_post_csv(self):
+        client = APIClient()
+        with self.captureOnCommitCallbacks():
+            request = client.post(
+                "/api/transient/post/batch",
+                "name,ra,dec,redshift\n2022csvone,10.5,-5.0,None\n2022testone,1,1,\n",
+                content_type="text/csv",
+            )
+        data = json.loads(request.content)
+
+        self.assertTrue(request.status_code == 201)
+        self.assertTrue(data["created"] == 1 and data["exists"] == 1)
+        self.assertTrue(Transient.objects.get(name="2022csvone").redshift is None)
+
     def test_transient_bad_post(self):
         client = APIClient()
         request = client.post("/api/transient/post/name=2022new&ra=-*1.0&dec=-5.0")
@@ -111,3 +228,25 @@ class APITest(TestCase):
         data = json.loads(request.content)
         self.assertTrue(request.status_code == 404)
         self.assertTrue(data["message"] == "2022NotInDatabase not in database")
+
+    def test_cone_search(self):
+        Transient.objects.create(
+            name="2024conenear", ra_deg=50.0, dec_deg=-20.0, tns_id=1, tns_prefix="SN"
+        )
+        Transient.objects.create(
+            name="2024conefar", ra_deg=50.0, dec_deg=-21.0, tns_id=2, tns_prefix="SN"
+        )
+        client = APIClient()
+        request = client.get("/api/cone?ra=50.0&dec=-19.9999&radius=0.01")
+        data = json.loads(request.content)
+        self.assertTrue(request.status_code == 200)
+        self.assertTrue([t["name"] for t in data["transients"]] == ["2024conenear"])
+        self.assertTrue(abs(data["transients"][0]["separation_arcsec"] - 0.36) < 1e-3)
+        self.assertTrue(data["hosts"] == [])
+
+        request = client.get("/api/cone?ra=50.0&dec=-20.0&radius=10")
+        self.assertTrue(request.status_code == 400)
+        request = client.get("/api/cone?ra=50.0&dec=-20.0&radius=wide")
+        self.assertTrue(request.status_code == 400)
+        request = client.get("/api/cone?ra=50.0&dec=-95.0&radius=0.1")
+        self.assertTrue(request.status_code == 400)
@@ -3,12 +3,14 @@ from typing import List
 
 from django.test import TestCase
 from host import models
+from rest_framework.renderers import JSONRenderer
 
 from .. import serializers
 from ..components import aperture_component
 from ..components import data_model_components
 from ..components import host_component
 from ..components import photometry_component
+from ..components import prefetch_component_objects
 from ..components import sed_fit_component
 from ..components import transient_component
 from ..datamodel import DataModelComponent
@@ -101,6 +103,34 @@ class DatamodelConstructionTest(TestCase):
         self.assertTrue(data["global_aperture_host_log_age_50"] == 0.1)
         self.assertTrue(data["global_aperture_host_log_age_84"] == 5.0)
 
+    def test_prefetched_datamodel_build(self):
+        component_groups = [
+            component_group("2022testone") for component_group in data_model_components
+        ]
+        components = unpack_component_groups(component_groups)
+        data = serialize_blast_science_data(components)
+
+        # transient, apertures, photometry, SED results and their SFHs,
+        # however many filters there are
+        with self.assertNumQueries(5):
+            objects = prefetch_component_objects("2022testone")
+            prefetched_data = serialize_blast_science_data(components, objects)
+        self.assertTrue(
+            JSONRenderer().render(prefetched_data) == JSONRenderer().render(data)
+        )
+
+    def test_prefetched_datamodel_build_without_data(self):
+        components = unpack_component_groups(
+            [
+                component_group("thisTransientDoesNotExist")
+                for component_group in data_model_components
+            ]
+        )
+        objects = prefetch_component_objects("thisTransientDoesNotExist")
+        data = serialize_blast_science_data(components, objects)
+        self.assertTrue(data["transient_name"] is None)
+        self.assertTrue(data["host_name"] is None)
+
 
 class DataModelComponentTests(TestCase):
     def test_all_datamodel_components_output_type(self):
@@ -13,6 +13,14 @@ urlpatterns = [
         f"""{base_path}transient/get/<str:transient_name>""",
         views.get_transient_science_payload,
     ),
+    path(
+        f"""{base_path}transient/export""",
+        views.export_science_payloads,
+    ),
+    path(
+        f"""{base_path}cone""",
+        views.cone_search,
+    ),
     # TO DO: Secure this endpoint with Django REST Framework permission_classes
     # path(
     #     f"""{base_path}workflow/<str:transient_name>""",
@@ -27,3 +35,9 @@ if os.environ.get("ALLOW_API_POST") == "YES":
             views.post_transient,
         )
     )
+    urlpatterns.append(
+        path(
+            f"""{base_path}transient/post/batch""",
+            views.post_transients,
+        )
+    )
@@ -2,9 +2,14 @@ import itertools
 
 import django_filters
 from astropy.coordinates import SkyCoord
+from django.http import StreamingHttpResponse
 from django_filters.rest_framework import DjangoFilterBackend
+from host import sky_index
 from host.models import *
 from host.models import Transient
+from host.transient_submission import read_submission_csv
+from host.transient_submission import submit_transients
+from host.transient_submission import summarize_submission
 from rest_framework import generics
 from rest_framework import status
 from rest_framework import viewsets
@@ -13,8 +18,15 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 
 from . import datamodel
+from . import export
+from . import payload_cache
 from . import serializers
 from .components import data_model_components
+from .components import prefetch_component_objects
+
+
+# largest radius of a cone search in degrees
+CONE_SEARCH_MAX_RADIUS_DEG = 5.0
 
 
 ### Filter Sets ###
@@ -194,20 +206,122 @@ def ra_dec_valid(ra: str, dec: str) -> bool:
     return valid
 
 
+def build_transient_science_payload(transient_name: str) -> dict:
+    """
+    Builds the science payload of a transient from the database.
+
+    Parameters:
+        transient_name (str): transient_name.
+    Returns:
+        data (dict): flat science payload.
+    """
+    component_groups = [
+        component_group(transient_name) for component_group in data_model_components
+    ]
+    components = datamodel.unpack_component_groups(component_groups)
+    objects = prefetch_component_objects(transient_name)
+    return datamodel.serialize_blast_science_data(components, objects)
+
+
+@api_view(["GET"])
+def cone_search(request):
+    ra = request.query_params.get("ra")
+    dec = request.query_params.get("dec")
+    radius_text = request.query_params.get("radius")
+    if not ra_dec_valid(ra, dec):
+        return Response(
+            {"message": f"bad ra and dec: ra={ra}, dec={dec}"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    try:
+        radius = float(radius_text)
+    except (TypeError, ValueError):
+        radius = None
+    if radius is None or not 0 < radius <= CONE_SEARCH_MAX_RADIUS_DEG:
+        return Response(
+            {
+                "message": "radius must be a number of degrees between 0 and "
+                f"{CONE_SEARCH_MAX_RADIUS_DEG}, got {radius_text}"
+            },
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    ra, dec = float(ra), float(dec)
+    transients = sky_index.cone_search(
+        Transient.objects.select_related("host"), ra, dec, radius
+    )
+    hosts = sky_index.cone_search(Host.objects.all(), ra, dec, radius)
+    data = {
+        "transients": [
+            {
+                "name": transient.name,
+                "ra_deg": transient.ra_deg,
+                "dec_deg": transient.dec_deg,
+                "redshift": transient.redshift,
+                "host_name": transient.host.name if transient.host else None,
+                "separation_arcsec": separation * 3600,
+            }
+            for transient, separation in transients
+        ],
+        "hosts": [
+            {
+                "name": host.name,
+                "ra_deg": host.ra_deg,
+                "dec_deg": host.dec_deg,
+                "redshift": host.redshift,
+                "separation_arcsec": separation * 3600,
+            }
+            for host, separation in hosts
+        ],
+    }
+    return Response(data, status=status.HTTP_200_OK)
+
+
 @api_view(["GET"])
 def get_transient_science_payload(request, transient_name):
-    if not transient_exists(transient_name):
+    version = payload_cache.payload_version(transient_name)
+    if version is None:
         return Response(
             {"message": f"{transient_name} not in database"},
             status=status.HTTP_404_NOT_FOUND,
         )
 
-    component_groups = [
-        component_group(transient_name) for component_group in data_model_components
-    ]
-    components = datamodel.unpack_component_groups(component_groups)
-    data = datamodel.serialize_blast_science_data(components)
-    return Response(data, status=status.HTTP_200_OK)
+    transient_id, payload_version = version
+    headers = {}
+    if payload_version is not None:
+        etag = payload_cache.payload_etag(
+            transient_id, payload_version, request.accepted_renderer.format
+        )
+        if payload_cache.etag_matches(etag, request.headers.get("If-None-Match")):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+        headers["ETag"] = etag
+
+    data = payload_cache.cached_payload(
+        transient_id,
+        payload_version,
+        lambda: build_transient_science_payload(transient_name),
+    )
+    return Response(data, status=status.HTTP_200_OK, headers=headers)
+
+
+@api_view(["GET", "POST"])
+def export_science_payloads(request):
+    params = request.data if request.method == "POST" else request.query_params
+    try:
+        export_request = export.parse_export_request(params)
+        file_format = export_request.pop("file_format")
+        transients = export.export_transients(**export_request)
+        chunks = export.iter_export(transients, file_format)
+    except ValueError as err:
+        return Response({"message": str(err)}, status=status.HTTP_400_BAD_REQUEST)
+
+    response = StreamingHttpResponse(
+        chunks, content_type=export.CONTENT_TYPES[file_format]
+    )
+    response[
+        "Content-Disposition"
+    ] = f'attachment; filename="blast_science_payloads.{file_format}"'
+    return response
 
 
 @api_view(["POST"])
@@ -239,6 +353,31 @@ def post_transient(request, transient_name, transient_ra, transient_dec):
     )
 
 
+@api_view(["POST"])
+def post_transients(request):
+    if request.content_type.startswith("text/csv"):
+        rows = read_submission_csv(request.body.decode())
+        retrigger = request.query_params.get("retrigger", "").lower() == "true"
+    else:
+        data = request.data
+        rows = data.get("transients") if isinstance(data, dict) else data
+        retrigger = isinstance(data, dict) and bool(data.get("retrigger"))
+    if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+        return Response(
+            {"message": "expected a list of transients with name, ra and dec"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    added_by = request.user if request.user.is_authenticated else None
+    report = submit_transients(rows, added_by=added_by, retrigger=retrigger)
+    summary = summarize_submission(report)
+    if summary.get("created"):
+        response_status = status.HTTP_201_CREATED
+    else:
+        response_status = status.HTTP_200_OK
+    return Response({**summary, "transients": report}, status=response_status)
+
+
 # TO DO: Secure this endpoint with Django REST Framework permission_classes
 # @api_view(["PUT"])
 # @permission_classes([IsAuthenticated])
@@ -157,10 +157,28 @@ MEDIA_ROOT = os.path.join(os.path.dirname(BASE_DIR), "data")
 
 DUSTMAPS_DATA_ROOT = os.environ.get("DUSTMAPS_DATA_ROOT", "/data/dustmaps")  # noqa
 CUTOUT_ROOT = os.environ.get("CUTOUT_ROOT", "/data/cutout_cdn")  # noqa
+FRAME_CACHE_ROOT = os.environ.get("FRAME_CACHE_ROOT", "/data/frame_cache")  # noqa
+# cached background and segmentation maps of the cutouts, next to them if empty
+CUTOUT_SIDECAR_ROOT = os.environ.get("CUTOUT_SIDECAR_ROOT", "")  # noqa
+FRAME_CACHE_MAX_BYTES = int(
+    os.environ.get("FRAME_CACHE_MAX_BYTES", str(20 * 1024**3))
+)  # noqa
 SED_OUTPUT_ROOT = os.environ.get("SED_OUTPUT_ROOT", "/data/sed_output")  # noqa
+# posterior predictive draws for the best-fit model and model percentiles
+SED_PREDICTIVE_DRAWS = int(os.environ.get("SED_PREDICTIVE_DRAWS", "100"))  # noqa
+# forked processes to compute the draws with, 1 computes them serially; must be 1
+# in celery prefork workers, whose daemonic processes cannot fork
+SED_PREDICTIVE_PROCESSES = int(os.environ.get("SED_PREDICTIVE_PROCESSES", "1"))  # noqa
 SBI_TRAINING_ROOT = os.environ.get(
     "SBI_TRAINING_ROOT", "/data/sbi_training_sets"
 )  # noqa
+# run host SED inference in micro-batches instead of one celery task per transient
+SED_BATCH_INFERENCE = os.environ.get("SED_BATCH_INFERENCE", "False") == "True"  # noqa
+SED_BATCH_SIZE = int(os.environ.get("SED_BATCH_SIZE", "16"))  # noqa
+# longest a queued SED inference waits for its batch to fill
+SED_BATCH_MAX_WAIT_SECONDS = int(
+    os.environ.get("SED_BATCH_MAX_WAIT_SECONDS", "120")
+)  # noqa
 GHOST_OUTPUT_ROOT = os.environ.get("GHOST_OUTPUT_ROOT", "/data/ghost_output")  # noqa
 GHOST_DATA_ROOT = os.environ.get("GHOST_DATA_ROOT", "/data/ghost_data")  # noqa
 GHOST_DUST_PATH = os.environ.get(
@@ -178,6 +196,21 @@ TRANSMISSION_CURVES_ROOT = os.environ.get(
 
 CUTOUT_OVERWRITE = os.environ.get("CUTOUT_OVERWRITE", "False")
 
+# cache of the science payloads served by the API, shared between processes
+# when CACHE_REDIS_URL is set and local to each process otherwise
+if os.environ.get("CACHE_REDIS_URL"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.environ["CACHE_REDIS_URL"],
+        }
+    }
+else:
+    CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+SCIENCE_PAYLOAD_CACHE_SECONDS = int(
+    os.environ.get("SCIENCE_PAYLOAD_CACHE_SECONDS", str(24 * 3600))
+)  # noqa
+
 CELERY_BEAT_SCHEDULER = "django_celery_beat.schedulers:DatabaseScheduler"
 CELERY_TIMEZONE = "UTC"
 
@@ -0,0 +1,119 @@
+"""
+Benchmark cone searches over a synthetic table of transients, comparing a
+full scan of the positions (as finding nearby transients used to require)
+with host.sky_index.cone_search over the indexed HEALPix pixels, and check
+that both find the same transients.
+
+The transients are written to a throwaway test database, which is destroyed
+at the end. Run from the app directory inside the blast container:
+
+    python benchmarks/benchmark_cone_search.py --n-transients 1000000 --nquery 100
+"""
+import argparse
+import os
+import sys
+import time
+
+import django
+import numpy as np
+from astropy import units as u
+from astropy.coordinates import angular_separation
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "app.settings")
+django.setup()
+
+from django.db import connection  # noqa: E402
+from host.models import SkyObject  # noqa: E402
+from host.models import Transient  # noqa: E402
+from host.sky_index import cone_search  # noqa: E402
+
+
+def random_positions(rng, n):
+    """Positions distributed uniformly over the sky."""
+    ra = rng.uniform(0.0, 360.0, size=n)
+    dec = np.degrees(np.arcsin(rng.uniform(-1.0, 1.0, size=n)))
+    return ra, dec
+
+
+def fill_transients(n_transients, batch_size=20000):
+    rng = np.random.default_rng(42)
+    for start in range(0, n_transients, batch_size):
+        ra, dec = random_positions(rng, min(batch_size, n_transients - start))
+        transients = [
+            Transient(
+                name=f"bench{start + i}",
+                ra_deg=float(ra[i]),
+                dec_deg=float(dec[i]),
+                tns_id=0,
+                tns_prefix="",
+            )
+            for i in range(len(ra))
+        ]
+        SkyObject.update_healpix_indices(transients)
+        Transient.objects.bulk_create(transients, batch_size=5000)
+
+
+def full_scan(ra_deg, dec_deg, radius_deg):
+    names, ra, dec = zip(*Transient.objects.values_list("name", "ra_deg", "dec_deg"))
+    separations = angular_separation(
+        np.array(ra) * u.deg, np.array(dec) * u.deg, ra_deg * u.deg, dec_deg * u.deg
+    ).to_value(u.deg)
+    return {names[i] for i in np.flatnonzero(separations <= radius_deg)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--n-transients", type=int, default=1000000)
+    parser.add_argument("--nquery", type=int, default=100)
+    parser.add_argument("--radius-arcsec", type=float, default=60.0)
+    args = parser.parse_args()
+    radius = args.radius_arcsec / 3600
+
+    old_database_name = connection.settings_dict["NAME"]
+    connection.creation.create_test_db(verbosity=0)
+    try:
+        start_time = time.monotonic()
+        fill_transients(args.n_transients)
+        fill_seconds = time.monotonic() - start_time
+
+        # centered on existing transients so every cone finds at least one
+        rng = np.random.default_rng(100)
+        centers = list(
+            Transient.objects.filter(
+                pk__in=rng.choice(args.n_transients, size=args.nquery) + 1
+            ).values_list("ra_deg", "dec_deg")
+        )
+
+        start_time = time.monotonic()
+        scan_matches = [full_scan(ra, dec, radius) for ra, dec in centers]
+        scan_seconds = time.monotonic() - start_time
+
+        start_time = time.monotonic()
+        index_matches = [
+            {
+                transient.name
+                for transient, _ in cone_search(
+                    Transient.objects.only("name", "ra_deg", "dec_deg"),
+                    ra,
+                    dec,
+                    radius,
+                )
+            }
+            for ra, dec in centers
+        ]
+        index_seconds = time.monotonic() - start_time
+    finally:
+        connection.creation.destroy_test_db(old_database_name, verbosity=0)
+
+    assert scan_matches == index_matches
+    nmatches = sum(len(matches) for matches in index_matches) / len(centers)
+    print(f"table: {args.n_transients} transients, filled in {fill_seconds:.1f} s")
+    print(f"cones of {args.radius_arcsec} arcsec: {nmatches:.1f} matches per cone")
+    print(f"full scan: {1e3 * scan_seconds / len(centers):.1f} ms per query")
+    print(f"HEALPix index: {1e3 * index_seconds / len(centers):.2f} ms per query")
+    print(f"speed-up: {scan_seconds / index_seconds:.0f}x, identical matches")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Benchmark the resident memory of loading cutouts and subtracting their
+backgrounds, comparing the previous approach (fits.open without closing the
+file and a float64 background-subtracted copy) with host_utils.open_image
+and host_utils.subtract_background, with a new float32 buffer per image and
+with one float32 buffer reused for all images as the batch photometry does.
+
+Every approach runs in a fresh process. The memory is read from
+/proc/self/status and split into anonymous pages (copies of the data) and
+file-backed pages (memory-mapped fits files, which the kernel can drop and
+read again). tracemalloc only sees the allocations of Python and numpy, not
+the pages of memory-mapped files.
+
+Run from the app directory inside the blast container:
+
+    python benchmarks/benchmark_fits_memory.py --n-images 20 --size 2048
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+from types import SimpleNamespace
+
+import django
+import numpy as np
+from astropy.io import fits
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "app.settings")
+django.setup()
+
+from host.host_utils import open_image  # noqa: E402
+from host.host_utils import subtract_background  # noqa: E402
+
+
+def memory_mib():
+    """Resident, anonymous and file-backed memory of this process in MiB."""
+    memory = {}
+    with open("/proc/self/status") as status:
+        for line in status:
+            field, value = line.split(":", 1)
+            if field in ("VmRSS", "RssAnon", "RssFile"):
+                memory[field] = int(value.split()[0]) / 1024
+    return memory
+
+
+def make_images(directory, n_images, size):
+    rng = np.random.default_rng(42)
+    paths = []
+    for i in range(n_images):
+        data = rng.normal(100.0, 5.0, size=(size, size)).astype(np.float32)
+        path = os.path.join(directory, f"image_{i}.fits")
+        fits.writeto(path, data, overwrite=True)
+        paths.append(path)
+    return paths
+
+
+def legacy_photometry_stage(path, background, buffers):
+    image = fits.open(path)
+    image_data = image[0].data
+    background_subtracted_data = image_data - background.background
+    return image, background_subtracted_data
+
+
+def photometry_stage(path, background, buffers):
+    with open_image(path) as image:
+        background_subtracted_data = subtract_background(image[0].data, background)
+        return None, background_subtracted_data
+
+
+def reused_buffer_photometry_stage(path, background, buffers):
+    with open_image(path) as image:
+        shape = np.shape(image[0].data)
+        if shape not in buffers:
+            buffers[shape] = np.empty(shape, dtype=np.float32)
+        background_subtracted_data = subtract_background(
+            image[0].data, background, out=buffers[shape]
+        )
+        return None, background_subtracted_data
+
+
+def measure(stage, paths, background, results):
+    start = memory_mib()
+    # the legacy stage leaves its files open, so keep the references alive
+    # for the whole run as a worker processing many transients would
+    open_images, sums, buffers = [], [], {}
+    for path in paths:
+        image, background_subtracted_data = stage(path, background, buffers)
+        open_images.append(image)
+        sums.append(float(background_subtracted_data.sum()))
+    end = memory_mib()
+    # ru_maxrss is in KiB on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    results.put(
+        {
+            "peak": peak - start["VmRSS"],
+            "anon": end["RssAnon"] - start["RssAnon"],
+            "file": end["RssFile"] - start["RssFile"],
+        }
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--n-images", type=int, default=20)
+    parser.add_argument("--size", type=int, default=2048)
+    args = parser.parse_args()
+
+    background = SimpleNamespace(
+        background=np.full((args.size, args.size), 100.0),
+    )
+
+    context = multiprocessing.get_context("fork")
+    with tempfile.TemporaryDirectory() as directory:
+        paths = make_images(directory, args.n_images, args.size)
+        for label, stage in [
+            ("fits.open + float64 copy", legacy_photometry_stage),
+            ("open_image + float32 copy", photometry_stage),
+            ("open_image + reused float32", reused_buffer_photometry_stage),
+        ]:
+            results = context.Queue()
+            process = context.Process(
+                target=measure, args=(stage, paths, background, results)
+            )
+            process.start()
+            memory = results.get()
+            process.join()
+            print(
+                f"{label:30s} peak RSS +{memory['peak']:8.1f} MiB, "
+                f"retained anonymous +{memory['anon']:8.1f} MiB, "
+                f"file-backed +{memory['file']:8.1f} MiB"
+            )
+
+
+if __name__ == "__main__":
+    main()
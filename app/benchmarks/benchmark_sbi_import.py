@@ -0,0 +1,98 @@
+"""
+Benchmark the cold import of host.SBI.run_sbi_blast and the memory of the
+worker processes that import it. The training sets are memory-mapped, so
+their pages are shared between the workers: compare the resident set size
+(RSS) of each worker with its proportional set size (PSS), which splits the
+shared pages between the processes mapping them.
+
+Run from the app directory inside the blast container, with the SBI training
+sets available:
+
+    python benchmarks/benchmark_sbi_import.py --workers 4
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def memory_mb():
+    """RSS and PSS of this process in MB."""
+    memory = {}
+    with open("/proc/self/smaps_rollup") as handle:
+        for line in handle:
+            field, value = line.split(":", 1)
+            if field in ("Rss", "Pss"):
+                memory[field.lower()] = int(value.split()[0]) / 1024
+    return memory
+
+
+def worker(barrier, results, load_posterior):
+    sys.path.insert(0, APP_DIR)
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "app.settings")
+    import django
+
+    django.setup()
+
+    start_time = time.monotonic()
+    from host.SBI import run_sbi_blast
+
+    result = {"import_seconds": time.monotonic() - start_time}
+    # touch the training sets as the nearest neighbour searches do
+    for x_train, y_train in run_sbi_blast.training_sets.values():
+        x_train.sum(), y_train.sum()
+
+    if load_posterior:
+        start_time = time.monotonic()
+        run_sbi_blast.posterior("global")
+        result["posterior_seconds"] = time.monotonic() - start_time
+
+    # measure once every worker has mapped the training sets
+    barrier.wait()
+    result.update(memory_mb())
+    results.put(result)
+    barrier.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument(
+        "--load-posterior",
+        action="store_true",
+        help="also load the flow weights, as the first SED task of a worker does",
+    )
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    barrier = context.Barrier(args.workers)
+    results = context.Queue()
+    processes = [
+        context.Process(target=worker, args=(barrier, results, args.load_posterior))
+        for _ in range(args.workers)
+    ]
+    for process in processes:
+        process.start()
+    worker_results = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    for i, result in enumerate(worker_results):
+        line = (
+            f"worker {i}: cold import {result['import_seconds']:.2f} s, "
+            f"RSS {result['rss']:.0f} MB, PSS {result['pss']:.0f} MB"
+        )
+        if "posterior_seconds" in result:
+            line += f", posterior loaded in {result['posterior_seconds']:.2f} s"
+        print(line)
+    print(
+        f"total RSS {sum(result['rss'] for result in worker_results):.0f} MB, "
+        f"total PSS {sum(result['pss'] for result in worker_results):.0f} MB"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Benchmark the Monte Carlo stage of SBI++, comparing one posterior sampling
+call per realisation (as sbi_mcnoise, sbi_missingband and
+sbi_missing_and_noisy used to do) with the batched sampling in
+host.SBI.sbi_pp.sample_posterior_batched.
+
+Run from the app directory inside the blast container, with the SBI training
+sets available:
+
+    python benchmarks/benchmark_sbi_mc.py --nmc 50 --nposterior 50
+"""
+import argparse
+import os
+import sys
+import time
+
+import django
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "app.settings")
+django.setup()
+
+import torch  # noqa: E402
+from host.SBI import run_sbi_blast  # noqa: E402
+from host.SBI import sbi_pp  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--nmc", type=int, default=50)
+    parser.add_argument("--nposterior", type=int, default=50)
+    parser.add_argument("--fit-type", choices=["global", "local"], default="global")
+    args = parser.parse_args()
+
+    hatp_x_y = run_sbi_blast.posterior(args.fit_type)
+    y_train = getattr(run_sbi_blast, f"y_train_{args.fit_type}")
+
+    # monte carlo realisations drawn from training set neighbours
+    rng = np.random.default_rng(100)
+    xs = y_train[rng.choice(len(y_train), size=args.nmc)]
+
+    start_time = time.monotonic()
+    loop_theta = []
+    for x in xs:
+        theta = hatp_x_y.sample(
+            (args.nposterior,),
+            x=torch.as_tensor(x.astype(np.float32)).to(sbi_pp.device),
+            show_progress_bars=False,
+        )
+        loop_theta.append(theta.detach().numpy())
+    loop_seconds = time.monotonic() - start_time
+
+    start_time = time.monotonic()
+    batched_theta = sbi_pp.sample_posterior_batched(hatp_x_y, xs, args.nposterior)
+    batched_seconds = time.monotonic() - start_time
+
+    loop_theta = np.concatenate(loop_theta)
+    batched_theta = np.concatenate(batched_theta)
+    print(f"one call per realisation: {loop_seconds:.2f} s")
+    print(
+        f"batched: {batched_seconds:.2f} s "
+        f"({loop_seconds / batched_seconds:.1f}x faster)"
+    )
+    # both are draws from the same mixture of posteriors
+    ks = [
+        sbi_pp.stats.ks_2samp(loop_theta[:, i], batched_theta[:, i]).pvalue
+        for i in range(loop_theta.shape[1])
+    ]
+    print(f"smallest per-parameter KS p-value: {np.min(ks):.3f}")
+
+
+if __name__ == "__main__":
+    main()
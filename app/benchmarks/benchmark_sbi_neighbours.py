@@ -0,0 +1,90 @@
+"""
+Benchmark the nearest neighbour searches of SBI++, comparing the brute force
+search that widens the chi^2 threshold step by step over the whole training
+set (as sbi_pp used to do) with host.SBI.nn_index.TrainingSetIndex, and check
+that both select the same neighbours.
+
+Run from the app directory inside the blast container, with the SBI training
+sets available:
+
+    python benchmarks/benchmark_sbi_neighbours.py --nquery 100 --k 200
+"""
+import argparse
+import os
+import sys
+import time
+
+import django
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "app.settings")
+django.setup()
+
+from host.SBI import run_sbi_blast  # noqa: E402
+from host.SBI.nn_index import chi2dof  # noqa: E402
+from host.SBI.nn_index import TrainingSetIndex  # noqa: E402
+
+
+def brute_force(y_train, bands, obsphot, obsphot_unc, k, ini_chi2, max_chi2):
+    chi2_nei = chi2dof(mags=y_train[:, bands], obsphot=obsphot, obsphot_unc=obsphot_unc)
+    _chi2_thres = ini_chi2 * 1
+    while _chi2_thres <= max_chi2:
+        idx_chi2_selected = np.where(chi2_nei <= _chi2_thres)[0]
+        if len(idx_chi2_selected) >= k:
+            return idx_chi2_selected
+        _chi2_thres += 5
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--nquery", type=int, default=100)
+    parser.add_argument("--k", type=int, default=200)
+    parser.add_argument("--fit-type", choices=["global", "local"], default="global")
+    args = parser.parse_args()
+
+    ini_chi2 = run_sbi_blast.run_params["ini_chi2"]
+    max_chi2 = run_sbi_blast.run_params["max_chi2"]
+    y_train = getattr(run_sbi_blast, f"y_train_{args.fit_type}")
+
+    start_time = time.monotonic()
+    index = TrainingSetIndex(y_train)
+    build_seconds = time.monotonic() - start_time
+
+    # perturbed training set SEDs with a random set of missing bands
+    rng = np.random.default_rng(100)
+    queries = []
+    for row in rng.choice(len(y_train), size=args.nquery):
+        sig_obs = np.abs(y_train[row, 22:44]) + 0.05
+        y_obs = y_train[row, :22] + rng.normal(scale=sig_obs)
+        bands = np.sort(rng.choice(22, size=rng.integers(5, 23), replace=False))
+        queries.append((bands, y_obs[bands], sig_obs[bands]))
+
+    start_time = time.monotonic()
+    brute_selected = [
+        brute_force(y_train, *query, args.k, ini_chi2, max_chi2) for query in queries
+    ]
+    brute_seconds = time.monotonic() - start_time
+
+    start_time = time.monotonic()
+    index_selected = [
+        index.within_chi2(*query, k=args.k, ini_chi2=ini_chi2, max_chi2=max_chi2)[0]
+        for query in queries
+    ]
+    index_seconds = time.monotonic() - start_time
+
+    for brute, indexed in zip(brute_selected, index_selected):
+        if brute is None or indexed is None:
+            assert brute is None and indexed is None
+        else:
+            assert np.array_equal(brute, indexed)
+
+    print(f"training set: {len(y_train)} SEDs, index built in {build_seconds:.2f} s")
+    print(f"brute force: {1e3 * brute_seconds / args.nquery:.2f} ms per query")
+    print(f"index: {1e3 * index_seconds / args.nquery:.2f} ms per query")
+    print(f"speed-up: {brute_seconds / index_seconds:.1f}x, identical neighbours")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Benchmark postprocess_prosp.getSFH on a large posterior chain, comparing the
+vectorized implementation with the previous per-sample loop.
+
+Run from the app directory inside the blast container:
+
+    python benchmarks/benchmark_sfh.py --n-samples 10000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+from prospect.models.transforms import logsfr_ratios_to_masses
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from host import postprocess_prosp as pp  # noqa: E402
+
+
+def getSFH_per_sample(chain, theta_index, zred, sfrtimes=[10, 30, 100], tbins=100):
+    """The previous implementation, looping over every sample."""
+    nsamples = chain.shape[0]
+    allsfhs = np.zeros((nsamples, 7))
+    allagebins = np.zeros((nsamples, 7, 2))
+    allMWA = np.zeros(nsamples)
+    for iteration in range(nsamples):
+        allagebins[iteration] = pp.z_to_agebins(zred=zred)
+        dt = 10 ** allagebins[iteration, :, 1] - 10 ** allagebins[iteration, :, 0]
+        masses = logsfr_ratios_to_masses(
+            logsfr_ratios=chain[iteration, theta_index["logsfr_ratios"]],
+            agebins=allagebins[iteration],
+            logmass=chain[iteration, theta_index["logmass"]][0],
+        )
+        allsfhs[iteration] = masses / dt
+        allMWA[iteration] = pp.get_mwa(allagebins[iteration], allsfhs[iteration])
+
+    allagebins_ago = 10**allagebins / 1e9
+    age_interp = np.logspace(1, np.log10(np.max(allagebins_ago * 1e9)), tbins) / 1e9
+    allsfhs_interp = np.zeros((nsamples, len(age_interp)))
+    allsfrs = np.zeros((nsamples, len(sfrtimes)))
+    for iteration in range(nsamples):
+        allsfhs_interp[iteration] = pp.stepInterp(
+            allagebins_ago[iteration], allsfhs[iteration], age_interp
+        )
+        for i, t in enumerate(sfrtimes):
+            allsfrs[iteration, i] = np.mean(
+                allsfhs_interp[iteration, (age_interp <= t * 1e-9)]
+            )
+    return age_interp, allsfhs_interp, allMWA, allsfrs, allsfhs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--n-samples", type=int, default=10000)
+    parser.add_argument("--zred", type=float, default=0.05)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    theta_index = pp.theta_index()
+    chain = np.zeros((args.n_samples, 18))
+    chain[:, theta_index["logmass"]] = rng.uniform(7, 12.5, (args.n_samples, 1))
+    chain[:, theta_index["logsfr_ratios"]] = rng.normal(0, 0.5, (args.n_samples, 6))
+
+    start_time = time.perf_counter()
+    expected = getSFH_per_sample(chain, theta_index, args.zred)
+    loop_seconds = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    result = pp.getSFH(chain, theta_index=theta_index, rtn_chains=True, zred=args.zred)
+    vectorized_seconds = time.perf_counter() - start_time
+
+    max_difference = max(
+        np.nanmax(np.abs(r - e) / np.maximum(np.abs(e), 1e-300))
+        for r, e in zip(result, expected)
+    )
+    print(f"{args.n_samples} samples")
+    print(f"per-sample loop: {loop_seconds:.3f} s")
+    print(f"vectorized:      {vectorized_seconds:.3f} s")
+    print(f"speed-up:        {loop_seconds / vectorized_seconds:.0f}x")
+    print(f"max relative difference: {max_difference:.2e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Benchmark the set-up time of the SED fitting model components, comparing a
+cold start (building FastStepBasis and the prospector model from scratch, as
+every SED task used to) with a warm start from host.sps_pool.
+
+Run from the app directory inside the blast container:
+
+    python benchmarks/benchmark_sps_pool.py --n-fits 5
+"""
+import argparse
+import os
+import sys
+import time
+
+import django
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "app.settings")
+django.setup()
+
+from host import sps_pool  # noqa: E402
+from host.prospector import build_model  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--n-fits", type=int, default=5)
+    args = parser.parse_args()
+
+    redshifts = np.linspace(0.01, 0.2, args.n_fits)
+
+    cold_seconds = []
+    for redshift in redshifts:
+        start_time = time.monotonic()
+        model_components = build_model(None)
+        sps_pool.reset_model_components(model_components, redshift)
+        cold_seconds.append(time.monotonic() - start_time)
+
+    warm_up_seconds = sps_pool.warm_up(size=1)
+    for aperture_type, redshift in zip(["local", "global"] * args.n_fits, redshifts):
+        with sps_pool.borrow_model_components(
+            {"redshift": redshift}, label=aperture_type
+        ):
+            pass
+
+    print(f"cold start: {np.mean(cold_seconds):.3f} s per fit")
+    print(f"pool warm up: {warm_up_seconds:.3f} s once per worker process")
+    for label, stats in sps_pool.pool_stats().items():
+        print(
+            f"{label} warm start: {stats['warm_mean_seconds']:.4f} s per fit "
+            f"({stats['warm_starts']} warm, {stats['cold_starts']} cold)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -16,6 +16,11 @@ if [[ ! -L "${CUTOUT_ROOT}" ]]; then
   mkdir -p "$(dirname "${CUTOUT_ROOT}")"
   ln -s "${DATA_ROOT_DIR}/cutout_cdn" "${CUTOUT_ROOT}"
 fi
+if [[ ! -L "${FRAME_CACHE_ROOT}" ]]; then
+  mkdir -p "${DATA_ROOT_DIR}"/frame_cache
+  mkdir -p "$(dirname "${FRAME_CACHE_ROOT}")"
+  ln -s "${DATA_ROOT_DIR}/frame_cache" "${FRAME_CACHE_ROOT}"
+fi
 if [[ ! -L "${SED_OUTPUT_ROOT}" ]]; then
   mkdir -p "${DATA_ROOT_DIR}"/sed_output
   mkdir -p "$(dirname "${SED_OUTPUT_ROOT}")"
@@ -0,0 +1,122 @@
+"""nearest neighbor searches in the sbi training set.
+
+sbi++ looks for the training SEDs within a reduced chi^2 of the observed
+photometry, widening the chi^2 threshold in steps until enough neighbors are
+found (sec. 4.1). TrainingSetIndex answers those queries without rescanning the
+training set at every step: it keeps the magnitudes of every band sorted, so
+only the training rows that can be within the threshold are looked at, and
+finds the final threshold from the k-th smallest chi^2.
+the selected neighbors are identical to those of the step-by-step search.
+"""
+import math
+
+import numpy as np
+
+
+def chi2dof(mags, obsphot, obsphot_unc, individual=False):
+    """reduced chi^2"""
+
+    if individual:
+        return ((mags - obsphot) / obsphot_unc) ** 2
+    else:
+        chi2 = np.nansum(((mags - obsphot) / obsphot_unc) ** 2, axis=1)
+        return chi2 / np.sum(np.isfinite(obsphot))
+
+
+class TrainingSetIndex:
+    """per-band sorted projections of the training photometry y_train;
+    built once when the training set is loaded
+
+    y_train: training photometry, magnitudes in the first nbands columns
+    nbands: number of magnitude columns
+    """
+
+    def __init__(self, y_train, nbands=22):
+        self.y_train = y_train
+        self.nbands = nbands
+        mags = y_train[:, :nbands]
+        # NaNs are sorted to the end of every column
+        self.order = np.argsort(mags, axis=0, kind="stable")
+        self.sorted_mags = np.take_along_axis(mags, self.order, axis=0)
+        self.n_finite = np.sum(np.isfinite(self.sorted_mags), axis=0)
+
+    def __len__(self):
+        return len(self.y_train)
+
+    def chi2(self, bands, obsphot, obsphot_unc, rows=None):
+        """reduced chi^2 of the training rows (all by default) in the given bands"""
+        if rows is None:
+            mags = self.y_train[:, bands]
+        else:
+            mags = self.y_train[np.ix_(rows, bands)]
+        return chi2dof(mags=mags, obsphot=obsphot, obsphot_unc=obsphot_unc)
+
+    def candidates(self, bands, obsphot, obsphot_unc, max_chi2):
+        """training rows that can have a reduced chi^2 <= max_chi2, in ascending order,
+        or None if no band narrows them down.
+        every band contributes at most max_chi2 * nfinite to the chi^2 sum, which bounds
+        |mag - obsphot| in each band; the most selective band is used
+        """
+        nfinite = np.sum(np.isfinite(obsphot))
+        radius = np.abs(obsphot_unc) * np.sqrt(max_chi2 * nfinite)
+
+        best = None
+        for band, obs, r in zip(bands, obsphot, radius):
+            if not (np.isfinite(obs) and np.isfinite(r)):
+                # NaN terms are left out of the chi^2 sum
+                continue
+            n_finite = self.n_finite[band]
+            finite_mags = self.sorted_mags[:n_finite, band]
+            lo = np.searchsorted(finite_mags, obs - r, side="left")
+            hi = np.searchsorted(finite_mags, obs + r, side="right")
+            # rows with a NaN magnitude don't add to the sum, so they stay candidates
+            ncand = hi - lo + len(self) - n_finite
+            if best is None or ncand < best[0]:
+                best = (ncand, band, lo, hi)
+
+        if best is None:
+            return None
+        ncand, band, lo, hi = best
+        rows = np.concatenate(
+            [self.order[lo:hi, band], self.order[self.n_finite[band] :, band]]
+        )
+        return np.sort(rows)
+
+    def within_chi2(self, bands, obsphot, obsphot_unc, k, ini_chi2, max_chi2, step=5):
+        """the training rows selected by widening a chi^2 threshold, starting at
+        ini_chi2, by step until at least k rows have chi2dof <= threshold.
+
+        returns the indices of those rows in ascending order, as np.where would, and the
+        threshold; or None and a threshold above max_chi2 if there are never k of them
+        """
+        # largest threshold the step-by-step search would try
+        last_chi2 = ini_chi2 + step * math.floor((max_chi2 - ini_chi2) / step)
+
+        threshold = ini_chi2
+        while threshold <= max_chi2:
+            rows = self.candidates(bands, obsphot, obsphot_unc, threshold)
+            chi2 = self.chi2(bands, obsphot, obsphot_unc, rows=rows)
+            if np.sum(chi2 <= threshold) >= k:
+                # every row within threshold is a candidate, so the k-th smallest
+                # chi^2 overall is among the candidates
+                kth_chi2 = np.partition(chi2, k - 1)[k - 1]
+                selected_chi2 = ini_chi2 + step * max(
+                    math.ceil((kth_chi2 - ini_chi2) / step), 0
+                )
+                while np.sum(chi2 <= selected_chi2) < k:
+                    # rounding in the division above
+                    selected_chi2 += step
+                selected = np.where(chi2 <= selected_chi2)[0]
+                if rows is not None:
+                    selected = rows[selected]
+                return selected, selected_chi2
+
+            if threshold >= last_chi2:
+                break
+            # widen geometrically, staying on the thresholds of the step-by-step search
+            wider = max(2 * threshold, threshold + step)
+            threshold = min(
+                ini_chi2 + step * math.ceil((wider - ini_chi2) / step), last_chi2
+            )
+
+        return None, last_chi2 + step
@@ -0,0 +1,116 @@
+"""toy noise model and filter metadata used by sbi++.
+
+the s/n vs. magnitude tables written by snr_vs_mag.py and the effective
+wavelengths of the filters are kept in one bundle in SBI_TRAINING_ROOT, so each
+process reads them once instead of parsing every s/n table and transmission
+curve on each fit. the bundle is rewritten when the s/n tables are (see
+snr_vs_mag.main) and reloaded by every process when it changes.
+"""
+import os
+import threading
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Q
+from scipy.interpolate import interp1d
+
+from host.models import Filter
+
+_noise_model = None
+_lock = threading.Lock()
+
+
+def sbi_filters():
+    """filters of the sbi++ training set, in the order of its bands"""
+    return Filter.objects.filter(~Q(name="DES_i") & ~Q(name="DES_Y"))
+
+
+def snr_file(filter_name):
+    return f"host/SBI/snrfiles/{filter_name}_magvsnr.txt"
+
+
+def bundle_path():
+    return os.path.join(settings.SBI_TRAINING_ROOT, "toy_noise_model.npz")
+
+
+def write_bundle():
+    """read the s/n tables & transmission curves of the sbi++ filters into the bundle"""
+    filters = list(sbi_filters())
+    arrays = {
+        "filternames": np.array([f.name for f in filters]),
+        "wavelengths": np.array(
+            [f.transmission_curve().wave_effective for f in filters]
+        ),
+    }
+    for f in filters:
+        mags, snrs = np.loadtxt(snr_file(f.name), dtype=float, unpack=True)
+        arrays[f"mags_{f.name}"] = mags
+        arrays[f"snrs_{f.name}"] = snrs
+
+    # write to a temporary file first so other processes never read a partial file
+    path = bundle_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as handle:
+        np.savez(handle, **arrays)
+    os.replace(tmp_path, path)
+
+
+def bundle_is_stale(filternames):
+    """whether the bundle is missing, was written for other filters or is older
+    than one of the s/n tables
+    """
+    path = bundle_path()
+    if not os.path.exists(path):
+        return True
+    with np.load(path) as data:
+        if list(data["filternames"]) != list(filternames):
+            return True
+    bundle_mtime = os.path.getmtime(path)
+    return any(os.path.getmtime(snr_file(name)) > bundle_mtime for name in filternames)
+
+
+def toy_noise_interpolator(mags, snrs):
+    """magnitude uncertainty as a function of magnitude"""
+    return interp1d(
+        mags,
+        1.0857 * 1 / snrs,
+        kind="slinear",
+        fill_value="extrapolate",  # (0.01,1.0),
+        bounds_error=False,
+    )
+
+
+def load_noise_model():
+    """toy noise model of every sbi++ filter, built once per process.
+
+    returns a dict with the "filternames" and effective "wavelengths" of the
+    filters and their "meds_sigs" & "stds_sigs" interpolators
+    """
+    global _noise_model
+
+    with _lock:
+        path = bundle_path()
+        if _noise_model is not None and os.path.exists(path):
+            if os.path.getmtime(path) == _noise_model["bundle_mtime"]:
+                return _noise_model
+
+        filternames = [f.name for f in sbi_filters()]
+        if bundle_is_stale(filternames):
+            write_bundle()
+
+        bundle_mtime = os.path.getmtime(path)
+        with np.load(path) as data:
+            interpolators = [
+                toy_noise_interpolator(data[f"mags_{name}"], data[f"snrs_{name}"])
+                for name in filternames
+            ]
+            _noise_model = {
+                "filternames": np.array(filternames),
+                "wavelengths": data["wavelengths"],
+                # the median & spread of the toy noise model are the same
+                "meds_sigs": interpolators,
+                "stds_sigs": interpolators,
+                "bundle_mtime": bundle_mtime,
+            }
+        return _noise_model
@@ -5,19 +5,18 @@ from django.conf import settings
 os.environ["KMP_DUPLICATE_LIB_OK"] = "True"
 import numpy as np
 import math
-from scipy.interpolate import interp1d
 
 # torch
 import torch
 from sbi import utils as Ut
 from sbi import inference as Inference
-from host.models import Filter
-from django.db.models import Q
 
 # all the functions implementing SBI++ are contained in `sbi_pp.py`
 from host.SBI import sbi_pp
+from host.SBI import noise_model
 import h5py
-import pickle
+import threading
+import time
 
 if torch.cuda.is_available():
     device = "cuda"
@@ -26,6 +25,7 @@ else:
 
 run_params = {
     "nmc": 50,  # number of MC samples
+    "mc_batch_size": 50,  # number of MC samples passed through the flow at once
     "nposterior": 50,  # number of posterior samples per MC drawn
     "np_baseline": 500,  # number of posterior samples used in baseline SBI
     "ini_chi2": 5,  # chi^2 cut usedi in the nearest neighbor search
@@ -48,7 +48,6 @@ sbi_params = {
     "nblocks": 15,  # architecture of the trained density estimator
 }
 
-all_filters = Filter.objects.filter(~Q(name="DES_i") & ~Q(name="DES_Y"))
 uv_filters = ["GALEX_NUV", "GALEX_FUV", "SDSS_u", "DES_u"]
 opt_filters = [
     "SDSS_g",
@@ -75,111 +74,116 @@ ir_filters = [
 
 
 # training set
-def run_training_set():
-    for _fit_type in ["global", "local"]:
-        data = h5py.File(sbi_params[f"train_fname_{_fit_type}"], "r")
-        x_train = np.array(data["theta"])  # physical parameters
-        y_train = np.array(data["phot"])  # fluxes & uncertainties
-
-        # we will only need the lower & upper limits to be passed to sbi as "priors"
-        # here we simply read in the bounds from the training set
-        prior_low = sbi_pp.prior_from_train("ll", x_train=x_train)
-        prior_high = sbi_pp.prior_from_train("ul", x_train=x_train)
-        lower_bounds = torch.tensor(prior_low).to(device)
-        upper_bounds = torch.tensor(prior_high).to(device)
-        prior = Ut.BoxUniform(low=lower_bounds, high=upper_bounds, device=device)
-
-        # density estimater
-        anpe = Inference.SNPE(
-            prior=prior,
-            density_estimator=Ut.posterior_nn(
-                "maf",
-                hidden_features=sbi_params["nhidden"],
-                num_transforms=sbi_params["nblocks"],
-            ),
-            device=device,
+def training_array_path(name, fit_type):
+    """.npy file of a training set array, memory-mapped by every worker"""
+    return os.path.join(settings.SBI_TRAINING_ROOT, f"{name}_{fit_type}.npy")
+
+
+def write_training_arrays(fit_type):
+    """copy the training set from the HDF5 file into uncompressed .npy files"""
+    with h5py.File(sbi_params[f"train_fname_{fit_type}"], "r") as data:
+        arrays = {
+            "x_train": np.array(data["theta"]),  # physical parameters
+            "y_train": np.array(data["phot"]),  # fluxes & uncertainties
+        }
+
+    os.makedirs(settings.SBI_TRAINING_ROOT, exist_ok=True)
+    for name, array in arrays.items():
+        # write to a temporary file first so other workers never map a partial file
+        path = training_array_path(name, fit_type)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as handle:
+            np.save(handle, array)
+        os.replace(tmp_path, path)
+
+
+def load_training_arrays(fit_type):
+    """x_train & y_train of a training set, memory-mapped read-only so the pages
+    are shared between the worker processes instead of copied into each of them
+    """
+    try:
+        return tuple(
+            np.load(training_array_path(name, fit_type), mmap_mode="r")
+            for name in ["x_train", "y_train"]
         )
-        x_tensor = torch.as_tensor(x_train.astype(np.float32)).to(device)
-        y_tensor = torch.as_tensor(y_train.astype(np.float32)).to(device)
-        anpe.append_simulations(x_tensor, y_tensor)
-        p_x_y_estimator = anpe._build_neural_net(x_tensor, y_tensor)
-        p_x_y_estimator.load_state_dict(
-            torch.load(
-                sbi_params[f"anpe_fname_{_fit_type}"], map_location=torch.device(device)
-            )
+    except FileNotFoundError:
+        print(f"""Writing {fit_type} training set to data files...""")
+        write_training_arrays(fit_type)
+        return load_training_arrays(fit_type)
+
+
+# training set rows used to build the flow before loading its trained weights
+NET_SHAPE_ROWS = 1000
+
+
+def build_posterior(fit_type, x_train, y_train):
+    """rebuild the trained posterior from the flow weights"""
+    # we will only need the lower & upper limits to be passed to sbi as "priors"
+    # here we simply read in the bounds from the training set
+    prior_low = sbi_pp.prior_from_train("ll", x_train=x_train)
+    prior_high = sbi_pp.prior_from_train("ul", x_train=x_train)
+    lower_bounds = torch.tensor(prior_low).to(device)
+    upper_bounds = torch.tensor(prior_high).to(device)
+    prior = Ut.BoxUniform(low=lower_bounds, high=upper_bounds, device=device)
+
+    # density estimater
+    anpe = Inference.SNPE(
+        prior=prior,
+        density_estimator=Ut.posterior_nn(
+            "maf",
+            hidden_features=sbi_params["nhidden"],
+            num_transforms=sbi_params["nblocks"],
+        ),
+        device=device,
+    )
+    # the flow is only built to load the trained weights into it, and those
+    # include the z-scoring of the training set, so a slice of the training set
+    # is enough and the memory-mapped arrays are not copied into the process
+    x_tensor = torch.as_tensor(
+        np.asarray(x_train[:NET_SHAPE_ROWS], dtype=np.float32)
+    ).to(device)
+    y_tensor = torch.as_tensor(
+        np.asarray(y_train[:NET_SHAPE_ROWS], dtype=np.float32)
+    ).to(device)
+    anpe.append_simulations(x_tensor, y_tensor)
+    p_x_y_estimator = anpe._build_neural_net(x_tensor, y_tensor)
+    p_x_y_estimator.load_state_dict(
+        torch.load(
+            sbi_params[f"anpe_fname_{fit_type}"], map_location=torch.device(device)
         )
-        anpe._x_shape = Ut.x_shape_from_simulation(y_tensor)
-        if _fit_type == "global":
-            hatp_x_y_global = anpe.build_posterior(
-                p_x_y_estimator, sample_with="rejection"
-            )
-            y_train_global = y_train[:]
-            x_train_global = x_train[:]
-        elif _fit_type == "local":
-            hatp_x_y_local = anpe.build_posterior(
-                p_x_y_estimator, sample_with="rejection"
+    )
+    anpe._x_shape = Ut.x_shape_from_simulation(y_tensor)
+    return anpe.build_posterior(p_x_y_estimator, sample_with="rejection")
+
+
+_posteriors = {}
+_posterior_lock = threading.Lock()
+
+
+def posterior(fit_type):
+    """trained posterior of a training set; the flow weights are only loaded
+    by the first SED fit that needs them in each process
+    """
+    with _posterior_lock:
+        if fit_type not in _posteriors:
+            start_time = time.monotonic()
+            x_train, y_train = training_sets[fit_type]
+            _posteriors[fit_type] = build_posterior(fit_type, x_train, y_train)
+            print(
+                f"Loaded {fit_type} SBI++ posterior in "
+                f"{time.monotonic() - start_time:.1f} seconds"
             )
-            y_train_local = y_train[:]
-            x_train_local = x_train[:]
-
-    print("""Storing training sets as data files...""")
-    with open(
-        os.path.join(settings.SBI_TRAINING_ROOT, "hatp_x_y_global.pkl"), "wb"
-    ) as handle:
-        pickle.dump(hatp_x_y_global, handle)
-    with open(
-        os.path.join(settings.SBI_TRAINING_ROOT, "y_train_global.pkl"), "wb"
-    ) as handle:
-        pickle.dump(y_train_global, handle)
-    with open(
-        os.path.join(settings.SBI_TRAINING_ROOT, "x_train_global.pkl"), "wb"
-    ) as handle:
-        pickle.dump(x_train_global, handle)
-    with open(
-        os.path.join(settings.SBI_TRAINING_ROOT, "hatp_x_y_local.pkl"), "wb"
-    ) as handle:
-        pickle.dump(hatp_x_y_local, handle)
-    with open(
-        os.path.join(settings.SBI_TRAINING_ROOT, "y_train_local.pkl"), "wb"
-    ) as handle:
-        pickle.dump(y_train_local, handle)
-    with open(
-        os.path.join(settings.SBI_TRAINING_ROOT, "x_train_local.pkl"), "wb"
-    ) as handle:
-        pickle.dump(x_train_local, handle)
-
-
-try:
-    print("""Loading training sets from data files...""")
-    with open(
-        os.path.join(settings.SBI_TRAINING_ROOT, "hatp_x_y_global.pkl"), "rb"
-    ) as handle:
-        hatp_x_y_global = pickle.load(handle)
-    with open(
-        os.path.join(settings.SBI_TRAINING_ROOT, "y_train_global.pkl"), "rb"
-    ) as handle:
-        y_train_global = pickle.load(handle)
-    with open(
-        os.path.join(settings.SBI_TRAINING_ROOT, "x_train_global.pkl"), "rb"
-    ) as handle:
-        x_train_global = pickle.load(handle)
-    with open(
-        os.path.join(settings.SBI_TRAINING_ROOT, "hatp_x_y_local.pkl"), "rb"
-    ) as handle:
-        hatp_x_y_local = pickle.load(handle)
-    with open(
-        os.path.join(settings.SBI_TRAINING_ROOT, "y_train_local.pkl"), "rb"
-    ) as handle:
-        y_train_local = pickle.load(handle)
-    with open(
-        os.path.join(settings.SBI_TRAINING_ROOT, "x_train_local.pkl"), "rb"
-    ) as handle:
-        x_train_local = pickle.load(handle)
-    print("""Training sets loaded.""")
-except Exception as err:
-    print(f"""Error loading training sets: {err}. Regenerating...""")
-    run_training_set()
-    print("""Training sets generated.""")
+        return _posteriors[fit_type]
+
+
+print("""Loading training sets from data files...""")
+x_train_global, y_train_global = load_training_arrays("global")
+x_train_local, y_train_local = load_training_arrays("local")
+training_sets = {
+    "global": (x_train_global, y_train_global),
+    "local": (x_train_local, y_train_local),
+}
+print("""Training sets loaded.""")
 
 
 def maggies_to_asinh(x):
@@ -189,37 +193,18 @@ def maggies_to_asinh(x):
     return -a * math.asinh((x / 2.0) * np.exp(mu / a)) + mu
 
 
-def fit_sbi_pp(observations, n_filt_cuts=True, fit_type="global"):
-    np.random.seed(100)  # make results reproducible
-
-    # toy noise model
-    meds_sigs, stds_sigs = [], []
+def load_toy_noise():
+    """toy noise model of every filter, interpolated from the SNR files"""
+    toy_noise = noise_model.load_noise_model()
+    sbi_params["toynoise_meds_sigs"] = toy_noise["meds_sigs"]
+    sbi_params["toynoise_stds_sigs"] = toy_noise["stds_sigs"]
 
-    for f in all_filters:
-        toy_noise_x, toy_noise_y = np.loadtxt(
-            f"host/SBI/snrfiles/{f.name}_magvsnr.txt", dtype=float, unpack=True
-        )
-        meds_sigs += [
-            interp1d(
-                toy_noise_x,
-                1.0857 * 1 / toy_noise_y,
-                kind="slinear",
-                fill_value="extrapolate",  # (0.01,1.0),
-                bounds_error=False,
-            )
-        ]
-        stds_sigs += [
-            interp1d(
-                toy_noise_x,
-                1.0857 * 1 / toy_noise_y,
-                kind="slinear",
-                fill_value="extrapolate",  # (0.01,1.0),
-                bounds_error=False,
-            )
-        ]
-    sbi_params["toynoise_meds_sigs"] = meds_sigs
-    sbi_params["toynoise_stds_sigs"] = stds_sigs
 
+def build_sbi_obs(observations, n_filt_cuts=True):
+    """
+    Convert prospector observations to the asinh magnitudes used by SBI++.
+    Returns None if there are not enough filters for reliable inference.
+    """
     # a testing object of which the noises are OOD
     mags, mags_unc, filternames, wavelengths = (
         np.array([]),
@@ -228,10 +213,11 @@ def fit_sbi_pp(observations, n_filt_cuts=True, fit_type="global"):
         np.array([]),
     )
 
+    toy_noise = noise_model.load_noise_model()
     has_uv, has_opt, has_ir = False, False, False
-    for f in all_filters:
-        if f.name in observations["filternames"]:
-            iflt = np.array(observations["filternames"]) == f.name
+    for name, wavelength in zip(toy_noise["filternames"], toy_noise["wavelengths"]):
+        if name in observations["filternames"]:
+            iflt = np.array(observations["filternames"]) == name
             mags = np.append(mags, maggies_to_asinh(observations["maggies"][iflt]))
             mags_unc = np.append(
                 mags_unc,
@@ -240,17 +226,17 @@ def fit_sbi_pp(observations, n_filt_cuts=True, fit_type="global"):
                 * observations["maggies_unc"][iflt]
                 / observations["maggies"][iflt],
             )
-            if f.name in uv_filters:
+            if name in uv_filters:
                 has_uv = True
-            elif f.name in opt_filters:
+            elif name in opt_filters:
                 has_opt = True
-            elif f.name in ir_filters:
+            elif name in ir_filters:
                 has_ir = True
         else:
             mags = np.append(mags, np.nan)
             mags_unc = np.append(mags_unc, np.nan)
-        filternames = np.append(filternames, f.name)
-        wavelengths = np.append(wavelengths, f.transmission_curve().wave_effective)
+        filternames = np.append(filternames, name)
+        wavelengths = np.append(wavelengths, wavelength)
 
     obs = {}
     obs[
@@ -265,17 +251,39 @@ def fit_sbi_pp(observations, n_filt_cuts=True, fit_type="global"):
 
     if n_filt_cuts and not has_opt and (not has_ir or not has_uv):
         print("not enough filters for reliable/fast inference")
-        return {}, 1
+        return None
+
+    return obs
+
+
+# nearest neighbor indices of the training sets, built on first use
+training_set_indices = {}
 
-    # prepare to pass the reconstructed model to sbi_pp
+
+def use_training_set(fit_type):
+    """prepare to pass the reconstructed model to sbi_pp"""
     if fit_type == "global":
         sbi_params["y_train"] = y_train_global
         sbi_params["theta_train"] = x_train_global
-        sbi_params["hatp_x_y"] = hatp_x_y_global
     elif fit_type == "local":
         sbi_params["y_train"] = y_train_local
-        sbi_params["hatp_x_y"] = hatp_x_y_local
         sbi_params["theta_train"] = x_train_local
+    sbi_params["hatp_x_y"] = posterior(fit_type)
+    sbi_params["y_train_index"] = training_set_indices.get(fit_type)
+    training_set_indices[fit_type] = sbi_pp.training_set_index(sbi_params)
+
+
+def fit_sbi_pp(observations, n_filt_cuts=True, fit_type="global"):
+    np.random.seed(100)  # make results reproducible
+
+    # toy noise model
+    load_toy_noise()
+
+    obs = build_sbi_obs(observations, n_filt_cuts=n_filt_cuts)
+    if obs is None:
+        return {}, 1
+
+    use_training_set(fit_type)
 
     # Run SBI++
     chain, obs, flags = sbi_pp.sbi_pp(
@@ -285,3 +293,32 @@ def fit_sbi_pp(observations, n_filt_cuts=True, fit_type="global"):
     # pathological format as we're missing some stuff that prospector usually spits out
     output = {"sampling": [{"samples": chain[:, :], "eff": 100}, 0]}
     return output, 0
+
+
+def fit_sbi_pp_batch(observations_list, n_filt_cuts=True, fit_type="global"):
+    """
+    Run SBI++ for many transients at once with the same trained posterior,
+    see sbi_pp.sbi_pp_batch.
+
+    Returns one (output, errflag) pair per transient, as fit_sbi_pp would.
+    """
+    np.random.seed(100)  # make results reproducible
+
+    load_toy_noise()
+    use_training_set(fit_type)
+
+    obs_list = [
+        build_sbi_obs(observations, n_filt_cuts=n_filt_cuts)
+        for observations in observations_list
+    ]
+    valid = [i for i, obs in enumerate(obs_list) if obs is not None]
+    results = sbi_pp.sbi_pp_batch(
+        obs_list=[obs_list[i] for i in valid],
+        run_params=run_params,
+        sbi_params=sbi_params,
+    )
+
+    outputs = [({}, 1) for _ in observations_list]
+    for i, (chain, obs, flags) in zip(valid, results):
+        outputs[i] = ({"sampling": [{"samples": chain[:, :], "eff": 100}, 0]}, 0)
+    return outputs
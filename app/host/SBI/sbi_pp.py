@@ -1,7 +1,6 @@
 # $ conda activate sbi_env
 import copy
 import os
-import signal
 import sys
 import time
 import warnings
@@ -37,6 +36,9 @@ import torch.nn as nn
 import torch.nn.functional as F
 from sbi import utils as Ut
 from sbi import inference as Inference
+from sbi.utils.sbiutils import within_support
+from host.SBI.nn_index import chi2dof
+from host.SBI.nn_index import TrainingSetIndex
 
 from host.models import AperturePhotometry, Transient, Filter
 from django.db.models import Q
@@ -83,13 +85,112 @@ def toy_noise(flux, meds_sigs, stds_sigs, verbose=False, **extra):
     return flux, meds_sigs(flux), np.clip(stds_sigs(flux), a_min=0.001, a_max=None)
 
 
-# the following functions are used to set the max time spent per object
-class TimeoutException(Exception):
-    pass
+def sample_posterior_batched(hatp_x_y, xs, npost, max_seconds=None):
+    """draw npost posterior samples for every row of xs in one batched pass through
+    the normalizing flow, instead of one hatp_x_y.sample call per monte carlo realisation.
+    samples outside the prior are rejected, as in hatp_x_y.sample;
+    rows that still lack npost samples after max_seconds are given up on.
 
+    returns a list with one (npost, ndim) array per row of xs, or None for rows given up on
+    """
+    st = time.monotonic()
+    x = torch.as_tensor(np.asarray(xs, dtype=np.float32)).to(device)
+
+    if hasattr(hatp_x_y, "sample_batched"):
+        # sbi >= 0.23 does the batched rejection sampling itself
+        theta = hatp_x_y.sample_batched((npost,), x=x, show_progress_bars=False)
+        return list(np.swapaxes(theta.detach().cpu().numpy(), 0, 1))
+
+    accepted = [[] for _ in range(len(x))]
+    naccepted = np.zeros(len(x), dtype=int)
+    pending = np.arange(len(x))
+    with torch.no_grad():
+        while len(pending):
+            # shape (len(pending), npost, ndim)
+            theta = hatp_x_y.posterior_estimator.sample(npost, context=x[pending])
+            in_prior = within_support(
+                hatp_x_y.prior, theta.reshape(-1, theta.shape[-1])
+            ).reshape(theta.shape[:2])
+            theta = theta.cpu().numpy()
+            in_prior = in_prior.cpu().numpy()
+            for row, this_theta, this_in_prior in zip(pending, theta, in_prior):
+                accepted[row].append(this_theta[this_in_prior])
+                naccepted[row] += np.sum(this_in_prior)
+            pending = pending[naccepted[pending] < npost]
+            if max_seconds is not None and time.monotonic() - st > max_seconds:
+                break
+
+    return [
+        np.concatenate(accepted[row])[:npost] if naccepted[row] >= npost else None
+        for row in range(len(x))
+    ]
+
+
+def mc_sample(hatp_x_y, draws, run_params):
+    """monte carlo loop shared by sbi_missingband, sbi_mcnoise and sbi_missing_and_noisy.
+    draws has one callable per object, returning the realisations of x from one monte carlo draw;
+    the realisations of all the objects are sampled together, in batches of
+    run_params["mc_batch_size"] realisations per object.
+    realisations that can't be sampled within the time budget are dropped and replaced.
+
+    returns one (ave_theta, all_x, timeout_flag, cnt) tuple per object
+    """
+    st = time.monotonic()
+    batch_size = run_params.get("mc_batch_size", run_params["nmc"])
+    ave_theta = [[] for _ in draws]
+    all_x = [[] for _ in draws]
+    cnt = [0 for _ in draws]
+    timeout_flag = [False for _ in draws]
+
+    active = list(range(len(draws)))
+    while active:
+        batch_x, owners = [], []
+        for i in active:
+            obj_x = []
+            while len(obj_x) < min(
+                run_params["nmc"] - cnt[i], batch_size
+            ) and not mc_timed_out(st, cnt[i], run_params):
+                obj_x.extend(draws[i]())
+            batch_x.extend(obj_x)
+            owners.extend([i] * len(obj_x))
+            all_x[i].extend(obj_x)
+
+        if len(batch_x):
+            # each realisation gets run_params["tmax_per_iter"] secs, as it did when they
+            # were sampled one at a time, but no batch runs past run_params["tmax_all"] mins
+            remaining = run_params["tmax_all"] * 60 - (time.monotonic() - st)
+            max_seconds = max(
+                min(run_params["tmax_per_iter"] * len(batch_x), remaining), 0
+            )
+            noiseless_theta = sample_posterior_batched(
+                hatp_x_y, batch_x, run_params["nposterior"], max_seconds=max_seconds
+            )
+            for i, theta in zip(owners, noiseless_theta):
+                if theta is not None:
+                    ave_theta[i].append(theta)
+                    cnt[i] += 1
 
-def timeout_handler(signum, frame):
-    raise TimeoutException
+        if run_params["verbose"]:
+            print("mc samples:", cnt[0] if len(cnt) == 1 else cnt)
+
+        for i in list(active):
+            if cnt[i] >= run_params["nmc"]:
+                active.remove(i)
+            elif mc_timed_out(st, cnt[i], run_params):
+                timeout_flag[i] = True
+                active.remove(i)
+
+    return list(zip(ave_theta, all_x, timeout_flag, cnt))
+
+
+def mc_timed_out(st, cnt, run_params):
+    """True once the monte carlo loop has used up run_params["tmax_all"] minutes,
+    or is on course to, judging by the number of realisations cnt drawn so far
+    """
+    elapsed_time = time.monotonic() - st  # in secs
+    return elapsed_time / 60 > run_params["tmax_all"] or (
+        cnt < run_params["nmc"] / 10 and elapsed_time / 60 * 10 > run_params["tmax_all"]
+    )
 
 
 def absdiff(mags, obsphot, obsphot_unc):
@@ -98,14 +199,15 @@ def absdiff(mags, obsphot, obsphot_unc):
     return np.abs(mags - obsphot)
 
 
-def chi2dof(mags, obsphot, obsphot_unc, individual=False):
-    """reduced chi^2"""
-
-    if individual:
-        return ((mags - obsphot) / obsphot_unc) ** 2
-    else:
-        chi2 = np.nansum(((mags - obsphot) / obsphot_unc) ** 2, axis=1)
-        return chi2 / np.sum(np.isfinite(obsphot))
+def training_set_index(sbi_params):
+    """nearest neighbor index of sbi_params["y_train"]; built here if the caller
+    didn't pass one in sbi_params["y_train_index"]
+    """
+    index = sbi_params.get("y_train_index")
+    if index is None or index.y_train is not sbi_params["y_train"]:
+        index = TrainingSetIndex(sbi_params["y_train"])
+        sbi_params["y_train_index"] = index
+    return index
 
 
 def chidof(mags, obsphot, obsphot_unc, individual=False):
@@ -133,24 +235,20 @@ def gauss_approx_missingband(obs, run_params, sbi_params, max_neighbors=200):
     valid_idx = np.where(~invalid_mask)[0]
     not_valid_idx = np.where(invalid_mask)[0]
 
-    look_in_training = y_train[:, valid_idx]
-    chi2_nei = chi2dof(
-        mags=look_in_training, obsphot=y_obs[valid_idx], obsphot_unc=sig_obs[valid_idx]
-    )
-
-    _chi2_thres = run_params["ini_chi2"] * 1
-    cnt = 0
+    index = training_set_index(sbi_params)
     use_res = True
-    while _chi2_thres <= run_params["max_chi2"]:
-        idx_chi2_selected = np.where(chi2_nei <= _chi2_thres)[0]
-        if len(idx_chi2_selected) >= 30:
-            break
-        else:
-            _chi2_thres += 5
-        cnt += 1
+    idx_chi2_selected, _chi2_thres = index.within_chi2(
+        valid_idx,
+        y_obs[valid_idx],
+        sig_obs[valid_idx],
+        k=30,
+        ini_chi2=run_params["ini_chi2"],
+        max_chi2=run_params["max_chi2"],
+    )
 
-    if _chi2_thres > run_params["max_chi2"]:
+    if idx_chi2_selected is None:
         use_res = False
+        chi2_nei = index.chi2(valid_idx, y_obs[valid_idx], sig_obs[valid_idx])
         chi2_selected = y_train[:, valid_idx]
         chi2_selected = chi2_selected[:max_neighbors]
         guess_ndata = y_train[:, not_valid_idx]
@@ -179,19 +277,12 @@ def gauss_approx_missingband(obs, run_params, sbi_params, max_neighbors=200):
     return kdes, use_res, idx_chi2_selected
 
 
-def sbi_missingband(obs, run_params, sbi_params, seconditer=False):
-    """used when observations have missing data;
-    see sec. 4.1.2 of for details
-    """
-
-    signal.signal(signal.SIGALRM, timeout_handler)
-
-    if run_params["verbose"]:
-        print("sbi missing bands")
-    ave_theta = []
+def missingband_draw(obs, run_params, sbi_params):
+    """nearest neighbor approximation of the missing bands, see sbi_missingband.
 
+    returns a callable drawing one monte carlo realisation of x, and use_res
+    """
     max_neighbors = 200
-    hatp_x_y = sbi_params["hatp_x_y"]
     y_train = sbi_params["y_train"]
     y_obs = np.copy(obs["mags_sbi"])
     sig_obs = np.copy(obs["mags_unc_sbi"])
@@ -200,40 +291,24 @@ def sbi_missingband(obs, run_params, sbi_params, seconditer=False):
     y_obs_valid_only = y_obs[~invalid_mask]
     valid_idx = np.where(~invalid_mask)[0]
     not_valid_idx = np.where(invalid_mask)[0]
-    st = time.time()
 
     # ------------------------------------------------
     # nearest neighbor approximation of missing bands;
     # see sec. 4.1 for details
-    look_in_training = y_train[:, valid_idx]
-    chi2_nei = chi2dof(
-        mags=look_in_training, obsphot=y_obs[valid_idx], obsphot_unc=sig_obs[valid_idx]
-    )
-    chi_nei = chidof(
-        mags=look_in_training, obsphot=y_obs[valid_idx], obsphot_unc=sig_obs[valid_idx]
-    )
-
-    _chi2_thres = run_params["ini_chi2"] * 1
-    cnt = 0
+    index = training_set_index(sbi_params)
     use_res = True
-    while _chi2_thres <= run_params["max_chi2"]:
-        # idx_chi2_selected = np.where(chi2_nei[redshift_idx] <= _chi2_thres)[0]
-        # if len(idx_chi2_selected) >= 100 and np.abs(np.median(chi_nei[redshift_idx][idx_chi2_selected])) < 0.25:
-
-        # let's not allow any matches with giant overall offsets
-        idx_chi2_selected = np.where(chi2_nei <= _chi2_thres)[
-            0
-        ]  # & (np.abs(chi_nei) < 0.25))[0]
-        if (
-            len(idx_chi2_selected) >= max_neighbors
-        ):  # and np.abs(np.median(chi_nei[idx_chi2_selected])) < 0.25:
-            break
-        else:
-            _chi2_thres += 5
-        cnt += 1
+    idx_chi2_selected, _chi2_thres = index.within_chi2(
+        valid_idx,
+        y_obs[valid_idx],
+        sig_obs[valid_idx],
+        k=max_neighbors,
+        ini_chi2=run_params["ini_chi2"],
+        max_chi2=run_params["max_chi2"],
+    )
 
-    if _chi2_thres > run_params["max_chi2"]:
+    if idx_chi2_selected is None:
         use_res = False
+        chi2_nei = index.chi2(valid_idx, y_obs[valid_idx], sig_obs[valid_idx])
         chi2_selected = y_train[:, valid_idx]
         chi2_selected = chi2_selected[:max_neighbors]
         guess_ndata = y_train[:, not_valid_idx]
@@ -268,99 +343,66 @@ def sbi_missingband(obs, run_params, sbi_params, seconditer=False):
     nbands = y_train.shape[1] // 2  # total number of bands
     not_valid_idx_unc = not_valid_idx + nbands
 
-    all_x = []
-    cnt = 0
-    cnt_timeout = 0
-    timeout_flag = False
     # ------------------------------------------------
     # draw monte carlo samples from the nearest neighbor approximation
     # later we will average over the monte-carlo posterior samples to attain the final posterior estimation
-    while cnt < run_params["nmc"]:
-        signal.alarm(
-            0
-        )  # run_params["tmax_per_obj"])  # max time spent on one object in sec -- disabled for now
-        try:
-            x = np.copy(observed)
-
-            for j, idx in enumerate(not_valid_idx):
-                x[not_valid_idx[j]] = np.random.choice(guess_ndata.T[j])
-                # let's just randomly sample the neighbors instead of unpredictable toy noise model
-                x[22:][not_valid_idx[j]] = y_train[idx_chi2_selected][
-                    np.random.choice(range(len(guess_ndata.T[j])))
-                ][22:][not_valid_idx[j]]
-                # x[not_valid_idx_unc[j]] = toy_noise(
-                #    flux=x[not_valid_idx[j]],
-                #    meds_sigs=sbi_params["toynoise_meds_sigs"][idx],
-                #    stds_sigs=sbi_params["toynoise_stds_sigs"][idx],
-                #    verbose=run_params["verbose"],
-                # )[1]
-
-            # the noise model in the training isn't quite right
-            # Pan-STARRS in particular seems a little off
-            # we'll have to re-train at some point, but for now just pull
-            # uncertainties from the training sample
-            for idx, fname in zip(valid_idx, obs["filternames"][valid_idx]):
-                chc = np.random.choice(range(len(y_train[idx_chi2_selected])))
-                x[22:-1][idx] = y_train[idx_chi2_selected][chc][22:-1][idx]
-
-            all_x.append(x)
-
-            # if we can't get one posterior sample in one second, we should move along
-            # to the next MC sample
-            do_continue = False
-            for tmax, npost in zip(
-                [1, run_params["tmax_per_iter"]], [1, run_params["nposterior"]]
-            ):
-                signal.alarm(tmax)  # max time spent on one object in sec
-                try:
-                    noiseless_theta = hatp_x_y.sample(
-                        (npost,),
-                        x=torch.as_tensor(x.astype(np.float32)).to(device),
-                        show_progress_bars=False,
-                    )
-                except TimeoutException:
-                    signal.alarm(0)
-                    do_continue = True
-                    break
-
-            if do_continue:
-                continue
-
-            signal.alarm(0)
+    def draw():
+        x = np.copy(observed)
+
+        for j, idx in enumerate(not_valid_idx):
+            x[not_valid_idx[j]] = np.random.choice(guess_ndata.T[j])
+            # let's just randomly sample the neighbors instead of unpredictable toy noise model
+            x[22:][not_valid_idx[j]] = y_train[idx_chi2_selected][
+                np.random.choice(range(len(guess_ndata.T[j])))
+            ][22:][not_valid_idx[j]]
+            # x[not_valid_idx_unc[j]] = toy_noise(
+            #    flux=x[not_valid_idx[j]],
+            #    meds_sigs=sbi_params["toynoise_meds_sigs"][idx],
+            #    stds_sigs=sbi_params["toynoise_stds_sigs"][idx],
+            #    verbose=run_params["verbose"],
+            # )[1]
 
-            noiseless_theta = noiseless_theta.detach().numpy()
+        # the noise model in the training isn't quite right
+        # Pan-STARRS in particular seems a little off
+        # we'll have to re-train at some point, but for now just pull
+        # uncertainties from the training sample
+        for idx, fname in zip(valid_idx, obs["filternames"][valid_idx]):
+            chc = np.random.choice(range(len(y_train[idx_chi2_selected])))
+            x[22:-1][idx] = y_train[idx_chi2_selected][chc][22:-1][idx]
 
-            ave_theta.append(noiseless_theta)
+        return [x]
 
-            cnt += 1
-            if run_params["verbose"]:
-                if cnt % 10 == 0:
-                    print("mc samples:", cnt)
+    return draw, use_res
 
-        except TimeoutException:
-            cnt_timeout += 1
-        else:
-            signal.alarm(0)
-
-        # set max time
-        et = time.time()
-        elapsed_time = et - st  # in secs
-        if elapsed_time / 60 > run_params["tmax_all"] or (
-            cnt < run_params["nmc"] / 10
-            and elapsed_time / 60 * 10 > run_params["tmax_all"]
-        ):
-            timeout_flag = True
-            use_res = False
-            break
-    # ------------------------------------------------
 
+def missingband_y_guess(obs, all_x, nbands):
+    """median of the monte carlo realisations drawn by missingband_draw"""
     all_x = np.array(all_x)
     all_x_flux = all_x.T[:nbands]
     all_x_unc = all_x.T[nbands:]
-    y_guess = np.concatenate(
+    return np.concatenate(
         [np.median(all_x_flux, axis=1), np.median(all_x_unc, axis=1), [obs["redshift"]]]
     )
 
+
+def sbi_missingband(obs, run_params, sbi_params, seconditer=False):
+    """used when observations have missing data;
+    see sec. 4.1.2 of for details
+    """
+
+    if run_params["verbose"]:
+        print("sbi missing bands")
+
+    draw, use_res = missingband_draw(obs, run_params, sbi_params)
+    ((ave_theta, all_x, timeout_flag, cnt),) = mc_sample(
+        sbi_params["hatp_x_y"], [draw], run_params
+    )
+    if timeout_flag:
+        use_res = False
+
+    nbands = sbi_params["y_train"].shape[1] // 2  # total number of bands
+    y_guess = missingband_y_guess(obs, all_x, nbands)
+
     return ave_theta, y_guess, use_res, timeout_flag, cnt
 
 
@@ -381,21 +423,22 @@ def lim_of_noisy_guass(obs, run_params, sbi_params):
     noisy_idx = np.where(noisy_mask == True)[0]
     not_noisy_idx = np.where(noisy_mask == False)[0]
 
-    look_in_training = y_train[:, noisy_idx]
-    chi2_nei = chi2dof(
-        mags=look_in_training, obsphot=y_obs[noisy_idx], obsphot_unc=sig_obs[noisy_idx]
+    chi2_nei = training_set_index(sbi_params).chi2(
+        noisy_idx, y_obs[noisy_idx], sig_obs[noisy_idx]
     )
+    # the neighbors within a threshold are the first rows in order of chi^2,
+    # so their min & max are running min & max over the sorted rows
+    order = np.argsort(chi2_nei, kind="stable")
+    sorted_chi2 = chi2_nei[order]
+    sorted_nei = y_train[np.ix_(order, noisy_idx)]
+    nei_min = np.minimum.accumulate(sorted_nei, axis=0)
+    nei_max = np.maximum.accumulate(sorted_nei, axis=0)
 
     _chi2_thres = run_params["ini_chi2"] * 1
     while True:
-        idx_chi2_selected = np.where(chi2_nei <= _chi2_thres)[0]
-        if len(idx_chi2_selected) >= 10:
-            chi2_nei_selected = y_train[idx_chi2_selected]
-            chi2_nei_selected = np.squeeze(chi2_nei_selected[:, noisy_idx])
-            lims = [
-                np.atleast_1d(np.min(chi2_nei_selected, axis=0)),
-                np.atleast_1d(np.max(chi2_nei_selected, axis=0)),
-            ]
+        n_selected = np.searchsorted(sorted_chi2, _chi2_thres, side="right")
+        if n_selected >= 10:
+            lims = [nei_min[n_selected - 1], nei_max[n_selected - 1]]
             if np.all((lims[0] - y_obs[noisy_idx]) < 0) and np.all(
                 (lims[1] - y_obs[noisy_idx]) > 0
             ):
@@ -420,18 +463,11 @@ def lim_of_noisy_guass(obs, run_params, sbi_params):
     return lims, use_res
 
 
-def sbi_mcnoise(obs, run_params, sbi_params, max_neighbors=200):
-    """used when observations have out-of-distribution uncertainties;
-    see sec. 4.1.1 for details
-    """
-    signal.signal(signal.SIGALRM, timeout_handler)
-
-    if run_params["verbose"]:
-        print("sbi mc noise")
-
-    ave_theta = []
+def mcnoise_draw(obs, run_params, sbi_params, max_neighbors=200):
+    """gaussian monte carlo of the noisy bands, see sbi_mcnoise.
 
-    hatp_x_y = sbi_params["hatp_x_y"]
+    returns a callable drawing the monte carlo realisations of x from one draw, and use_res
+    """
     y_train = sbi_params["y_train"]
 
     y_obs = np.copy(obs["mags_sbi"])
@@ -443,9 +479,6 @@ def sbi_mcnoise(obs, run_params, sbi_params, max_neighbors=200):
     noisy_idx = np.where(noisy_mask == True)[0]
     not_noisy_idx = np.where(noisy_mask == False)[0]
 
-    # start time
-    st = time.time()
-
     lims, use_res = lim_of_noisy_guass(
         obs=obs, run_params=run_params, sbi_params=sbi_params
     )
@@ -453,17 +486,18 @@ def sbi_mcnoise(obs, run_params, sbi_params, max_neighbors=200):
     scale = sig_obs[noisy_idx]
 
     ### temporary for getting errors, because error model not good enough
-    chi2_nei = chi2dof(mags=y_train[:, :22], obsphot=y_obs, obsphot_unc=sig_obs)
-
-    _chi2_thres = run_params["ini_chi2"] * 1
-    while _chi2_thres <= run_params["max_chi2"]:
-        idx_chi2_selected = np.where(chi2_nei <= _chi2_thres)[0]
-        if len(idx_chi2_selected) >= 30:
-            break
-        else:
-            _chi2_thres += 5
+    index = training_set_index(sbi_params)
+    idx_chi2_selected, _chi2_thres = index.within_chi2(
+        np.arange(22),
+        y_obs,
+        sig_obs,
+        k=30,
+        ini_chi2=run_params["ini_chi2"],
+        max_chi2=run_params["max_chi2"],
+    )
 
-    if _chi2_thres > run_params["max_chi2"]:
+    if idx_chi2_selected is None:
+        chi2_nei = index.chi2(np.arange(22), y_obs, sig_obs)
         chi2_selected = y_train[:]
         idx_chi2_selected = np.argsort(chi2_nei)[0:max_neighbors]
         if run_params["verbose"]:
@@ -471,13 +505,11 @@ def sbi_mcnoise(obs, run_params, sbi_params, max_neighbors=200):
     else:
         chi2_selected = y_train[idx_chi2_selected]
 
-    cnt = 0
-    cnt_timeout = 0
-    timeout_flag = False
     # ------------------------------------------------
     # draw monte carlo samples from a norm dist centered at x_obs and 1 sigma = 1 sigma uncertainty associated with x_obs
     # later we will average over the those "noisy" posterior samples to attain the final posterior estimation
-    while cnt < run_params["nmc"]:
+    def draw():
+        realisations = []
         samp_y_guess = np.copy(observed)
         samp_y_guess[noisy_idx] = stats.norm.rvs(loc=loc, scale=scale)
         # ensure positive uncertainties
@@ -496,7 +528,6 @@ def sbi_mcnoise(obs, run_params, sbi_params, max_neighbors=200):
                     stds_sigs=sbi_params["toynoise_stds_sigs"][ii],
                     verbose=run_params["verbose"],
                 )[1]
-                # signal.alarm(run_params["tmax_per_obj"])
 
                 for idx, fname in enumerate(obs["filternames"]):
                     chc = np.random.choice(range(len(y_train[idx_chi2_selected])))
@@ -504,67 +535,37 @@ def sbi_mcnoise(obs, run_params, sbi_params, max_neighbors=200):
                         idx
                     ]
 
-                do_continue = False
-                for tmax, npost in zip(
-                    [run_params["tmax_per_iter"]], [run_params["nposterior"]]
-                ):
-                    signal.alarm(tmax)  # max time spent on one object in sec
-                    try:
-                        noiseless_theta = hatp_x_y.sample(
-                            (run_params["nposterior"],),
-                            x=torch.as_tensor(samp_y_guess).to(device),
-                            show_progress_bars=False,
-                        )
-                    except TimeoutException:
-                        signal.alarm(0)
-                        do_continue = True
-                        break
-
-                if do_continue:
-                    continue
-
-                noiseless_theta = noiseless_theta.detach().numpy()
-
-                ave_theta.append(noiseless_theta)
-
-                cnt += 1
-                if run_params["verbose"]:
-                    if cnt % 10 == 0:
-                        print("mc samples:", cnt)
-
-            # except TimeoutException:
-            #    cnt_timeout += 1
-            # else:
-            signal.alarm(0)
-
-        # end time
-        et = time.time()
-        elapsed_time = et - st  # in secs
-        if elapsed_time / 60 > run_params["tmax_all"] or (
-            cnt < run_params["nmc"] / 10
-            and elapsed_time / 60 * 10 > run_params["tmax_all"]
-        ):
-            timeout_flag = True
-            use_res = False
-            break
-    # ------------------------------------------------
+                realisations.append(np.copy(samp_y_guess))
+        return realisations
 
-    return ave_theta, use_res, timeout_flag, cnt
+    return draw, use_res
 
 
-def sbi_missing_and_noisy(obs, run_params, sbi_params):
-    """used when observations have missing data and out-of-distribution uncertainties.
-    fill in the missing bands first using the nearest neighbor approximation;
-    then mc the noisy bands
+def sbi_mcnoise(obs, run_params, sbi_params, max_neighbors=200):
+    """used when observations have out-of-distribution uncertainties;
+    see sec. 4.1.1 for details
     """
-    signal.signal(signal.SIGALRM, timeout_handler)
 
     if run_params["verbose"]:
-        print("sbi missing and noisy bands")
+        print("sbi mc noise")
 
-    ave_theta = []
+    draw, use_res = mcnoise_draw(obs, run_params, sbi_params, max_neighbors)
+    ((ave_theta, all_x, timeout_flag, cnt),) = mc_sample(
+        sbi_params["hatp_x_y"], [draw], run_params
+    )
+    if timeout_flag:
+        use_res = False
 
-    hatp_x_y = sbi_params["hatp_x_y"]
+    return ave_theta, use_res, timeout_flag, cnt
+
+
+def missing_and_noisy_draw(obs, run_params, sbi_params):
+    """nearest neighbor approximation of the missing bands and gaussian monte carlo
+    of the noisy bands, see sbi_missing_and_noisy.
+
+    returns a callable drawing the monte carlo realisations of x from one draw, and
+    whether both approximations succeeded
+    """
     y_train = sbi_params["y_train"]
 
     y_obs = np.copy(obs["mags_sbi"])
@@ -587,19 +588,14 @@ def sbi_missing_and_noisy(obs, run_params, sbi_params):
         obs, run_params, sbi_params
     )
 
-    # start time
-    st = time.time()
-
     lims, use_res_noisy = lim_of_noisy_guass(
         obs=obs, run_params=run_params, sbi_params=sbi_params
     )
     loc = y_obs[noisy_idx]
     scale = sig_obs[noisy_idx]
 
-    cnt = 0
-    cnt_timeout = 0
-    timeout_flag = False
-    while cnt < run_params["nmc"]:
+    def draw():
+        realisations = []
         samp_y_guess = np.copy(observed)
 
         # first, fill in the missing bands
@@ -647,62 +643,33 @@ def sbi_missing_and_noisy(obs, run_params, sbi_params):
                 chc = np.random.choice(range(len(y_train[idx_chi2_selected])))
                 samp_y_guess[22:][idx] = y_train[idx_chi2_selected][chc][22:][idx]
 
-            # if we can't get one posterior sample in one second, we should move along
-            # to the next MC sample
-            do_continue = False
-            for tmax, npost in zip(
-                [1, run_params["tmax_per_iter"]], [1, run_params["nposterior"]]
-            ):
-                signal.alarm(tmax)  # max time spent on one object in sec
-                try:
-                    noiseless_theta = hatp_x_y.sample(
-                        (npost,),
-                        x=torch.as_tensor(samp_y_guess).to(device),
-                        show_progress_bars=False,
-                    )
-                except TimeoutException:
-                    signal.alarm(0)
-                    do_continue = True
-                    break
+            realisations.append(np.copy(samp_y_guess))
+        return realisations
 
-            if do_continue:
-                continue
+    return draw, use_res_missing == 1 and use_res_noisy == 1
 
-            signal.alarm(0)
-            noiseless_theta = noiseless_theta.detach().numpy()
 
-            ave_theta.append(noiseless_theta)
-
-            cnt += 1
-            if run_params["verbose"]:
-                if cnt % 10 == 0:
-                    print("mc samples:", cnt)
-
-        # end time
-        et = time.time()
-        elapsed_time = et - st  # in secs
-        if elapsed_time / 60 > run_params["tmax_all"] or (
-            cnt < run_params["nmc"] / 10
-            and elapsed_time / 60 * 10 > run_params["tmax_all"]
-        ):
-            timeout_flag = 1
-            use_res = 0
-            break
-    # ------------------------------------------------
-
-    if use_res_missing == 1 and use_res_noisy == 1 and timeout_flag == 0:
-        use_res = 1
+def sbi_missing_and_noisy(obs, run_params, sbi_params):
+    """used when observations have missing data and out-of-distribution uncertainties.
+    fill in the missing bands first using the nearest neighbor approximation;
+    then mc the noisy bands
+    """
 
-    return ave_theta, use_res, timeout_flag, cnt
+    if run_params["verbose"]:
+        print("sbi missing and noisy bands")
 
+    draw, use_res = missing_and_noisy_draw(obs, run_params, sbi_params)
+    ((ave_theta, all_x, timeout_flag, cnt),) = mc_sample(
+        sbi_params["hatp_x_y"], [draw], run_params
+    )
+    use_res = int(use_res and not timeout_flag)
 
-def sbi_baseline(obs, run_params, sbi_params, max_neighbors=200):
-    signal.signal(signal.SIGALRM, timeout_handler)
+    return ave_theta, use_res, int(timeout_flag), cnt
 
-    if run_params["verbose"]:
-        print("baseline sbi")
 
-    flags = {
+def new_flags():
+    """bookkeeping flags returned by sbi_pp"""
+    return {
         "use_res": 0,  # True if sbi++ succeeds; False if otherwise.
         # below are for bookkeeping
         "timeout": 0,
@@ -714,7 +681,15 @@ def sbi_baseline(obs, run_params, sbi_params, max_neighbors=200):
         "nsamp_noisy": -99,  # number of MC samples drawn
     }
 
-    hatp_x_y = sbi_params["hatp_x_y"]
+
+def prepare_obs(obs, run_params, sbi_params):
+    """copy the observed data to be used by sbi and decide if we need to deal with
+    missing and/or noisy bands; sets obs["missing_mask"] and obs["noisy_mask"]
+
+    returns the flags of the object
+    """
+    flags = new_flags()
+
     y_train = sbi_params["y_train"]
 
     y_obs = np.copy(obs["mags"])
@@ -723,24 +698,58 @@ def sbi_baseline(obs, run_params, sbi_params, max_neighbors=200):
     # missing data, if any, will be filled in later
     obs["mags_sbi"] = y_obs
     obs["mags_unc_sbi"] = sig_obs
-    observed = np.concatenate([y_obs, sig_obs, [obs["redshift"]]])
     nbands = y_train.shape[1] // 2  # total number of bands
 
-    flags["use_res"] = 1
-    flags["timeout"] = False
+    # decide if we need to deal with missing bands
+    obs["missing_mask"] = np.isnan(y_obs)
+    missing_mask = np.isnan(y_obs)  # idx of missing bands
+    # decide if we need to deal with noisy bands
+    noisy_mask = np.zeros_like(y_obs, dtype=bool)
+    for j in range(nbands):
+        _toynoise = toy_noise(
+            flux=y_obs[j],
+            meds_sigs=sbi_params["toynoise_meds_sigs"][j],
+            stds_sigs=sbi_params["toynoise_stds_sigs"][j],
+            verbose=run_params["verbose"],
+        )
+        noisy_mask[j] = (sig_obs[j] - _toynoise[1]) / _toynoise[2] >= run_params[
+            "noisy_sig"
+        ]
+        # if noisy_mask[j]:
+        #    import pdb; pdb.set_trace()
+    noisy_mask &= np.isfinite(y_obs)  # idx of noisy bands
+    obs["noisy_mask"] = noisy_mask
 
-    ### temporary for getting errors, because error model not good enough
-    chi2_nei = chi2dof(mags=y_train[:, :22], obsphot=y_obs, obsphot_unc=sig_obs)
+    if np.any(missing_mask):
+        flags["missing_data"] = True
+    if np.any(noisy_mask):
+        flags["noisy_data"] = True
 
-    _chi2_thres = run_params["ini_chi2"] * 1
-    while _chi2_thres <= run_params["max_chi2"]:
-        idx_chi2_selected = np.where(chi2_nei <= _chi2_thres)[0]
-        if len(idx_chi2_selected) >= 30:
-            break
-        else:
-            _chi2_thres += 5
+    return flags
+
+
+def baseline_x(obs, run_params, sbi_params, max_neighbors=200):
+    """observed data passed to baseline sbi, with the uncertainties drawn
+    from the nearest neighbors in the training set
+    """
+    y_train = sbi_params["y_train"]
 
-    if _chi2_thres > run_params["max_chi2"]:
+    y_obs = np.copy(obs["mags"])
+    sig_obs = np.copy(obs["mags_unc"])
+
+    ### temporary for getting errors, because error model not good enough
+    index = training_set_index(sbi_params)
+    idx_chi2_selected, _chi2_thres = index.within_chi2(
+        np.arange(22),
+        y_obs,
+        sig_obs,
+        k=30,
+        ini_chi2=run_params["ini_chi2"],
+        max_chi2=run_params["max_chi2"],
+    )
+
+    if idx_chi2_selected is None:
+        chi2_nei = index.chi2(np.arange(22), y_obs, sig_obs)
         chi2_selected = y_train[:]
         idx_chi2_selected = np.argsort(chi2_nei)[0:max_neighbors]
         if run_params["verbose"]:
@@ -748,30 +757,44 @@ def sbi_baseline(obs, run_params, sbi_params, max_neighbors=200):
     else:
         chi2_selected = y_train[idx_chi2_selected]
 
-    # ------------------------------------------------
-    # call baseline sbi to draw posterior samples
-    signal.alarm(run_params["tmax_per_obj"])  # max time spent on one object in sec
-
     x = np.concatenate([y_obs, sig_obs, [obs["redshift"]]])
 
     for idx, fname in enumerate(obs["filternames"]):
         chc = np.random.choice(range(len(y_train[idx_chi2_selected])))
         x[22:-1][idx] = y_train[idx_chi2_selected][chc][22:-1][idx]
 
-    try:
-        ave_theta = hatp_x_y.sample(
-            (run_params["np_baseline"],),
-            x=torch.as_tensor(x.astype(np.float32)).to(device),
-            show_progress_bars=False,
-        )
-        ave_theta = ave_theta.detach().numpy()
-    except TimeoutException:
+    return x
+
+
+def sbi_baseline(obs, run_params, sbi_params, max_neighbors=200):
+    if run_params["verbose"]:
+        print("baseline sbi")
+
+    flags = new_flags()
+
+    # copy the observed data to be used by sbi
+    obs["mags_sbi"] = np.copy(obs["mags"])
+    obs["mags_unc_sbi"] = np.copy(obs["mags_unc"])
+
+    flags["use_res"] = 1
+    flags["timeout"] = False
+
+    # ------------------------------------------------
+    # call baseline sbi to draw posterior samples
+    x = baseline_x(obs, run_params, sbi_params, max_neighbors)
+
+    # max time spent on one object in sec
+    (ave_theta,) = sample_posterior_batched(
+        sbi_params["hatp_x_y"],
+        [x],
+        run_params["np_baseline"],
+        max_seconds=run_params["tmax_per_obj"],
+    )
+    if ave_theta is None:
         flags["timeout"] = True
         ave_theta = [np.nan]
         if run_params["verbose"]:
             print("timeout!")
-    else:
-        signal.alarm(0)
     # ------------------------------------------------
 
     return ave_theta, obs, flags
@@ -787,57 +810,9 @@ def sbi_pp(obs, run_params, sbi_params, max_neighbors=200):
         - ""
 
     """
-    signal.signal(signal.SIGALRM, timeout_handler)
-
-    flags = {
-        "use_res": 0,  # True if sbi++ succeeds; False if otherwise.
-        # below are for bookkeeping
-        "timeout": 0,
-        "use_res_missing": 0,  # True if sbi++ for missing bands succeeds
-        "use_res_noisy": 0,  # True if sbi++ for noisy bands succeeds
-        "noisy_data": False,  # True if sbi++ (noisy data) is called
-        "missing_data": False,  # True if sbi++ (missing data) is called
-        "nsamp_missing": -99,  # number of MC samples drawn
-        "nsamp_noisy": -99,  # number of MC samples drawn
-    }
-
-    hatp_x_y = sbi_params["hatp_x_y"]
-    y_train = sbi_params["y_train"]
-
-    y_obs = np.copy(obs["mags"])
-    sig_obs = np.copy(obs["mags_unc"])
-    # copy the observed data to be used by sbi
-    # missing data, if any, will be filled in later
-    obs["mags_sbi"] = y_obs
-    obs["mags_unc_sbi"] = sig_obs
-    observed = np.concatenate([y_obs, sig_obs, [obs["redshift"]]])
-    nbands = y_train.shape[1] // 2  # total number of bands
-
-    # decide if we need to deal with missing bands
-    obs["missing_mask"] = np.isnan(y_obs)
-    missing_mask = np.isnan(y_obs)  # idx of missing bands
-    # decide if we need to deal with noisy bands
-    noisy_mask = np.zeros_like(y_obs, dtype=bool)
-    for j in range(nbands):
-        _toynoise = toy_noise(
-            flux=y_obs[j],
-            meds_sigs=sbi_params["toynoise_meds_sigs"][j],
-            stds_sigs=sbi_params["toynoise_stds_sigs"][j],
-            verbose=run_params["verbose"],
-        )
-        noisy_mask[j] = (sig_obs[j] - _toynoise[1]) / _toynoise[2] >= run_params[
-            "noisy_sig"
-        ]
-        # if noisy_mask[j]:
-        #    import pdb; pdb.set_trace()
-    noisy_mask &= np.isfinite(y_obs)  # idx of noisy bands
-    obs["noisy_mask"] = noisy_mask
+    flags = prepare_obs(obs, run_params, sbi_params)
 
     ave_theta = [np.nan]
-    if np.any(missing_mask):
-        flags["missing_data"] = True
-    if np.any(noisy_mask):
-        flags["noisy_data"] = True
 
     if not flags["missing_data"] and not flags["noisy_data"]:
         flags["use_res"] = 1
@@ -845,45 +820,18 @@ def sbi_pp(obs, run_params, sbi_params, max_neighbors=200):
         if run_params["verbose"]:
             print("baseline sbi")
 
-        ### temporary for getting errors, because error model not good enough
-        chi2_nei = chi2dof(mags=y_train[:, :22], obsphot=y_obs, obsphot_unc=sig_obs)
-
-        _chi2_thres = run_params["ini_chi2"] * 1
-        while _chi2_thres <= run_params["max_chi2"]:
-            idx_chi2_selected = np.where(chi2_nei <= _chi2_thres)[0]
-            if len(idx_chi2_selected) >= 30:
-                break
-            else:
-                _chi2_thres += 5
-
-        if _chi2_thres > run_params["max_chi2"]:
-            chi2_selected = y_train[:]
-            idx_chi2_selected = np.argsort(chi2_nei)[0:max_neighbors]
-            if run_params["verbose"]:
-                print("Failed to find sufficient number of nearest neighbors!")
-        else:
-            chi2_selected = y_train[idx_chi2_selected]
-
-        signal.alarm(run_params["tmax_per_obj"])  # max time spent on one object in sec
-
-        x = np.concatenate([y_obs, sig_obs, [obs["redshift"]]])
-
-        for idx, fname in enumerate(obs["filternames"]):
-            chc = np.random.choice(range(len(y_train[idx_chi2_selected])))
-            x[22:-1][idx] = y_train[idx_chi2_selected][chc][22:-1][idx]
+        x = baseline_x(obs, run_params, sbi_params, max_neighbors)
 
-        try:
-            ave_theta = hatp_x_y.sample(
-                (run_params["np_baseline"],),
-                x=torch.as_tensor(x.astype(np.float32)).to(device),
-                show_progress_bars=False,
-            )
-            ave_theta = ave_theta.detach().numpy()
-        except TimeoutException:
+        # max time spent on one object in sec
+        (ave_theta,) = sample_posterior_batched(
+            sbi_params["hatp_x_y"],
+            [x],
+            run_params["np_baseline"],
+            max_seconds=run_params["tmax_per_obj"],
+        )
+        if ave_theta is None:
             flags["timeout"] = True
             ave_theta = [np.nan]
-        else:
-            signal.alarm(0)
 
         return ave_theta, obs, flags
 
@@ -988,3 +936,85 @@ def sbi_pp(obs, run_params, sbi_params, max_neighbors=200):
         pass
 
     return ave_theta, obs, flags
+
+
+def sbi_pp_batch(obs_list, run_params, sbi_params, max_neighbors=200):
+    """sbi++ for many objects at once, with the same training set and trained posterior.
+    the baseline objects are sampled in a single call, and the monte carlo realisations
+    of all the objects with missing and/or noisy bands are sampled together.
+    objects that time out are retried on their own with sbi_pp, which drops problematic filters.
+
+    returns one (ave_theta, obs, flags) tuple per object, as sbi_pp would
+    """
+    hatp_x_y = sbi_params["hatp_x_y"]
+    results = [None] * len(obs_list)
+    all_flags = [prepare_obs(obs, run_params, sbi_params) for obs in obs_list]
+
+    # baseline sbi
+    baseline = [
+        i
+        for i, flags in enumerate(all_flags)
+        if not flags["missing_data"] and not flags["noisy_data"]
+    ]
+    if len(baseline):
+        if run_params["verbose"]:
+            print(f"baseline sbi for {len(baseline)} objects")
+        xs = [
+            baseline_x(obs_list[i], run_params, sbi_params, max_neighbors)
+            for i in baseline
+        ]
+        theta = sample_posterior_batched(
+            hatp_x_y,
+            xs,
+            run_params["np_baseline"],
+            max_seconds=run_params["tmax_per_obj"] * len(xs),
+        )
+        for i, ave_theta in zip(baseline, theta):
+            all_flags[i]["use_res"] = 1
+            all_flags[i]["timeout"] = ave_theta is None
+            if ave_theta is None:
+                ave_theta = [np.nan]
+            results[i] = (ave_theta, obs_list[i], all_flags[i])
+
+    # monte carlo over the missing and/or noisy bands
+    mc, draws, use_res = [], [], []
+    for i, flags in enumerate(all_flags):
+        if results[i] is not None:
+            continue
+        if flags["missing_data"] and flags["noisy_data"]:
+            draw, _use_res = missing_and_noisy_draw(obs_list[i], run_params, sbi_params)
+        elif flags["missing_data"]:
+            draw, _use_res = missingband_draw(obs_list[i], run_params, sbi_params)
+        else:
+            draw, _use_res = mcnoise_draw(
+                obs_list[i], run_params, sbi_params, max_neighbors
+            )
+        mc.append(i)
+        draws.append(draw)
+        use_res.append(_use_res)
+
+    if len(mc) and run_params["verbose"]:
+        print(f"sbi++ monte carlo for {len(mc)} objects")
+    mc_results = mc_sample(hatp_x_y, draws, run_params) if len(mc) else []
+    for i, _use_res, (ave_theta, all_x, timeout_flag, cnt) in zip(
+        mc, use_res, mc_results
+    ):
+        if timeout_flag:
+            results[i] = sbi_pp(obs_list[i], run_params, sbi_params, max_neighbors)
+            continue
+
+        flags = all_flags[i]
+        flags["timeout"] = False
+        if flags["missing_data"] and flags["noisy_data"]:
+            flags["use_res"] = int(_use_res)
+            flags["nsamp_noisy"] = cnt
+        elif flags["missing_data"]:
+            flags["use_res_missing"] = _use_res
+            flags["nsamp_missing"] = cnt
+            flags["use_res"] = flags["use_res_missing"] * 1
+        else:
+            flags["use_res_noisy"] = _use_res
+            flags["use_res"] = flags["use_res_noisy"] * 1
+        results[i] = (np.concatenate(ave_theta), obs_list[i], flags)
+
+    return results
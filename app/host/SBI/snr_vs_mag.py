@@ -7,6 +7,7 @@ Just ASCII file output should be fine
 import h5py
 import numpy as np
 from host.models import *
+from host.SBI import noise_model
 from scipy.stats import binned_statistic
 
 
@@ -42,4 +43,7 @@ def main():
             for m, s in zip(magbins, snr_bins_interp):
                 print(f"{m:.3f} {s:.3f}", file=fout)
 
+    # the sbi++ workers reload the toy noise model when the bundle changes
+    noise_model.write_bundle()
+
     return
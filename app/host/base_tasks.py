@@ -4,13 +4,17 @@ from abc import abstractmethod
 from time import process_time
 
 from billiard.exceptions import SoftTimeLimitExceeded
+from django.db import transaction
 from django.db.models import Q
 from django.utils import timezone
 
+from .models import SciencePayloadVersion
+from .models import SkyObject
 from .models import Status
 from .models import Task
 from .models import TaskRegister
 from .models import Transient
+from .models import TransientTaskCounts
 
 task_time_limit = int(os.environ.get("TASK_TIME_LIMIT", "3800"))
 task_soft_time_limit = int(os.environ.get("TASK_SOFT_TIME_LIMIT", "3600"))
@@ -19,81 +23,50 @@ task_soft_time_limit = int(os.environ.get("TASK_SOFT_TIME_LIMIT", "3600"))
 
 
 def get_progress(transient_name):
-    tasks = TaskRegister.objects.filter(Q(transient__name__exact=transient_name) &
-                                        ~Q(task__name="Log transient processing status"))
-    failed_tasks = tasks.filter(status__type='error')
-    completed_tasks = tasks.filter(status__type='success')
-    incomplete_tasks = tasks.filter(status__type='blank')
-    
-    total_tasks = len(tasks)
-    completed_tasks = len(
-        [task for task in tasks if task.status.message == "processed"]
-    )
-    if not len(failed_tasks):
-        progress = 100 * (1 - len(incomplete_tasks) / total_tasks) if total_tasks > 0 else 0
-    else:
-        remaining_tasks = len(incomplete_tasks)
-        for task_name in [
-                'Cutout download','Transient information','MWEBV transient',
-                'Host match','Host information']:
-            if failed_tasks.filter(task__name=task_name).exists():
-                remaining_tasks = 0
-                break
-        if remaining_tasks == 0:
-            progress = 100
-        else:
-            # local chain
-            if failed_tasks.filter(task__name='Local aperture photometry'): remaining_tasks -= 2
-            elif failed_tasks.filter(task__name='Validate local photometry'): remaining_tasks -= 1
-
-            # global chain
-            if failed_tasks.filter(task__name='MWEBV host').exists() or \
-               failed_tasks.filter(task__name='Validate global photometry').exists(): remaining_tasks -= 1
-            elif failed_tasks.filter(task__name='Global aperture photometry'): remaining_tasks -= 2
-            elif failed_tasks.filter(task__name='Global aperture construction'): remaining_tasks -= 3
+    """
+    Progress of a transient in percent, read from its task counts.
 
-            progress = 100 * (1 - remaining_tasks / total_tasks)
-        
-    return int(round(progress, 0))
+    Parameters:
+        transient_name (str): Name of the transient.
+    Returns:
+        progress (int): percentage of tasks no longer waiting to be processed.
+    """
+    counts = TransientTaskCounts.objects.filter(
+        transient__name__exact=transient_name
+    ).first()
+    return counts.progress if counts is not None else 0
 
 
 def get_processing_status(transient):
-    tasks = TaskRegister.objects.filter(
-        Q(transient__name__exact=transient.name)
-        & ~Q(task__name="Log transient processing status")
-    )
-    processing_task_qs = TaskRegister.objects.filter(
-        transient__name__exact=transient.name,
-        task__name="Log transient processing status",
-    )
+    """
+    Processing status of a transient, read from its task counts.
 
-    total_tasks = len(tasks)
-    completed_tasks = len(
-        [task for task in tasks if task.status.message == "processed"]
-    )
-    blocked = len([task for task in tasks if task.status.type == "error"])
-
-    progress = "processing"
-
-    if total_tasks == 0:
-        progress = "processing"
-    elif total_tasks == completed_tasks:
-        progress = "completed"
-    elif total_tasks < completed_tasks:
-        progress = "processing"
-    elif blocked > 0:
-        progress = "blocked"
-
-    # save task
-    if len(processing_task_qs) == 1:
-        processing_task = processing_task_qs[0]
-        processing_task.status = Status.objects.get(
-            message=progress if progress != "completed" else "processed"
-        )
-        processing_task.save()
+    Parameters:
+        transient (models.Transient): Transient to get the status of.
+    Returns:
+        processing status (str): "processing", "blocked" or "completed".
+    """
+    counts = TransientTaskCounts.objects.filter(transient=transient).first()
+    return counts.processing_status if counts is not None else "processing"
+
+
+def update_register_statuses(task_register, updated_status):
+    """
+    Update the status of many task register items with one query and rebuild
+    the task counts of the transients they belong to.
 
-    # save transient progress
-    return progress
+    Parameters:
+        task_register (QuerySet): task register items to update.
+        updated_status (models.Status): new status of the items.
+    Returns:
+        None: Saves the new updates to the backend.
+    """
+    with transaction.atomic():
+        transients = Transient.objects.filter(
+            pk__in=list(task_register.values_list("transient_id", flat=True))
+        )
+        task_register.update(status=updated_status, last_modified=timezone.now())
+        TransientTaskCounts.rebuild(transients)
 
 
 class TaskRunner(ABC):
@@ -137,6 +110,41 @@ class TaskRunner(ABC):
         except model.DoesNotExist:
             model.objects.create(**object_data)
 
+    def _bulk_overwrite_or_create_objects(self, model, unique_fields, objects_data):
+        """
+        Overwrites or creates many objects in the blast database at once.
+
+        All existing objects matching any of the new objects on the unique
+        fields are deleted with a single query and the new objects are then
+        inserted with a single bulk_create, both in one transaction.
+
+        Parameters
+            model (dango.model): blast model of the objects that need to be updated
+            unique_fields (list[str]): fields that together uniquely identify an
+                object of interest
+            objects_data (list[dict]): data to be saved or overwritten for each
+                object.
+        """
+        if not len(objects_data):
+            return
+
+        unique_object_query = Q()
+        for object_data in objects_data:
+            unique_object_query |= Q(
+                **{field: object_data[field] for field in unique_fields}
+            )
+
+        objects = [model(**object_data) for object_data in objects_data]
+        if issubclass(model, SkyObject):
+            # bulk_create does not call save, which sets the HEALPix pixels
+            SkyObject.update_healpix_indices(objects)
+
+        # the delete sends a signal per object, each bumping the payload
+        # version of its transient, so bump them once instead
+        with transaction.atomic(), SciencePayloadVersion.deferred_bumps():
+            model.objects.filter(unique_object_query).delete()
+            model.objects.bulk_create(objects)
+
     @property
     def task_frequency_seconds(self) -> int:
         """
@@ -201,6 +209,8 @@ class TransientTaskRunner(TaskRunner):
         failed_status (model.Status): Status of the task is if the runner fails.
         prerequisites (dict): Prerequisite tasks and statuses required for the
             runner to process.
+        dependencies (list): Tasks that have to finish before the runner is
+            scheduled in the transient workflow.
     """
 
     def __init__(self, transient_name=None):
@@ -209,6 +219,7 @@ class TransientTaskRunner(TaskRunner):
         """
 
         self.prerequisites = self._prerequisites()
+        self.dependencies = self._dependencies()
         assert transient_name
         self.transient_name = transient_name
 
@@ -219,24 +230,29 @@ class TransientTaskRunner(TaskRunner):
         Returns:
             (QuerySet): Task register items meeting prerequisites.
         """
-        task = Task.objects.get(name__exact=self.task_name)
-        task_register = TaskRegister.objects.all()
-        if self.transient_name:
-            current_transients = Transient.objects.filter(
-                name__exact=self.transient_name
-            )
-        else:
-            current_transients = Transient.objects.all()
+        statuses = transient_task_statuses(self.transient_name)
+        if not self.prerequisites_met(statuses):
+            return TaskRegister.objects.none()
 
-        for task_name, status_message in self.prerequisites.items():
-            task_prereq = Task.objects.get(name__exact=task_name)
-            status = Status.objects.get(message__exact=status_message)
+        return TaskRegister.objects.filter(
+            transient__name__exact=self.transient_name,
+            task__name__exact=self.task_name,
+        )
 
-            current_transients = current_transients & Transient.objects.filter(
-                taskregister__task=task_prereq, taskregister__status=status
-            )
+    def prerequisites_met(self, statuses):
+        """
+        Checks the prerequisites against the task statuses of a transient.
 
-        return task_register.filter(transient__in=list(current_transients), task=task)
+        Parameters:
+            statuses (dict): task name to status message of every task of the
+                transient, as returned by transient_task_statuses.
+        Returns:
+            (bool): True if every prerequisite task has the required status.
+        """
+        return all(
+            statuses.get(task_name) == status_message
+            for task_name, status_message in self.prerequisites.items()
+        )
 
     def _select_highest_priority(self, register):
         """
@@ -261,9 +277,7 @@ class TransientTaskRunner(TaskRunner):
         Returns:
             None: Saves the new updates to the backend.
         """
-        task_status.status = updated_status
-        task_status.last_modified = timezone.now()
-        task_status.save()
+        update_status(task_status, updated_status)
 
     def select_register_item(self):
         """
@@ -302,13 +316,9 @@ class TransientTaskRunner(TaskRunner):
             finally:
                 end_time = process_time()
                 status = Status.objects.get(message__exact=status_message)
-                self._update_status(task_register_item, status)
                 processing_time = round(end_time - start_time, 2)
                 task_register_item.last_processing_time_seconds = processing_time
-                task_register_item.save()
-                transient.progress = get_progress(transient.name)
-                transient.processing_status = get_processing_status(transient)
-                transient.save()
+                self._update_status(task_register_item, status)
             return transient.name
 
     @abstractmethod
@@ -336,6 +346,21 @@ class TransientTaskRunner(TaskRunner):
         """
         pass
 
+    def _dependencies(self):
+        """
+        Tasks that have to finish before the runner is scheduled in the
+        transient workflow. Defaults to the prerequisite tasks that need to be
+        processed; child classes can add tasks that only need to run first.
+
+        Returns:
+            dependencies (list): names of the parent tasks.
+        """
+        return [
+            task_name
+            for task_name, status_message in self.prerequisites.items()
+            if status_message == "processed"
+        ]
+
     @abstractmethod
     def _failed_status_message(self):
         """
@@ -393,14 +418,31 @@ def update_status(task_status, updated_status):
 
     Parameters:
         task_status (models.TaskProcessingStatus): task processing status to be
-            updated.
+            updated, as last read from the database.
         updated_status (models.Status): new status to update the task with.
     Returns:
         None: Saves the new updates to the backend.
     """
+    previous_status_id = task_status.status_id if task_status.pk is not None else None
     task_status.status = updated_status
     task_status.last_modified = timezone.now()
-    task_status.save()
+    task_status.save(previous_status_id=previous_status_id)
+
+
+def transient_task_statuses(transient_name):
+    """
+    Get the status of every task of a transient with a single query.
+
+    Parameters:
+        transient_name (str): Name of the transient.
+    Returns:
+        statuses (dict): task name to status message.
+    """
+    return dict(
+        TaskRegister.objects.filter(transient__name__exact=transient_name).values_list(
+            "task__name", "status__message"
+        )
+    )
 
 
 def initialise_all_tasks_status(transient):
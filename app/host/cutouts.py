@@ -1,6 +1,8 @@
 import os
 import re
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 
 import astropy.table as at
@@ -8,7 +10,6 @@ import astropy.units as u
 import astropy.utils.data
 import numpy as np
 import pandas as pd
-import requests
 from astropy.coordinates import SkyCoord
 from astropy.io import fits
 from astropy.nddata import Cutout2D
@@ -24,11 +25,18 @@ from dl import queryClient as qc
 from dl import storeClient as sc
 from pyvo.dal import sia
 
+from .frame_cache import frame_cache_stats
+from .frame_cache import open_cached_fits
+from .host_utils import remove_cutout_sidecars
+from .http_sessions import http_get
+from .http_sessions import session_stats
 from .models import Cutout
 from .models import Filter
 
 DOWNLOAD_SLEEP_TIME = int(os.environ.get("DOWNLOAD_SLEEP_TIME", "0"))
 DOWNLOAD_MAX_TRIES = int(os.environ.get("DOWNLOAD_MAX_TRIES", "1"))
+DOWNLOAD_MAX_WORKERS = int(os.environ.get("DOWNLOAD_MAX_WORKERS", "8"))
+DOWNLOAD_MAX_PER_SURVEY = int(os.environ.get("DOWNLOAD_MAX_PER_SURVEY", "2"))
 
 # from host import SkyServer
 
@@ -75,9 +83,17 @@ def download_and_save_cutouts(
     fov=Quantity(0.1, unit="deg"),
     media_root=settings.CUTOUT_ROOT,
     overwrite=settings.CUTOUT_OVERWRITE,
+    max_workers=DOWNLOAD_MAX_WORKERS,
+    max_per_survey=DOWNLOAD_MAX_PER_SURVEY,
 ):
     """
     Download all available imaging from a list of surveys
+
+    The downloads for every filter are fanned out over a thread pool, with
+    at most ``max_per_survey`` requests in flight against any one survey.
+    All database bookkeeping happens serially in the calling thread, in the
+    same order as ``Filter.objects.all()``.
+
     Parameters
     ----------
     :position : :class:`~astropy.coordinates.SkyCoord`
@@ -89,6 +105,10 @@ def download_and_save_cutouts(
         Field of view of the cutout image, angular length of one of the sides
         of the square cutout. Angular astropy quantity. Default is angular
         length of 0.2 degrees.
+    :max_workers : int
+        Maximum number of concurrent downloads across all surveys.
+    :max_per_survey : int
+        Maximum number of concurrent downloads against a single survey.
     Returns
     -------
     :images dictionary : dict[str: :class:`~astropy.io.fits.HDUList`]
@@ -96,7 +116,9 @@ def download_and_save_cutouts(
         as values.
     """
 
-    for filter in Filter.objects.all():
+    # work out which filters need downloading before touching the network
+    jobs = []
+    for filter in Filter.objects.select_related("survey"):
         save_dir = f"{media_root}/{transient.name}/{filter.survey.name}/"
         path_to_fits = save_dir + f"{filter.name}.fits"
         file_exists = os.path.exists(path_to_fits)
@@ -113,37 +135,128 @@ def download_and_save_cutouts(
             cutout_object = cutout_object[0]
             cutout_exists = True
 
-        fits = None
         if (
             (not file_exists or not cutout_exists)
             and cutout_object.message != "No image found"
         ) or not overwrite == "False":
-            if not file_exists and cutout_object.message != "No image found":
-                fits, status, err = cutout(transient.sky_coord, filter, fov=fov)
-
-                if fits:
-                    save_dir = f"{media_root}/{transient.name}/{filter.survey.name}/"
-                    os.makedirs(save_dir, exist_ok=True)
-                    path_to_fits = save_dir + f"{filter.name}.fits"
-                    fits.writeto(path_to_fits, overwrite=True)
+            needs_download = (
+                not file_exists and cutout_object.message != "No image found"
+            )
+            jobs += [(filter, cutout_object, path_to_fits, file_exists, needs_download)]
 
-            # if there is data, save path to the file
-            # otherwise record that we searched and couldn't find anything
-            if file_exists or fits:
-                cutout_object.fits.name = path_to_fits
-                cutout_object.save()
+    downloads = download_cutouts_concurrently(
+        transient.sky_coord,
+        [job[0] for job in jobs if job[4]],
+        fov=fov,
+        max_workers=max_workers,
+        max_per_survey=max_per_survey,
+    )
 
-            elif status == 1:
-                cutout_object.message = "Download error"
-                cutout_object.save()
+    for filter, cutout_object, path_to_fits, file_exists, needs_download in jobs:
+        fits, status, err = downloads.get(filter.name, (None, 0, None))
+        if fits:
+            save_dir = f"{media_root}/{transient.name}/{filter.survey.name}/"
+            os.makedirs(save_dir, exist_ok=True)
+            fits.writeto(path_to_fits, overwrite=True)
+            # cached background and segmentation maps belong to the previous download
+            remove_cutout_sidecars(path_to_fits)
+
+        # if there is data, save path to the file
+        # otherwise record that we searched and couldn't find anything
+        if file_exists or fits:
+            cutout_object.fits.name = path_to_fits
+            cutout_object.save()
+
+        elif status == 1:
+            cutout_object.message = "Download error"
+            cutout_object.save()
 
-            else:
-                cutout_object.message = "No image found"
-                cutout_object.save()
+        else:
+            cutout_object.message = "No image found"
+            cutout_object.save()
 
     return "processed"
 
 
+def download_cutouts_concurrently(
+    position,
+    filters,
+    fov=Quantity(0.1, unit="deg"),
+    max_workers=DOWNLOAD_MAX_WORKERS,
+    max_per_survey=DOWNLOAD_MAX_PER_SURVEY,
+):
+    """
+    Download cutouts for many filters at once using a thread pool.
+
+    Parameters
+    ----------
+    :position : :class:`~astropy.coordinates.SkyCoord`
+        Target centre position of the cutout images to be downloaded.
+    :filters : list[Filter]
+        Filters to download cutouts for.
+    :fov : :class:`~astropy.units.Quantity`
+        Field of view of the cutout images.
+    :max_workers : int
+        Maximum number of concurrent downloads across all surveys.
+    :max_per_survey : int
+        Maximum number of concurrent downloads against a single survey.
+    Returns
+    -------
+    :downloads : dict[str: tuple]
+        The ``(fits, status, err)`` result of :func:`cutout` keyed by
+        filter name.
+    """
+    if not len(filters):
+        return {}
+
+    # clear the download cache once up front rather than once per filter,
+    # otherwise concurrent downloads can delete each other's cached files
+    astropy.utils.data.clear_download_cache()
+
+    survey_names = {filter.survey.name for filter in filters}
+    survey_slots = {
+        name: threading.BoundedSemaphore(max(max_per_survey, 1))
+        for name in survey_names
+    }
+    survey_times = {name: [] for name in survey_names}
+
+    def download(filter):
+        survey_name = filter.survey.name
+        with survey_slots[survey_name]:
+            start_time = time.monotonic()
+            try:
+                return cutout(position, filter, fov=fov, clear_cache=False)
+            except Exception as err:
+                # a failing survey must not lose the downloads of the others
+                print(f"Could not download {filter.name} data")
+                print(f"exception: {err}")
+                return None, 1, err
+            finally:
+                survey_times[survey_name] += [(start_time, time.monotonic())]
+
+    with ThreadPoolExecutor(max_workers=max(max_workers, 1)) as executor:
+        futures = {filter.name: executor.submit(download, filter) for filter in filters}
+        downloads = {name: future.result() for name, future in futures.items()}
+
+    for survey_name, times in sorted(survey_times.items()):
+        wall_time = max(end for _, end in times) - min(start for start, _ in times)
+        print(
+            f"{survey_name}: downloaded {len(times)} cutouts in {wall_time:.2f} seconds"
+        )
+    for host, stats in sorted(session_stats().items()):
+        print(
+            f"{host}: {stats['requests']} requests, {stats['bytes']} bytes, "
+            f"connection reuse ratio {stats['reuse_ratio']:.2f}"
+        )
+    stats = frame_cache_stats()
+    print(
+        f"frame cache: {stats['hits']} hits, {stats['misses']} misses, "
+        f"hit rate {stats['hit_rate']:.2f}"
+    )
+
+    return downloads
+
+
 def panstarrs_image_filename(position, image_size=None, filter=None):
     """Query panstarrs service to get a list of image names
 
@@ -166,7 +279,7 @@ def panstarrs_image_filename(position, image_size=None, filter=None):
 
     ### was having SSL errors with pandas, so let's run it through requests
     ### optionally, can edit to do this in an unsafe way
-    r = requests.get(url, stream=True)
+    r = http_get(url, stream=True)
     r.raw.decode_content = True
     filename_table = pd.read_csv(r.raw, sep="\s+")["filename"]
     return filename_table[0] if len(filename_table) > 0 else None
@@ -226,11 +339,7 @@ def panstarrs_cutout(position, image_size=None, filter=None):
             f"{service}ra={position.ra.degree}&dec={position.dec.degree}"
             f"&size={image_size}&format=fits&red={filename}"
         )
-        try:
-            r = requests.get(fits_url, stream=True)
-        except Exception as e:
-            time.sleep(5)
-            r = requests.get(fits_url, stream=True)
+        r = http_get(fits_url)
         fits_image = fits.open(BytesIO(r.content))
 
     else:
@@ -272,15 +381,14 @@ def galex_cutout(position, image_size=None, filter=None):
     if len(obs):
         ### stupid MAST thinks we want the exposure time map
 
-        fits_image = fits.open(
+        fits_image = open_cached_fits(
             obs["dataURL"][0]
             .replace("-exp.fits.gz", "-int.fits.gz")
             .replace("-gsp.fits.gz", "-int.fits.gz")
             .replace("-rr.fits.gz", "-int.fits.gz")
             .replace("-cnt.fits.gz", "-int.fits.gz")
             .replace("-fcat.ds9reg", "-int.fits.gz")
-            .replace("-xd-mcat.fits.gz", f"-{filter[0].lower()}d-int.fits.gz"),
-            cache=None,
+            .replace("-xd-mcat.fits.gz", f"-{filter[0].lower()}d-int.fits.gz")
         )
 
         wcs = WCS(fits_image[0].header)
@@ -318,7 +426,7 @@ def WISE_cutout(position, image_size=None, filter=None):
     }
 
     url = f"https://irsa.ipac.caltech.edu/SIA?COLLECTION=wise_allwise&POS=circle+{position.ra.deg}+{position.dec.deg}+0.002777&RESPONSEFORMAT=CSV&BAND={band_to_wavelength[filter]}&FORMAT=image/fits"
-    r = requests.get(url)
+    r = http_get(url)
     url = None
     for t in r.text.split(","):
         if t.startswith("https"):
@@ -341,7 +449,7 @@ def WISE_cutout(position, image_size=None, filter=None):
     exptime = data["t_exptime"][0]
 
     if url is not None:
-        fits_image = fits.open(url, cache=None)
+        fits_image = open_cached_fits(url)
 
         wcs = WCS(fits_image[0].header)
         cutout = Cutout2D(fits_image[0].data, position, image_size, wcs=wcs)
@@ -388,9 +496,7 @@ def DES_cutout(position, image_size=None, filter=None):
         # we need both the depth and the image
         time.sleep(1)
         try:
-            fits_image = fits.open(
-                valid_urls[0].replace("-depth-", "-image-"), cache=None
-            )
+            fits_image = open_cached_fits(valid_urls[0].replace("-depth-", "-image-"))
         except Exception as e:
             ### found some bad links...
             return None
@@ -398,12 +504,7 @@ def DES_cutout(position, image_size=None, filter=None):
             # no idea what's happening here but this is a mess
             return None
 
-        try:
-            depth_image = fits.open(valid_urls[0])
-        except Exception as e:
-            # wonder if there's some issue with other tasks clearing the cache
-            time.sleep(5)
-            depth_image = fits.open(valid_urls[0])
+        depth_image = open_cached_fits(valid_urls[0])
         wcs_depth = WCS(depth_image[0].header)
         xc, yc = wcs_depth.wcs_world2pix(position.ra.deg, position.dec.deg, 0)
 
@@ -443,14 +544,14 @@ def TWOMASS_cutout(position, image_size=None, filter=None):
     """
 
     irsaquery = f"https://irsa.ipac.caltech.edu/cgi-bin/2MASS/IM/nph-im_sia?POS={position.ra.deg},{position.dec.deg}&SIZE=0.01"
-    response = requests.get(url=irsaquery)
+    response = http_get(irsaquery)
 
     fits_image = None
     for line in response.content.decode("utf-8").split("<TD><![CDATA["):
         if re.match(f"https://irsa.*{filter.lower()}i.*fits", line.split("]]>")[0]):
             fitsurl = line.split("]]")[0]
 
-            fits_image = fits.open(fitsurl, cache=None)
+            fits_image = open_cached_fits(fitsurl)
             wcs = WCS(fits_image[0].header)
 
             if position.contained_by(wcs):
@@ -493,7 +594,7 @@ def SDSS_cutout(position, image_size=None, filter=None):
 
     url = f"https://dr12.sdss.org/fields/raDec?ra={position.ra.deg}&dec={position.dec.deg}"
     print(url)
-    rt = requests.get(url)
+    rt = http_get(url)
 
     # a little latency so that we don't look like a bot to SDSS?
     time.sleep(1)
@@ -528,7 +629,7 @@ def SDSS_cutout(position, image_size=None, filter=None):
         band=filter,
     )
 
-    fits_image = fits.open(link, cache=None)
+    fits_image = open_cached_fits(link)
 
     wcs = WCS(fits_image[0].header)
     cutout = Cutout2D(fits_image[0].data, position, image_size, wcs=wcs)
@@ -551,7 +652,7 @@ download_function_dict = {
 }
 
 
-def cutout(transient, survey, fov=Quantity(0.1, unit="deg")):
+def cutout(transient, survey, fov=Quantity(0.1, unit="deg"), clear_cache=True):
     """
     Download image cutout data from a survey.
     Parameters
@@ -566,6 +667,9 @@ def cutout(transient, survey, fov=Quantity(0.1, unit="deg")):
         Field of view of the cutout image, angular length of one of the sides
         of the square cutout. Angular astropy quantity. Default is angular
         length of 0.2 degrees.
+    :clear_cache : bool, default=True
+        Clear the astropy download cache before downloading. Concurrent
+        callers should clear it once themselves and pass False.
     Returns
     -------
     :cutout : :class:`~astropy.io.fits.HDUList` or None
@@ -573,7 +677,8 @@ def cutout(transient, survey, fov=Quantity(0.1, unit="deg")):
         `ReadTimeoutError` None will be returned.
     """
     # need to make sure the cache doesn't overfill
-    astropy.utils.data.clear_download_cache()
+    if clear_cache:
+        astropy.utils.data.clear_download_cache()
     num_pixels = int(fov.to(u.arcsec).value / survey.pixel_size_arcsec)
 
     status = 1
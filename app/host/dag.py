@@ -0,0 +1,319 @@
+"""
+Dependency graph of the transient workflow and the scheduler that walks it.
+
+Every :class:`~host.base_tasks.TransientTaskRunner` declares the tasks it
+depends on, and is registered here together with the celery task that runs
+it. Instead of a hard-coded celery chain, each task reports back when it
+finishes and the scheduler then dispatches every task whose parents have all
+finished. The graph itself is static, so it can be inspected with
+:func:`workflow_graph` or rendered with :func:`workflow_graph_dot`.
+
+Tasks registered as queued are not dispatched straight away but left as
+"queued", to be picked up in batches by a separate service (see
+:mod:`host.sed_batch`), which reports back in the same way.
+
+A task counts as finished once it has any status other than "not processed",
+"queued" or "processing". A task whose parents have all finished without meeting its
+prerequisites is skipped and marked as "blocked".
+"""
+from django.db import transaction
+from django.utils import timezone
+
+from .base_tasks import transient_task_statuses
+from .base_tasks import update_register_statuses
+from .models import Status
+from .models import TaskRegister
+from .models import TransientTaskCounts
+
+UNFINISHED_STATUSES = ("not processed", "queued", "processing")
+
+# placeholder transient name used to instantiate runners for the static graph
+_GRAPH_TRANSIENT_NAME = "workflow graph"
+
+_nodes = {}
+_queued_nodes = set()
+
+
+def register_node(runner_class, celery_task, queued=False):
+    """
+    Add a transient task to the workflow graph.
+
+    Parameters
+    ----------
+    :runner_class : subclass of :class:`~host.base_tasks.TransientTaskRunner`
+        Runner of the task.
+    :celery_task : celery task
+        Task that runs the runner, it is called with the transient name and
+        ``scheduled=True``.
+    :queued : bool
+        If True, ready tasks are marked as queued for a batch service
+        instead of being dispatched to the celery task.
+    """
+    runner = runner_class(transient_name=_GRAPH_TRANSIENT_NAME)
+    _nodes[runner.task_name] = (runner_class, celery_task, runner)
+    if queued:
+        _queued_nodes.add(runner.task_name)
+    else:
+        _queued_nodes.discard(runner.task_name)
+
+
+def workflow_graph():
+    """
+    The transient workflow graph.
+
+    Returns
+    -------
+    :graph : dict[str: list[str]]
+        Task name to the names of the tasks it depends on.
+    """
+    return {
+        task_name: list(runner.dependencies)
+        for task_name, (_, _, runner) in _nodes.items()
+    }
+
+
+def children(task_name):
+    """Names of the tasks that directly depend on a task."""
+    return [
+        child
+        for child, dependencies in workflow_graph().items()
+        if task_name in dependencies
+    ]
+
+
+def descendants(task_name):
+    """Names of all the tasks downstream of a task, excluding itself."""
+    found = []
+    stack = children(task_name)
+    while stack:
+        child = stack.pop()
+        if child not in found:
+            found.append(child)
+            stack.extend(children(child))
+    return found
+
+
+def topological_order():
+    """
+    Task names ordered so that every task comes after its dependencies.
+
+    Raises
+    ------
+    :ValueError
+        If the graph has a cycle or depends on an unregistered task.
+    """
+    graph = workflow_graph()
+    order = []
+    remaining = dict(graph)
+    while remaining:
+        ready = [
+            task_name
+            for task_name, dependencies in remaining.items()
+            if all(dependency in order for dependency in dependencies)
+        ]
+        if not ready:
+            raise ValueError(
+                f"Workflow graph has a cycle or unknown dependency: {sorted(remaining)}"
+            )
+        for task_name in sorted(ready):
+            order.append(task_name)
+            del remaining[task_name]
+    return order
+
+
+def workflow_graph_dot():
+    """
+    The transient workflow graph in graphviz dot format.
+    """
+    lines = ["digraph transient_workflow {"]
+    for task_name in topological_order():
+        lines.append(f'    "{task_name}";')
+        for dependency in _nodes[task_name][2].dependencies:
+            lines.append(f'    "{dependency}" -> "{task_name}";')
+    lines.append("}")
+    return "\n".join(lines)
+
+
+def node_states(statuses):
+    """
+    Work out which tasks of a transient can run and which have finished.
+
+    Parameters
+    ----------
+    :statuses : dict[str: str]
+        Task name to status message of every task of the transient.
+    Returns
+    -------
+    :ready : list[str]
+        Tasks whose parents have finished and whose prerequisites are met.
+    :finished : set[str]
+        Tasks that have finished or will be skipped.
+    """
+    ready = []
+    finished = set()
+    for task_name in topological_order():
+        runner = _nodes[task_name][2]
+        status = statuses.get(task_name)
+        if status is None:
+            # not initialised for this transient, nothing to wait for
+            finished.add(task_name)
+        elif status not in UNFINISHED_STATUSES:
+            finished.add(task_name)
+        elif status == "not processed" and all(
+            dependency in finished for dependency in runner.dependencies
+        ):
+            if runner.prerequisites_met(statuses):
+                ready.append(task_name)
+            else:
+                finished.add(task_name)
+    return ready, finished
+
+
+def claim(register_item, from_status, to_status):
+    """
+    Atomically move a register item from one status to another, so a task is
+    only dispatched once, even if two parents finish together.
+
+    Parameters
+    ----------
+    :register_item : dict
+        ``pk``, ``transient_id`` and ``task_id`` of the register item.
+    :from_status : :class:`~host.models.Status`
+        Status the item must currently have.
+    :to_status : :class:`~host.models.Status`
+        New status of the item.
+    Returns
+    -------
+    :claimed : bool
+        False if the item no longer had ``from_status``.
+    """
+    with transaction.atomic():
+        claimed = TaskRegister.objects.filter(
+            pk=register_item["pk"], status=from_status
+        ).update(status=to_status, last_modified=timezone.now())
+        if claimed:
+            TransientTaskCounts.record_status_change(
+                register_item["transient_id"],
+                register_item["task_id"],
+                from_status.pk,
+                to_status.pk,
+            )
+    return bool(claimed)
+
+
+def dispatch_ready(transient_name):
+    """
+    Dispatch every task of a transient that is ready to run, or queue it if
+    it is run in batches, and mark the tasks that can no longer run as
+    blocked.
+
+    Parameters
+    ----------
+    :transient_name : str
+        Name of the transient.
+    Returns
+    -------
+    :dispatched : list[str]
+        Names of the dispatched and queued tasks.
+    """
+    statuses = transient_task_statuses(transient_name)
+    ready, finished = node_states(statuses)
+
+    skipped = [
+        task_name
+        for task_name in finished
+        if statuses.get(task_name) == "not processed"
+    ]
+    if skipped:
+        update_register_statuses(
+            TaskRegister.objects.filter(
+                transient__name__exact=transient_name, task__name__in=skipped
+            ),
+            Status.objects.get(message__exact="blocked"),
+        )
+    if not ready:
+        return []
+
+    status_objects = {
+        status.message: status
+        for status in Status.objects.filter(message__in=UNFINISHED_STATUSES)
+    }
+    register_items = {
+        register_item["task__name"]: register_item
+        for register_item in TaskRegister.objects.filter(
+            transient__name__exact=transient_name, task__name__in=ready
+        ).values("pk", "transient_id", "task_id", "task__name")
+    }
+
+    dispatched = []
+    for task_name in ready:
+        queued = task_name in _queued_nodes
+        claimed = claim(
+            register_items[task_name],
+            status_objects["not processed"],
+            status_objects["queued" if queued else "processing"],
+        )
+        if claimed and queued:
+            dispatched.append(task_name)
+        elif claimed:
+            celery_task = _nodes[task_name][1]
+            transaction.on_commit(
+                lambda task=celery_task: task.delay(transient_name, scheduled=True)
+            )
+            dispatched.append(task_name)
+    return dispatched
+
+
+def run_node(runner, scheduled=False):
+    """
+    Run a transient task and, if it was dispatched by the scheduler, let the
+    scheduler know it has finished so its children can be dispatched.
+
+    Parameters
+    ----------
+    :runner : :class:`~host.base_tasks.TransientTaskRunner`
+        Runner of the task.
+    :scheduled : bool
+        True if the task was claimed by :func:`dispatch_ready`, in which case
+        the prerequisites have already been checked.
+    """
+    if not scheduled:
+        return runner.run_process()
+
+    try:
+        task_register_item = TaskRegister.objects.get(
+            transient__name__exact=runner.transient_name,
+            task__name__exact=runner.task_name,
+        )
+        return runner.run_process(task_register_item=task_register_item)
+    finally:
+        dispatch_ready(runner.transient_name)
+
+
+def rerun_subgraph(transient_name, task_name):
+    """
+    Re-run a task and everything downstream of it for one transient. Tasks
+    upstream of it keep their results.
+
+    Parameters
+    ----------
+    :transient_name : str
+        Name of the transient.
+    :task_name : str
+        Name of the task at the root of the subgraph.
+    Returns
+    -------
+    :dispatched : list[str]
+        Names of the tasks dispatched straight away.
+    """
+    if task_name not in _nodes:
+        raise ValueError(f"{task_name} is not part of the transient workflow")
+
+    reset_tasks = [task_name] + descendants(task_name)
+    update_register_statuses(
+        TaskRegister.objects.filter(
+            transient__name__exact=transient_name, task__name__in=reset_tasks
+        ),
+        Status.objects.get(message__exact="not processed"),
+    )
+    return dispatch_ready(transient_name)
@@ -0,0 +1,107 @@
+"""
+Process-wide registry of parsed filter transmission curves and correlated
+error models.
+
+Parsing a transmission curve with pandas and building a
+:class:`sedpy.observate.Filter` is slow compared to how often they are
+needed (SED fitting, SBI++ and the SED plots all need them for every filter),
+so each file is parsed once per process. Entries are keyed by filter name and
+the modification time of the file, so an updated file is parsed again the
+next time it is requested. The cached objects are shared and must not be
+modified by callers.
+"""
+import os
+import threading
+
+import pandas as pd
+from django.conf import settings
+from sedpy import observate
+
+_transmission_curves = {}
+_correlation_models = {}
+_lock = threading.Lock()
+
+
+def transmission_curve_path(filter_name):
+    return f"{settings.TRANSMISSION_CURVES_ROOT}/{filter_name}.txt"
+
+
+def correlation_model_path(filter_name):
+    return f"{settings.TRANSMISSION_CURVES_ROOT}/{filter_name}_corrmodel.txt"
+
+
+def _cached(cache, filter_name, path, parse):
+    """Look up an entry, parsing the file if it is new or has changed."""
+    mtime = os.path.getmtime(path)
+    with _lock:
+        entry = cache.get(filter_name)
+        if entry is None or entry[0] != mtime:
+            entry = (mtime, parse(path))
+            cache[filter_name] = entry
+        return entry[1]
+
+
+def transmission_curve(filter_name):
+    """
+    Transmission curve of a filter.
+
+    Parameters
+    ----------
+    :filter_name : str
+        Name of the filter, as in :class:`~host.models.Filter`.
+    Returns
+    -------
+    :transmission_curve : :class:`sedpy.observate.Filter`
+        The shared, parsed transmission curve.
+    """
+    path = transmission_curve_path(filter_name)
+
+    def parse(path):
+        curve = pd.read_csv(path, sep=r"\s+", header=None)
+        wavelength = curve[0].to_numpy()
+        transmission = curve[1].to_numpy()
+        return observate.Filter(
+            kname=filter_name, nick=filter_name, data=(wavelength, transmission)
+        )
+
+    try:
+        return _cached(_transmission_curves, filter_name, path, parse)
+    except Exception as err:
+        raise ValueError(
+            f"{filter_name}: Problem loading filter transmission curve from {path}: {err}"
+        )
+
+
+def correlation_model(filter_name):
+    """
+    Model for the correlated errors of a filter.
+
+    Parameters
+    ----------
+    :filter_name : str
+        Name of the filter, as in :class:`~host.models.Filter`.
+    Returns
+    -------
+    :app_radius : np.ndarray or None
+        Aperture radii of the model, None if the filter has no model.
+    :error_adjust : np.ndarray or None
+        Factor by which the flux errors are multiplied at those radii.
+    """
+    path = correlation_model_path(filter_name)
+    if not os.path.exists(path):
+        return None, None
+
+    def parse(path):
+        corr_model = pd.read_csv(path, sep=r"\s+", header=None)
+        app_radius = corr_model[0].to_numpy()
+        error_adjust = corr_model[1].to_numpy() ** (1 / 2.0)
+        for array in (app_radius, error_adjust):
+            array.flags.writeable = False
+        return app_radius, error_adjust
+
+    try:
+        return _cached(_correlation_models, filter_name, path, parse)
+    except Exception as err:
+        raise ValueError(
+            f"{filter_name}: Problem loading filter correlation model from {path}: {err}"
+        )
@@ -0,0 +1,211 @@
+"""
+Persistent on-disk cache of the full survey frames that cutouts are cut from.
+
+Several surveys only serve whole frames or tiles, so nearby transients that
+land on the same frame would otherwise download it again. Frames are stored
+under ``settings.FRAME_CACHE_ROOT`` in files named by the SHA-256 of their
+url, and the least recently used frames are evicted once the cache grows
+beyond ``settings.FRAME_CACHE_MAX_BYTES``.
+
+Each process keeps a running total of the size of the cache and only scans
+the cache directory when the total exceeds the budget, or when its last scan
+is older than ``RESCAN_SECONDS`` so that it also counts the frames other
+workers downloaded in the meantime.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from io import BytesIO
+
+from astropy.io import fits
+from django.conf import settings
+
+from .http_sessions import http_get
+
+_stats = {"hits": 0, "misses": 0, "evictions": 0}
+_lock = threading.Lock()
+
+# size of each cache directory in bytes as counted by this process, and the
+# time of its last scan
+_cache_bytes = {}
+_last_scan = {}
+RESCAN_SECONDS = 600
+# temporary files older than this are left over from failed downloads
+STALE_TMP_SECONDS = 3600
+
+
+def frame_cache_path(url, cache_root=None):
+    """
+    Path of the cache file for a frame url.
+
+    Parameters
+    ----------
+    :url : str
+        Url of the frame.
+    :cache_root : str, optional
+        Cache directory, defaults to ``settings.FRAME_CACHE_ROOT``.
+    Returns
+    -------
+    :path : str
+    """
+    cache_root = cache_root or settings.FRAME_CACHE_ROOT
+    key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+    return os.path.join(cache_root, key[:2], f"{key}.fits")
+
+
+def _scan(cache_root):
+    """
+    List the cached frames as (modification time, size, path) and remove the
+    temporary files of downloads that failed.
+    """
+    frames = []
+    now = time.time()
+    for dirpath, _, filenames in os.walk(cache_root):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            try:
+                stat = os.stat(path)
+                if (
+                    filename.endswith(".tmp")
+                    and now - stat.st_mtime > STALE_TMP_SECONDS
+                ):
+                    os.remove(path)
+            except FileNotFoundError:
+                continue
+            if filename.endswith(".fits"):
+                frames.append((stat.st_mtime, stat.st_size, path))
+    return frames
+
+
+def _evict(cache_root, max_bytes, keep=None):
+    """Remove least recently used frames until the cache fits in max_bytes."""
+    frames = _scan(cache_root)
+    total_bytes = sum(size for _, size, _ in frames)
+    for _, size, path in sorted(frames):
+        if total_bytes <= max_bytes:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+            with _lock:
+                _stats["evictions"] += 1
+        except FileNotFoundError:
+            # evicted by another worker in the meantime
+            pass
+        total_bytes -= size
+
+    with _lock:
+        _cache_bytes[cache_root] = total_bytes
+        _last_scan[cache_root] = time.monotonic()
+
+
+def _add_frame(cache_root, max_bytes, path):
+    """
+    Add a new frame to the running total of the cache size, and evict frames
+    if the cache is over its budget.
+    """
+    size = os.path.getsize(path)
+    with _lock:
+        total_bytes = _cache_bytes.get(cache_root)
+        scan = (
+            total_bytes is None
+            or time.monotonic() - _last_scan[cache_root] > RESCAN_SECONDS
+        )
+        if not scan:
+            total_bytes += size
+            _cache_bytes[cache_root] = total_bytes
+    if scan or total_bytes > max_bytes:
+        _evict(cache_root, max_bytes, keep=path)
+
+
+def fetch_frame(url, cache_root=None, max_bytes=None):
+    """
+    Get the local path of a frame, downloading it only if it is not cached.
+
+    Parameters
+    ----------
+    :url : str
+        Url of the frame.
+    :cache_root : str, optional
+        Cache directory, defaults to ``settings.FRAME_CACHE_ROOT``.
+    :max_bytes : int, optional
+        Byte budget of the cache, defaults to
+        ``settings.FRAME_CACHE_MAX_BYTES``.
+    Returns
+    -------
+    :path : str
+        Path of the cached frame.
+    """
+    cache_root = cache_root or settings.FRAME_CACHE_ROOT
+    if max_bytes is None:
+        max_bytes = settings.FRAME_CACHE_MAX_BYTES
+    path = frame_cache_path(url, cache_root=cache_root)
+
+    if os.path.exists(path):
+        try:
+            # bump the modification time so eviction is least recently used
+            os.utime(path)
+            with _lock:
+                _stats["hits"] += 1
+            return path
+        except FileNotFoundError:
+            # evicted by another worker in the meantime
+            pass
+
+    with _lock:
+        _stats["misses"] += 1
+    response = http_get(url)
+    response.raise_for_status()
+
+    # write to a temporary file first so other workers never see partial frames
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as tmp_file:
+            tmp_file.write(response.content)
+        os.replace(tmp_path, path)
+        tmp_path = None
+    finally:
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    _add_frame(cache_root, max_bytes, path)
+    return path
+
+
+def open_cached_fits(url, cache_root=None, max_bytes=None):
+    """
+    Open a remote fits frame, serving it from the frame cache when possible.
+
+    Parameters
+    ----------
+    :url : str
+        Url of the (optionally gzipped) fits frame.
+    Returns
+    -------
+    :fits_image : :class:`~astropy.io.fits.HDUList`
+    """
+    path = fetch_frame(url, cache_root=cache_root, max_bytes=max_bytes)
+    # read into memory so the frame can be evicted while still in use
+    with open(path, "rb") as frame_file:
+        return fits.open(BytesIO(frame_file.read()))
+
+
+def frame_cache_stats():
+    """
+    Frame cache counters for this process.
+
+    Returns
+    -------
+    :stats : dict
+        Number of ``hits``, ``misses`` and ``evictions`` and the
+        ``hit_rate``.
+    """
+    with _lock:
+        stats = dict(_stats)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+    return stats
@@ -1,8 +1,17 @@
 from datetime import datetime, timezone, timedelta
+import glob
+import hashlib
 import math
+import os
+import re
+import tempfile
 import time
 import warnings
+import zipfile
 from collections import namedtuple
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
 from xml.parsers.expat import ExpatError
 
 import astropy.units as u
@@ -26,16 +35,17 @@ from dustmaps.config import config
 
 config.reset()
 config["data_dir"] = settings.DUSTMAPS_DATA_ROOT
-from photutils.aperture import aperture_photometry
 from photutils.aperture import EllipticalAperture
 from photutils.background import Background2D
 from photutils.segmentation import detect_sources
+from photutils.segmentation import SegmentationImage
 from photutils.segmentation import SourceCatalog
 from photutils.utils import calc_total_error
 from photutils.background import LocalBackground
 from photutils.background import MeanBackground, SExtractorBackground
 from astropy.stats import SigmaClip
 
+from .http_sessions import use_shared_session
 from .photometric_calibration import flux_to_mag
 from .photometric_calibration import flux_to_mJy_flux
 from .photometric_calibration import fluxerr_to_magerr
@@ -78,6 +88,52 @@ def survey_list(survey_metadata_path):
     return survey_list
 
 
+@contextmanager
+def open_image(path):
+    """
+    Open a fits image memory-mapped and read-only.
+
+    The primary HDU data is a read-only view of the memory-mapped file, so
+    it is paged in on demand rather than copied into memory, and the file is
+    closed when the context exits.
+    Parameters
+    ----------
+    :path : str
+        Path to the fits file.
+    Returns
+    -------
+    :image : :class:`~astropy.io.fits.HDUList`
+        Fits image, valid only inside the context.
+    """
+    with fits.open(path, memmap=True, mode="readonly") as image:
+        if image[0].data is not None:
+            image[0].data.flags.writeable = False
+        yield image
+
+
+def subtract_background(image_data, background, out=None):
+    """
+    Subtract a background estimate from image data into a float32 buffer.
+    Parameters
+    ----------
+    :image_data : :class:`~numpy.ndarray`
+        Image data, left untouched.
+    :background : BackgroundEstimate
+        Estimate of the background in the image.
+    :out : :class:`~numpy.ndarray`, optional
+        float32 buffer with the same shape as the image to write into. A new
+        buffer is allocated if not given.
+    Returns
+    -------
+    :background_subtracted_data : :class:`~numpy.ndarray`
+        float32 background-subtracted image data.
+    """
+    if out is None:
+        out = np.empty(np.shape(image_data), dtype=np.float32)
+    np.subtract(image_data, background.background, out=out, casting="same_kind")
+    return out
+
+
 def build_source_catalog(image, background, threshhold_sigma=3.0, npixels=10):
     """
     Constructs a source catalog given an image and background estimation
@@ -85,7 +141,7 @@ def build_source_catalog(image, background, threshhold_sigma=3.0, npixels=10):
     ----------
     :image :  :class:`~astropy.io.fits.HDUList`
         Fits image to construct source catalog from.
-    :background : :class:`~photutils.background.Background2D`
+    :background : BackgroundEstimate
         Estimate of the background in the image.
     :threshold_sigma : float default=2.0
         Threshold sigma above the baseline that a source has to be to be
@@ -99,8 +155,7 @@ def build_source_catalog(image, background, threshhold_sigma=3.0, npixels=10):
         Catalog of sources constructed from the image.
     """
 
-    image_data = image[0].data
-    background_subtracted_data = image_data - background.background
+    background_subtracted_data = subtract_background(image[0].data, background)
     threshold = threshhold_sigma * background.background_rms
 
     segmentation = detect_sources(
@@ -172,82 +227,147 @@ def elliptical_sky_aperture(source_catalog, wcs, aperture_scale=3.0):
     return pixel_aperture.to_sky(wcs)
 
 
-def do_aperture_photometry(image, sky_aperture, filter):
+NO_PHOTOMETRY = {
+    "flux": None,
+    "flux_error": None,
+    "magnitude": None,
+    "magnitude_error": None,
+}
+
+# header cards that define the celestial WCS of an image, including SIP, TPV
+# and DSS plate solution distortions
+WCS_KEYWORD_PATTERN = re.compile(
+    r"(NAXIS\d*|WCSAXES|CTYPE\d|CUNIT\d|CRVAL\d|CRPIX\d|CDELT\d|CROTA\d|"
+    r"CD\d_\d|PC\d_\d|PV\d_\d+|LONPOLE|LATPOLE|EQUINOX|EPOCH|RADE(C)?SYS|"
+    r"A?B?P?_ORDER|A?B?P?_\d+_\d+|PLT.*|PPO\d+|AMD[XY]\d+|[XY]PIXELSZ|CNPIX\d)"
+)
+
+
+def aperture_sum(aperture_weights, data, error=None):
+    """
+    Sum of the data in an aperture, as computed by
+    :func:`~photutils.aperture.aperture_photometry` with non-finite data
+    values masked.
+    Parameters
+    ----------
+    :aperture_weights : :class:`~numpy.ndarray`
+        Fraction of each pixel of the aperture bounding box in the aperture,
+        the data of an :class:`~photutils.aperture.ApertureMask`.
+    :data : :class:`~numpy.ndarray`
+        Data in the aperture bounding box.
+    :error : :class:`~numpy.ndarray`, optional
+        1-sigma error of the data in the aperture bounding box.
+    Returns
+    -------
+    :aperture_sum : float
+        Weighted sum of the data.
+    :aperture_sum_err : float or None
+        Error of the sum, None if no error is given.
+    """
+    finite = np.isfinite(data)
+    total = np.sum(np.where(finite, data, 0.0) * aperture_weights)
+    if error is None:
+        return total, None
+    variance = np.sum(np.where(finite, error**2, 0.0) * aperture_weights)
+    return total, np.sqrt(variance)
+
+
+def wcs_key(header):
+    """Cards of a header that define its celestial WCS, as a hashable key."""
+    return tuple(
+        (keyword, header[keyword])
+        for keyword in header
+        if WCS_KEYWORD_PATTERN.fullmatch(keyword)
+    )
+
+
+def do_aperture_photometry(image, sky_aperture, filter, pixel_aperture=None, out=None):
     """
     Performs Aperture photometry
+    Parameters
+    ----------
+    :image : :class:`~astropy.io.fits.HDUList`
+        Image to measure.
+    :sky_aperture : :class:`~photutils.aperture.SkyEllipticalAperture`
+        Aperture to measure the flux in.
+    :filter : Filter
+        Filter of the image.
+    :pixel_aperture : :class:`~photutils.aperture.EllipticalAperture`, optional
+        The sky aperture transformed to the pixels of the image, computed
+        from the image WCS if not given.
+    :out : :class:`~numpy.ndarray`, optional
+        float32 buffer with the shape of the image to hold the
+        background-subtracted data, overwritten. A new buffer is allocated if
+        not given.
+    Returns
+    -------
+    :photometry : dict
+        Flux and magnitude with their errors, all None if the aperture
+        cannot be measured.
     """
     image_data = image[0].data
-    wcs = WCS(image[0].header)
-
-    # get the background
-    try:
-        background = estimate_background(image, filter.name)
-    except ValueError:
-        # indicates poor image data
-        return {
-            "flux": None,
-            "flux_error": None,
-            "magnitude": None,
-            "magnitude_error": None,
-        }
+    if pixel_aperture is None:
+        pixel_aperture = sky_aperture.to_pixel(WCS(image[0].header))
 
     # is the aperture inside the image?
-    bbox = sky_aperture.to_pixel(wcs).bbox
+    bbox = pixel_aperture.bbox
     if (
         bbox.ixmin < 0
         or bbox.iymin < 0
         or bbox.ixmax > image_data.shape[1]
         or bbox.iymax > image_data.shape[0]
     ):
-        return {
-            "flux": None,
-            "flux_error": None,
-            "magnitude": None,
-            "magnitude_error": None,
-        }
+        return dict(NO_PHOTOMETRY)
+
+    # the aperture weights over its bounding box serve both the mask check
+    # and the photometry, which only need the pixels in the bounding box
+    aperture_mask = pixel_aperture.to_mask(method="exact")
+    bbox_slices = bbox.slices
 
     # if the image pixels are all zero, let's assume this is masked
     # even GALEX FUV should have *something*
-    phot_table_maskcheck = aperture_photometry(image_data, sky_aperture, wcs=wcs)
-    if phot_table_maskcheck["aperture_sum"].value[0] == 0:
-        return {
-            "flux": None,
-            "flux_error": None,
-            "magnitude": None,
-            "magnitude_error": None,
-        }
+    if aperture_sum(aperture_mask.data, image_data[bbox_slices])[0] == 0:
+        return dict(NO_PHOTOMETRY)
 
-    background_subtracted_data = image_data - background.background
+    # get the background
+    try:
+        background = estimate_background(image, filter.name)
+    except ValueError:
+        # indicates poor image data
+        return dict(NO_PHOTOMETRY)
+
+    # a single float32 buffer holds the background-subtracted image
+    # and is modified in place from here on
+    background_subtracted_data = subtract_background(image_data, background, out=out)
 
     # I think we need a local background subtraction for WISE
     # the others haven't given major problems
     if "WISE" in filter.name:
-        aper_pix = sky_aperture.to_pixel(wcs)
-        lbg = LocalBackground(aper_pix.a, aper_pix.a * 2)
+        lbg = LocalBackground(pixel_aperture.a, pixel_aperture.a * 2)
         local_background = lbg(
-            background_subtracted_data, aper_pix.positions[0], aper_pix.positions[1]
+            background_subtracted_data,
+            pixel_aperture.positions[0],
+            pixel_aperture.positions[1],
         )
         background_subtracted_data -= local_background
 
+    # the error is only computed inside the aperture bounding box
+    bbox_data = background_subtracted_data[bbox_slices]
+    bbox_background_rms = background.background_rms[bbox_slices]
     if filter.image_pixel_units == "counts/sec":
         error = calc_total_error(
-            background_subtracted_data,
-            background.background_rms,
+            bbox_data,
+            bbox_background_rms,
             float(image[0].header["EXPTIME"]),
         )
 
     else:
-        error = calc_total_error(
-            background_subtracted_data, background.background_rms, 1.0
-        )
+        error = calc_total_error(bbox_data, bbox_background_rms, 1.0)
 
-    phot_table = aperture_photometry(
-        background_subtracted_data, sky_aperture, wcs=wcs, error=error
+    uncalibrated_flux, uncalibrated_flux_err = aperture_sum(
+        aperture_mask.data, bbox_data, error
     )
-    uncalibrated_flux = phot_table["aperture_sum"].value[0]
-    if "2MASS" not in filter.name:
-        uncalibrated_flux_err = phot_table["aperture_sum_err"].value[0]
-    else:
+    if "2MASS" in filter.name:
         # 2MASS is annoying
         # https://wise2.ipac.caltech.edu/staff/jarrett/2mass/3chan/noise/
         n_pix = (
@@ -264,10 +384,8 @@ def do_aperture_photometry(image, sky_aperture, filter):
     # check for correlated errors
     aprad, err_adjust = filter.correlation_model()
     if aprad is not None:
-        image_aperture = sky_aperture.to_pixel(wcs)
-
         err_adjust_interp = np.interp(
-            (image_aperture.a + image_aperture.b) / 2.0, aprad, err_adjust
+            (pixel_aperture.a + pixel_aperture.b) / 2.0, aprad, err_adjust
         )
         uncalibrated_flux_err *= err_adjust_interp
 
@@ -296,6 +414,49 @@ def do_aperture_photometry(image, sky_aperture, filter):
     }
 
 
+def do_aperture_photometry_batch(cutouts, sky_apertures):
+    """
+    Performs aperture photometry on all of a transient's cutouts in one pass
+
+    Each sky aperture is transformed to pixels once per distinct image WCS,
+    so the images of a survey that share their pixel grid share the pixel
+    aperture, and the WCS of an image is only built if its grid is new. The
+    background-subtracted data of consecutive images of the same shape is
+    written into one reused float32 buffer.
+    Parameters
+    ----------
+    :cutouts : list[Cutout]
+        Cutouts to measure, each with a fits file.
+    :sky_apertures : :class:`~photutils.aperture.SkyEllipticalAperture` or dict
+        Either one aperture used for every cutout, or a dictionary of
+        apertures keyed by cutout name, e.g. the PSF-adjusted global
+        apertures.
+    Returns
+    -------
+    :photometry : dict[str: dict]
+        The :func:`do_aperture_photometry` result keyed by cutout name.
+    """
+    photometry = {}
+    pixel_apertures = {}
+    buffer = None
+    for cutout in cutouts:
+        if isinstance(sky_apertures, dict):
+            sky_aperture = sky_apertures[cutout.name]
+        else:
+            sky_aperture = sky_apertures
+        with open_image(cutout.fits.name) as image:
+            key = (id(sky_aperture), wcs_key(image[0].header))
+            if key not in pixel_apertures:
+                pixel_apertures[key] = sky_aperture.to_pixel(WCS(image[0].header))
+            shape = np.shape(image[0].data)
+            if buffer is None or buffer.shape != shape:
+                buffer = np.empty(shape, dtype=np.float32)
+            photometry[cutout.name] = do_aperture_photometry(
+                image, sky_aperture, cutout.filter, pixel_apertures[key], out=buffer
+            )
+    return photometry
+
+
 def get_dust_maps(position):
     """Gets milkyway reddening value"""
 
@@ -344,32 +505,31 @@ def check_global_contamination(global_aperture_phot, aperture_primary):
             continue
 
         # copy the steps to build segmentation map
-        image = fits.open(cutout_name)
-        wcs = WCS(image[0].header)
-        background = estimate_background(image)
-        catalog = build_source_catalog(
-            image, background, threshhold_sigma=5, npixels=15
-        )
-
-        # catalog is None is no sources are detected in the image
-        # so we don't have to worry about contamination in that case
-        if catalog is None:
-            continue
-
-        source_data = match_source(aperture.sky_coord, catalog, wcs)
-
-        mask_image = (
-            aperture.sky_aperture.to_pixel(wcs)
-            .to_mask()
-            .to_image(np.shape(image[0].data))
-        )
-        obj_ids = catalog._segment_img.data[np.where(mask_image == True)]  # noqa: E712
-        source_obj = source_data._labels
-
-        # let's look for contaminants
-        unq_obj_ids = np.unique(obj_ids)
-        if len(unq_obj_ids[(unq_obj_ids != 0) & (unq_obj_ids != source_obj)]):
-            is_contam = True
+        with open_image(cutout_name) as image:
+            wcs = WCS(image[0].header)
+            catalog = cached_source_catalog(image, threshhold_sigma=5, npixels=15)
+
+            # catalog is None is no sources are detected in the image
+            # so we don't have to worry about contamination in that case
+            if catalog is None:
+                continue
+
+            source_data = match_source(aperture.sky_coord, catalog, wcs)
+
+            mask_image = (
+                aperture.sky_aperture.to_pixel(wcs)
+                .to_mask()
+                .to_image(np.shape(image[0].data))
+            )
+            obj_ids = catalog._segment_img.data[
+                np.where(mask_image == True)  # noqa: E712
+            ]
+            source_obj = source_data._labels
+
+            # let's look for contaminants
+            unq_obj_ids = np.unique(obj_ids)
+            if len(unq_obj_ids[(unq_obj_ids != 0) & (unq_obj_ids != source_obj)]):
+                is_contam = True
 
     return is_contam
 
@@ -455,17 +615,212 @@ def select_aperture(transient):
 #    return host_position
 
 
-def estimate_background(image, filter_name=None):
+BackgroundEstimate = namedtuple("BackgroundEstimate", ["background", "background_rms"])
+
+
+@lru_cache(maxsize=256)
+def _file_hash(path, mtime_ns, size):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def file_hash(path):
+    """SHA-256 hex digest of a file's contents"""
+    stat = os.stat(path)
+    return _file_hash(path, stat.st_mtime_ns, stat.st_size)
+
+
+def _sidecar_base(fits_path):
+    """
+    Path of a fits file without extension, under CUTOUT_SIDECAR_ROOT if it
+    is set and otherwise next to the file.
+    """
+    base = os.path.splitext(fits_path)[0]
+    if settings.CUTOUT_SIDECAR_ROOT:
+        base = os.path.join(
+            settings.CUTOUT_SIDECAR_ROOT, os.path.abspath(base).lstrip(os.sep)
+        )
+    return base
+
+
+def background_sidecar_path(fits_path, estimator):
+    """Path of the cached background estimate of a fits file"""
+    return f"{_sidecar_base(fits_path)}.{estimator}.bkg.npz"
+
+
+def segmentation_sidecar_path(fits_path, threshhold_sigma, npixels):
+    """Path of the cached segmentation map of a fits file"""
+    return f"{_sidecar_base(fits_path)}.t{threshhold_sigma}_n{npixels}.seg.npz"
+
+
+def remove_cutout_sidecars(fits_path):
+    """Remove the cached background and segmentation files of a cutout"""
+    base = _sidecar_base(fits_path)
+    for sidecar in glob.glob(f"{base}.*.bkg.npz") + glob.glob(f"{base}.*.seg.npz"):
+        os.remove(sidecar)
+
+
+def _load_background_sidecar(sidecar_path, fits_hash, estimator_settings):
+    try:
+        with np.load(sidecar_path, allow_pickle=False) as sidecar:
+            if (
+                str(sidecar["fits_hash"]) != fits_hash
+                or str(sidecar["estimator_settings"]) != estimator_settings
+            ):
+                return None
+            return BackgroundEstimate(sidecar["background"], sidecar["background_rms"])
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+        return None
+
+
+def _save_sidecar(sidecar_path, **arrays):
+    """
+    Write a sidecar atomically, through a temporary file in the same
+    directory that is removed if the write fails.
+    """
+    tmp_path = None
+    try:
+        sidecar_dir = os.path.dirname(sidecar_path) or "."
+        os.makedirs(sidecar_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=sidecar_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            np.savez_compressed(f, **arrays)
+        os.replace(tmp_path, sidecar_path)
+        tmp_path = None
+    except OSError as err:
+        print(f"Could not write the cache file {sidecar_path}: {err}")
+    finally:
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _save_background_sidecar(sidecar_path, fits_hash, estimator_settings, background):
+    _save_sidecar(
+        sidecar_path,
+        fits_hash=fits_hash,
+        estimator_settings=estimator_settings,
+        background=background.background,
+        background_rms=background.background_rms,
+    )
+
+
+def _save_segmentation_sidecar(sidecar_path, fits_hash, segmentation):
+    _save_sidecar(
+        sidecar_path,
+        fits_hash=fits_hash,
+        has_sources=segmentation is not None,
+        segmentation=segmentation.data if segmentation is not None else np.zeros(0),
+    )
+
+
+def _load_segmentation_sidecar(sidecar_path, fits_hash):
+    """
+    Returns a (found, segmentation) pair, segmentation is None if the
+    cached map had no sources.
+    """
+    try:
+        with np.load(sidecar_path, allow_pickle=False) as sidecar:
+            if str(sidecar["fits_hash"]) != fits_hash:
+                return False, None
+            if not bool(sidecar["has_sources"]):
+                return True, None
+            return True, SegmentationImage(sidecar["segmentation"])
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+        return False, None
+
+
+# in-process memo of recent source catalogs,
+# keyed by (fits hash, threshold, npixels)
+_source_catalog_memo = OrderedDict()
+SOURCE_CATALOG_MEMO_SIZE = 8
+
+
+def cached_source_catalog(image, threshhold_sigma=3.0, npixels=10):
+    """
+    Source catalog of an image, memoized per cutout, threshold and npixels.
+
+    The segmentation map is stored in a sidecar next to the fits file so
+    that it is computed once per cutout, and recent catalogs are also kept
+    in memory. The background is the default :func:`estimate_background`.
+    Parameters
+    ----------
+    :image :  :class:`~astropy.io.fits.HDUList`
+        Fits image to construct source catalog from.
+    :threshold_sigma : float default=3.0
+        Threshold sigma above the baseline that a source has to be to be
+        detected.
+    :n_pixels : int default=10
+        The length of the size of the box in pixels used to perform segmentation
+        and de-blending of the image.
+    Returns
+    -------
+    :source_catalog : :class:`photutils.segmentation.SourceCatalog` or None
+        Catalog of sources constructed from the image.
+    """
+    fits_path = image.filename()
+    if fits_path is None:
+        return build_source_catalog(
+            image,
+            estimate_background(image),
+            threshhold_sigma=threshhold_sigma,
+            npixels=npixels,
+        )
+
+    fits_hash = file_hash(fits_path)
+    key = (fits_hash, threshhold_sigma, npixels)
+    if key in _source_catalog_memo:
+        _source_catalog_memo.move_to_end(key)
+        return _source_catalog_memo[key]
+
+    background = estimate_background(image)
+    sidecar_path = segmentation_sidecar_path(fits_path, threshhold_sigma, npixels)
+    found, segmentation = _load_segmentation_sidecar(sidecar_path, fits_hash)
+    if found:
+        catalog = (
+            SourceCatalog(subtract_background(image[0].data, background), segmentation)
+            if segmentation is not None
+            else None
+        )
+    else:
+        catalog = build_source_catalog(
+            image, background, threshhold_sigma=threshhold_sigma, npixels=npixels
+        )
+        _save_segmentation_sidecar(
+            sidecar_path,
+            fits_hash,
+            catalog._segment_img if catalog is not None else None,
+        )
+
+    _source_catalog_memo[key] = catalog
+    while len(_source_catalog_memo) > SOURCE_CATALOG_MEMO_SIZE:
+        _source_catalog_memo.popitem(last=False)
+    return catalog
+
+
+def estimate_background(image, filter_name=None, use_cache=True):
     """
     Estimates the background of an image
+
+    If the image was opened from a file, the estimate is cached in a
+    compressed sidecar next to it, keyed by the hash of the file and the
+    estimator settings, so that every stage working on the same cutout
+    shares one estimate. Re-downloading the cutout changes its hash and
+    invalidates the cached estimate.
     Parameters
     ----------
     :image : :class:`~astropy.io.fits.HDUList`
         Image to have the background estimated of.
+    :filter_name : str, optional
+        Name of the filter of the image.
+    :use_cache : bool, default=True
+        Load and store the estimate in the sidecar file.
     Returns
     -------
-    :background : :class:`~photutils.background.Background2D`
-        Background estimate of the image
+    :background : BackgroundEstimate
+        Background and background RMS maps of the image
     """
     image_data = image[0].data
     box_size = int(0.1 * np.sqrt(image_data.size))
@@ -473,15 +828,35 @@ def estimate_background(image, filter_name=None):
     # GALEX needs mean, not median - median just always comes up with zero
     if filter_name is not None and "GALEX" in filter_name:
         bkg = MeanBackground(SigmaClip(sigma=3.0))
+        estimator = "mean"
     else:
         bkg = SExtractorBackground(sigma_clip=None)
+        estimator = "sextractor"
+
+    fits_path = image.filename() if use_cache else None
+    if fits_path is not None:
+        estimator_settings = f"{estimator}:box_size={box_size}"
+        sidecar_path = background_sidecar_path(fits_path, estimator)
+        fits_hash = file_hash(fits_path)
+        background = _load_background_sidecar(
+            sidecar_path, fits_hash, estimator_settings
+        )
+        if background is not None:
+            return background
 
     try:
-        return Background2D(image_data, box_size=box_size, bkg_estimator=bkg)
+        background = Background2D(image_data, box_size=box_size, bkg_estimator=bkg)
     except ValueError:
-        return Background2D(
+        background = Background2D(
             image_data, box_size=box_size, exclude_percentile=50, bkg_estimator=bkg
         )
+    background = BackgroundEstimate(background.background, background.background_rms)
+
+    if fits_path is not None:
+        _save_background_sidecar(
+            sidecar_path, fits_hash, estimator_settings, background
+        )
+    return background
 
 
 def construct_aperture(image, position):
@@ -530,6 +905,7 @@ def construct_aperture(image, position):
 
 def query_ned(position):
     """Get a Galaxy's redshift from NED if it is available."""
+    use_shared_session(Ned, "https://ned.ipac.caltech.edu")
 
     qs = ExternalRequest.objects.filter(name="NED")
     if not len(qs):
@@ -580,6 +956,7 @@ def query_ned(position):
 
 def query_sdss(position):
     """Get a Galaxy's redshift from SDSS if it is available"""
+    use_shared_session(SDSS, "https://skyserver.sdss.org")
     result_table = SDSS.query_region(position, spectro=True, radius=1.0 * u.arcsec)
 
     if result_table is not None and "z" in result_table.keys():
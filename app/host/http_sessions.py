@@ -0,0 +1,185 @@
+"""
+Shared, pooled HTTP sessions for talking to remote surveys and catalogs.
+
+One :class:`requests.Session` is kept per remote host so that repeated
+requests to the same survey reuse keep-alive connections instead of paying
+a new TCP and TLS handshake every time. Every session applies the same
+connection limits and retry/backoff policy, and records simple counters
+that can be inspected with :func:`session_stats`.
+"""
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+HTTP_POOL_MAXSIZE = int(os.environ.get("HTTP_POOL_MAXSIZE", "4"))
+HTTP_MAX_RETRIES = int(os.environ.get("HTTP_MAX_RETRIES", "3"))
+HTTP_BACKOFF_FACTOR = float(os.environ.get("HTTP_BACKOFF_FACTOR", "1.0"))
+
+# upper edges of the latency histogram buckets in seconds
+LATENCY_BUCKETS_SECONDS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, float("inf"))
+
+_sessions = {}
+_stats = {}
+_lock = threading.Lock()
+
+
+def _empty_stats():
+    return {
+        "requests": 0,
+        "bytes": 0,
+        "latency_histogram": [0] * len(LATENCY_BUCKETS_SECONDS),
+    }
+
+
+def _record(host, latency, n_bytes):
+    bucket = next(
+        i for i, edge in enumerate(LATENCY_BUCKETS_SECONDS) if latency <= edge
+    )
+    with _lock:
+        host_stats = _stats.setdefault(host, _empty_stats())
+        host_stats["requests"] += 1
+        host_stats["bytes"] += n_bytes
+        host_stats["latency_histogram"][bucket] += 1
+
+
+class CountingHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter that records the number of requests, bytes received and
+    latency of every request it sends.
+    """
+
+    def send(self, request, stream=False, **kwargs):
+        start_time = time.monotonic()
+        response = super().send(request, stream=stream, **kwargs)
+        latency = time.monotonic() - start_time
+
+        if "Content-Length" in response.headers:
+            n_bytes = int(response.headers["Content-Length"])
+        elif not stream:
+            n_bytes = len(response.content)
+        else:
+            n_bytes = 0
+
+        _record(urlparse(request.url).netloc, latency, n_bytes)
+        return response
+
+
+def _new_session():
+    retry = Retry(
+        total=HTTP_MAX_RETRIES,
+        backoff_factor=HTTP_BACKOFF_FACTOR,
+        status_forcelist=(429, 500, 502, 503, 504),
+    )
+    adapter = CountingHTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=HTTP_POOL_MAXSIZE,
+        max_retries=retry,
+        pool_block=True,
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session(url):
+    """
+    Get the shared session for the host of a url.
+
+    Parameters
+    ----------
+    :url : str
+        Any url (or bare host name) on the remote service.
+    Returns
+    -------
+    :session : :class:`requests.Session`
+        Session with keep-alive connections to that host.
+    """
+    host = urlparse(url).netloc or url
+    with _lock:
+        if host not in _sessions:
+            _sessions[host] = _new_session()
+        return _sessions[host]
+
+
+def http_get(url, **kwargs):
+    """
+    Send a GET request through the shared session for the url's host.
+    Keyword arguments are passed on to :meth:`requests.Session.get`.
+    """
+    return get_session(url).get(url, **kwargs)
+
+
+def use_shared_session(query_class, url):
+    """
+    Point an astroquery service at the shared session for a host, so that
+    its requests are pooled and counted along with everything else. The
+    headers of the service's own session, such as the User-Agent astroquery
+    sets, are copied onto the shared session.
+    """
+    session = get_session(url)
+    if query_class._session is not session:
+        session.headers.update(query_class._session.headers)
+        query_class._session = session
+
+
+def session_stats():
+    """
+    Counters for every host contacted so far in this process.
+
+    Returns
+    -------
+    :stats : dict[str: dict]
+        Keyed by host. Each entry has the number of ``requests``, the number
+        of TCP ``connections`` opened, the connection ``reuse_ratio``, the
+        ``bytes`` received and a ``latency_histogram`` whose bucket upper
+        edges are ``LATENCY_BUCKETS_SECONDS``.
+    """
+    with _lock:
+        stats = {
+            host: {
+                "requests": host_stats["requests"],
+                "bytes": host_stats["bytes"],
+                "latency_histogram": list(host_stats["latency_histogram"]),
+            }
+            for host, host_stats in _stats.items()
+        }
+        sessions = dict(_sessions)
+
+    for host, session in sessions.items():
+        connections, pool_requests = 0, 0
+        for adapter in set(session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is not None:
+                    connections += pool.num_connections
+                    pool_requests += pool.num_requests
+        host_stats = stats.setdefault(host, _empty_stats())
+        host_stats["connections"] = connections
+        host_stats["reuse_ratio"] = (
+            1 - connections / pool_requests if pool_requests else 0.0
+        )
+
+    # hosts reached through another host's session (e.g. astroquery redirects)
+    for host_stats in stats.values():
+        host_stats.setdefault("connections", 0)
+        host_stats.setdefault("reuse_ratio", 0.0)
+
+    return stats
+
+
+def reset_session_stats():
+    """
+    Close all shared sessions and reset the counters.
+    """
+    with _lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+        _stats.clear()
@@ -0,0 +1,63 @@
+from django.core.management.base import BaseCommand
+from host.models import SciencePayloadVersion
+from host.models import SEDFittingResult
+from host.sed_output import convert_legacy_output
+
+
+class Command(BaseCommand):
+    help = (
+        "Convert SED fitting outputs written as a prospector .h5 file with "
+        "separate chain, percentile and model .npz files to single SED output "
+        "containers."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "transient_names",
+            nargs="*",
+            help="Names of the transients to convert, defaults to all transients.",
+        )
+        parser.add_argument(
+            "--keep-legacy-files",
+            action="store_true",
+            help="Keep the .npz files after converting.",
+        )
+
+    def handle(self, *args, **options):
+        sed_results = (
+            SEDFittingResult.objects.select_related("transient", "aperture")
+            .filter(posterior__isnull=False)
+            .exclude(posterior="")
+        )
+        if options["transient_names"]:
+            sed_results = sed_results.filter(
+                transient__name__in=options["transient_names"]
+            )
+
+        n_converted, n_failed = 0, 0
+        for sed_result in sed_results.iterator():
+            path = sed_result.posterior.name
+            try:
+                converted = convert_legacy_output(
+                    path,
+                    attrs={
+                        "transient": sed_result.transient.name,
+                        "aperture_type": sed_result.aperture.type,
+                    },
+                    remove=not options["keep_legacy_files"],
+                )
+            except Exception as err:
+                self.stderr.write(f"Could not convert {path}: {err}")
+                n_failed += 1
+                continue
+
+            if converted:
+                n_converted += 1
+            SEDFittingResult.objects.filter(pk=sed_result.pk).update(
+                chains_file=None, percentiles_file=None, model_file=None
+            )
+            SciencePayloadVersion.bump([sed_result.transient_id])
+
+        self.stdout.write(
+            f"Converted {n_converted} SED outputs, {n_failed} could not be converted."
+        )
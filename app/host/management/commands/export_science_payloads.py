@@ -0,0 +1,63 @@
+from api.export import BATCH_SIZE
+from api.export import EXPORT_FORMATS
+from api.export import export_transients
+from api.export import iter_export
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        "Export the science payloads of transients to a CSV or Parquet file, "
+        "streamed in batches so memory use does not grow with the number of "
+        "transients."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("output", help="Path of the file to write.")
+        parser.add_argument(
+            "transient_names",
+            nargs="*",
+            help="Names of the transients to export, defaults to all transients.",
+        )
+        parser.add_argument("--redshift-gte", type=float, default=None)
+        parser.add_argument("--redshift-lte", type=float, default=None)
+        parser.add_argument(
+            "--processing-status",
+            default=None,
+            help=(
+                "Only export transients with this processing status: "
+                '"processing", "blocked" or "completed".'
+            ),
+        )
+        parser.add_argument(
+            "--format",
+            choices=EXPORT_FORMATS,
+            default=None,
+            help="File format, defaults to the extension of the output file.",
+        )
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        file_format = options["format"] or options["output"].rsplit(".", 1)[-1]
+        if file_format not in EXPORT_FORMATS:
+            raise CommandError(
+                f"Unknown file format {file_format}, use --format to choose one of "
+                f"{', '.join(EXPORT_FORMATS)}"
+            )
+
+        transients = export_transients(
+            names=options["transient_names"],
+            redshift_gte=options["redshift_gte"],
+            redshift_lte=options["redshift_lte"],
+            processing_status=options["processing_status"],
+        )
+        try:
+            chunks = iter_export(transients, file_format, options["batch_size"])
+        except ValueError as err:
+            raise CommandError(str(err))
+
+        with open(options["output"], "wb") as output_file:
+            for chunk in chunks:
+                output_file.write(chunk)
+        self.stdout.write(f"Exported {transients.count()} transients.")
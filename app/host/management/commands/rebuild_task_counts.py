@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from host.models import Transient
+from host.models import TransientTaskCounts
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the task counts, progress and processing status of transients "
+        "from the task register."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "transient_names",
+            nargs="*",
+            help="Names of the transients to rebuild, defaults to all transients.",
+        )
+
+    def handle(self, *args, **options):
+        transients = Transient.objects.all()
+        if options["transient_names"]:
+            transients = transients.filter(name__in=options["transient_names"])
+        n_rebuilt = TransientTaskCounts.rebuild(transients)
+        self.stdout.write(f"Rebuilt task counts of {n_rebuilt} transients.")
@@ -1,8 +1,24 @@
+import yaml
+from django.core.exceptions import FieldDoesNotExist
 from django.db import migrations
-from django.core import serializers
+
+# fields of the natural keys in the fixtures, the historical models do not
+# have the managers that look them up
+NATURAL_KEY_FIELDS = {'host.status': 'message'}
+
+
+def related_pk(model, value):
+    """Primary key of a related object given by primary key or natural key."""
+    if isinstance(value, list):
+        field = NATURAL_KEY_FIELDS.get(model._meta.label_lower, 'name')
+        return model.objects.values_list('pk', flat=True).get(**{field: value[0]})
+    return value
 
 
 def load_fixtures(apps, schema_editor):
+    # The fixtures are loaded into the models as they are at this migration
+    # rather than the current models, which may have fields that are only
+    # added by later migrations.
     for fixture_file in [
         '/app/host/fixtures/initial/setup_survey_data.yaml',
         '/app/host/fixtures/initial/setup_filter_data.yaml',
@@ -17,10 +33,34 @@ def load_fixtures(apps, schema_editor):
     ]:
         # print(f'''  Loading fixture "{fixture_file}"...''')
         with open(fixture_file) as fp:
-            # Inspired by https://stackoverflow.com/a/25981899
-            objects = serializers.deserialize('yaml', fp, ignorenonexistent=True)
-            for obj in objects:
-                obj.save()
+            records = yaml.safe_load(fp) or []
+        for record in records:
+            model = apps.get_model(record['model'])
+            data, many_to_many = {}, {}
+            for name, value in record['fields'].items():
+                try:
+                    field = model._meta.get_field(name)
+                except FieldDoesNotExist:
+                    continue
+                if field.many_to_many:
+                    related_model = field.remote_field.model
+                    many_to_many[name] = [
+                        related_pk(related_model, item) for item in value
+                    ]
+                elif field.many_to_one or field.one_to_one:
+                    data[field.attname] = (
+                        None
+                        if value is None
+                        else related_pk(field.remote_field.model, value)
+                    )
+                else:
+                    data[field.attname] = field.to_python(value)
+
+            obj = model(pk=record.get('pk'), **data)
+            # as loaddata does, keep the values of auto_now fields
+            obj.save_base(raw=True)
+            for name, pks in many_to_many.items():
+                getattr(obj, name).set(pks)
 
 
 class Migration(migrations.Migration):
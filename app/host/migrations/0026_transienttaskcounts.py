@@ -0,0 +1,69 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def rebuild_task_counts(apps, schema_editor):
+    Transient = apps.get_model("host", "Transient")
+    TaskRegister = apps.get_model("host", "TaskRegister")
+    TransientTaskCounts = apps.get_model("host", "TransientTaskCounts")
+
+    rows = (
+        TaskRegister.objects.exclude(task__name="Log transient processing status")
+        .values("transient_id")
+        .annotate(
+            total=models.Count("pk"),
+            not_processed=models.Count(
+                "pk", filter=models.Q(status__message="not processed")
+            ),
+            processed=models.Count("pk", filter=models.Q(status__message="processed")),
+            failed=models.Count(
+                "pk",
+                filter=models.Q(status__type="error")
+                & ~models.Q(status__message="blocked"),
+            ),
+        )
+    )
+    TransientTaskCounts.objects.bulk_create(
+        [TransientTaskCounts(**row) for row in rows]
+    )
+    for transient_id in Transient.objects.exclude(
+        pk__in=[row["transient_id"] for row in rows]
+    ).values_list("pk", flat=True):
+        TransientTaskCounts.objects.create(transient_id=transient_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("host", "0025_sedfittingresult_dust1_fraction_16_and_more"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TransientTaskCounts",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("total", models.IntegerField(default=0)),
+                ("not_processed", models.IntegerField(default=0)),
+                ("processed", models.IntegerField(default=0)),
+                ("failed", models.IntegerField(default=0)),
+                (
+                    "transient",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="task_counts",
+                        to="host.transient",
+                    ),
+                ),
+            ],
+        ),
+        migrations.RunPython(rebuild_task_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+from django.db import migrations
+
+
+def add_queued_status(apps, schema_editor):
+    Status = apps.get_model("host", "Status")
+    Status.objects.get_or_create(message="queued", defaults={"type": "warning"})
+
+
+def remove_queued_status(apps, schema_editor):
+    Status = apps.get_model("host", "Status")
+    Status.objects.filter(message="queued").delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("host", "0026_transienttaskcounts"),
+    ]
+
+    operations = [
+        migrations.RunPython(add_queued_status, remove_queued_status),
+    ]
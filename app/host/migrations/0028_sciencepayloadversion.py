@@ -0,0 +1,49 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def create_payload_versions(apps, schema_editor):
+    Transient = apps.get_model("host", "Transient")
+    SciencePayloadVersion = apps.get_model("host", "SciencePayloadVersion")
+
+    SciencePayloadVersion.objects.bulk_create(
+        [
+            SciencePayloadVersion(transient_id=transient_id)
+            for transient_id in Transient.objects.values_list("pk", flat=True)
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("host", "0027_queued_status"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SciencePayloadVersion",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("version", models.IntegerField(default=0)),
+                (
+                    "transient",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="payload_version",
+                        to="host.transient",
+                    ),
+                ),
+            ],
+        ),
+        migrations.RunPython(create_payload_versions, migrations.RunPython.noop),
+    ]
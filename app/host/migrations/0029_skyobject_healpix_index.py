@@ -0,0 +1,53 @@
+from django.db import migrations, models
+from host.sky_index import healpix_index
+
+BATCH_SIZE = 10000
+
+
+def fill_healpix_index(apps, schema_editor):
+    # also fills the rows loaded from fixtures by 0024_load_fixtures
+    for model_name in ["Host", "Transient", "Aperture"]:
+        model = apps.get_model("host", model_name)
+        last_pk = 0
+        while True:
+            sky_objects = list(
+                model.objects.filter(pk__gt=last_pk)
+                .order_by("pk")
+                .only("pk", "ra_deg", "dec_deg")[:BATCH_SIZE]
+            )
+            if not sky_objects:
+                break
+            indices = healpix_index(
+                [sky_object.ra_deg for sky_object in sky_objects],
+                [sky_object.dec_deg for sky_object in sky_objects],
+            )
+            for sky_object, index in zip(sky_objects, indices.tolist()):
+                sky_object.healpix_index = index
+            model.objects.bulk_update(sky_objects, ["healpix_index"], batch_size=1000)
+            last_pk = sky_objects[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("host", "0028_sciencepayloadversion"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="aperture",
+            name="healpix_index",
+            field=models.BigIntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="host",
+            name="healpix_index",
+            field=models.BigIntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="transient",
+            name="healpix_index",
+            field=models.BigIntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.RunPython(fill_healpix_index, migrations.RunPython.noop),
+    ]
@@ -2,17 +2,18 @@
 This modules contains the django code used to create tables in the database
 backend.
 """
-import os
+import threading
+from contextlib import contextmanager
 
-import pandas as pd
 from astropy import units as u
 from astropy.coordinates import SkyCoord
-from django.conf import settings
 from django.contrib.auth.models import User
 from django.db import models
+from django.db import transaction
 from photutils.aperture import SkyEllipticalAperture
-from sedpy import observate
 
+from . import filter_curves
+from . import sky_index
 from .managers import ApertureManager
 from .managers import CatalogManager
 from .managers import CutoutManager
@@ -37,14 +38,51 @@ class SkyObject(models.Model):
             degrees of the host
         deg_deg (django.db.model.FloatField): Declination (ICRS) in decimal degrees
             of the host
+        healpix_index (django.db.model.BigIntegerField): Nested HEALPix pixel of
+            the position, set on save, for cone searches (see host.sky_index).
     """
 
     ra_deg = models.FloatField()
     dec_deg = models.FloatField()
+    healpix_index = models.BigIntegerField(null=True, blank=True, db_index=True)
 
     class Meta:
         abstract = True
 
+    def update_healpix_index(self):
+        """
+        Set the HEALPix pixel from the position.
+        """
+        if self.ra_deg is not None and self.dec_deg is not None:
+            self.healpix_index = sky_index.healpix_index(
+                float(self.ra_deg), float(self.dec_deg)
+            )
+
+    @staticmethod
+    def update_healpix_indices(sky_objects):
+        """
+        Set the HEALPix pixels of many objects at once, e.g. before a
+        bulk_create, which does not call save.
+        """
+        if not len(sky_objects):
+            return
+        indices = sky_index.healpix_index(
+            [float(sky_object.ra_deg) for sky_object in sky_objects],
+            [float(sky_object.dec_deg) for sky_object in sky_objects],
+        )
+        for sky_object, index in zip(sky_objects, indices.tolist()):
+            sky_object.healpix_index = index
+
+    def save(self, *args, **kwargs):
+        """
+        Save the object, updating the HEALPix pixel of its position.
+        """
+        self.update_healpix_index()
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and {"ra_deg", "dec_deg"} & set(update_fields):
+            kwargs["update_fields"] = set(update_fields) | {"healpix_index"}
+        super().save(*args, **kwargs)
+
     @property
     def sky_coord(self):
         """
@@ -222,6 +260,10 @@ class Task(models.Model):
         return f"{self.name}"
 
 
+# default of TaskRegister.save when the caller does not know the stored status
+UNKNOWN_STATUS = object()
+
+
 class TaskRegister(models.Model):
     """
     Keep track of the the various processing status of a transient.
@@ -234,10 +276,267 @@ class TaskRegister(models.Model):
     last_modified = models.DateTimeField(blank=True, null=True)
     last_processing_time_seconds = models.FloatField(blank=True, null=True)
 
+    def save(self, *args, previous_status_id=UNKNOWN_STATUS, **kwargs):
+        """
+        Save the register item and update the task counts of its transient
+        in the same transaction if the status changed.
+
+        Parameters:
+            previous_status_id (int): primary key of the status stored before
+                this save, None for a new item. It is read from the database
+                if not given.
+        """
+        with transaction.atomic():
+            if previous_status_id is UNKNOWN_STATUS:
+                previous_status_id = None
+                if self.pk is not None:
+                    previous_status_id = (
+                        TaskRegister.objects.filter(pk=self.pk)
+                        .values_list("status_id", flat=True)
+                        .first()
+                    )
+            super().save(*args, **kwargs)
+            if previous_status_id != self.status_id:
+                TransientTaskCounts.record_status_change(
+                    self.transient_id, self.task_id, previous_status_id, self.status_id
+                )
+
     def __repr__(self):
         return f" {self.transient.name} | {self.task.name} | {self.status.message}"
 
 
+class TransientTaskCounts(models.Model):
+    """
+    Running counts of the task statuses of a transient. They are updated
+    whenever the status of one of its register items changes, so that the
+    progress and processing status of the transient never need the whole
+    task register. Counts can be rebuilt from the register with
+    ``python manage.py rebuild_task_counts``.
+
+    Attributes:
+        transient (models.OneToOneField): Transient the counts belong to.
+        total (models.IntegerField): Number of tasks.
+        not_processed (models.IntegerField): Number of tasks not processed.
+        processed (models.IntegerField): Number of processed tasks.
+        failed (models.IntegerField): Number of tasks with an error status,
+            not counting the tasks skipped because of an earlier failure.
+    """
+
+    # bookkeeping task that reports the processing status itself
+    EXCLUDED_TASKS = ("Log transient processing status",)
+    # status of the tasks the scheduler skips, the failure is already counted
+    # on the task that caused it
+    SKIPPED_STATUS = "blocked"
+
+    # the statuses and tasks are fixed, so they are only read once per process
+    _statuses = {}
+    _excluded_task_ids = None
+
+    transient = models.OneToOneField(
+        Transient, on_delete=models.CASCADE, related_name="task_counts"
+    )
+    total = models.IntegerField(default=0)
+    not_processed = models.IntegerField(default=0)
+    processed = models.IntegerField(default=0)
+    failed = models.IntegerField(default=0)
+
+    @property
+    def progress(self):
+        """Percentage of tasks that are no longer waiting to be processed."""
+        if not self.total:
+            return 0
+        return int(round(100 * (1 - self.not_processed / self.total), 0))
+
+    @property
+    def processing_status(self):
+        """Processing status of the transient."""
+        if self.total and self.processed == self.total:
+            return "completed"
+        if self.failed > 0:
+            return "blocked"
+        return "processing"
+
+    def _count(self, status, sign):
+        if status.message == "not processed":
+            self.not_processed += sign
+        elif status.message == "processed":
+            self.processed += sign
+        if status.type == "error" and status.message != self.SKIPPED_STATUS:
+            self.failed += sign
+
+    def save_transient_progress(self):
+        """Copy the progress and processing status onto the transient."""
+        Transient.objects.filter(pk=self.transient_id).update(
+            progress=self.progress, processing_status=self.processing_status
+        )
+        SciencePayloadVersion.bump([self.transient_id])
+
+    @classmethod
+    def record_status_change(cls, transient_id, task_id, previous_status_id, status_id):
+        """
+        Update the counts of a transient after one of its tasks changed
+        status. Must be called inside a transaction.
+
+        Parameters:
+            transient_id (int): primary key of the transient.
+            task_id (int): primary key of the task that changed.
+            previous_status_id (int): primary key of the previous status, None
+                if the register item is new.
+            status_id (int): primary key of the new status.
+        """
+        if cls._excluded_task_ids is None:
+            cls._excluded_task_ids = set(
+                Task.objects.filter(name__in=cls.EXCLUDED_TASKS).values_list(
+                    "pk", flat=True
+                )
+            )
+        if task_id in cls._excluded_task_ids:
+            return
+
+        missing = {previous_status_id, status_id} - {None} - cls._statuses.keys()
+        if missing:
+            cls._statuses.update(Status.objects.in_bulk(missing))
+        counts, _ = cls.objects.select_for_update().get_or_create(
+            transient_id=transient_id
+        )
+        if previous_status_id is None:
+            counts.total += 1
+        else:
+            counts._count(cls._statuses[previous_status_id], -1)
+        counts._count(cls._statuses[status_id], 1)
+        counts.save()
+        counts.save_transient_progress()
+
+    @classmethod
+    def rebuild(cls, transients=None):
+        """
+        Rebuild the counts from the task register.
+
+        Parameters:
+            transients (QuerySet): transients to rebuild, defaults to all.
+        Returns:
+            (int): number of transients rebuilt.
+        """
+        if transients is None:
+            transients = Transient.objects.all()
+        registers = TaskRegister.objects.filter(transient__in=transients).exclude(
+            task__name__in=cls.EXCLUDED_TASKS
+        )
+        rows = registers.values("transient_id").annotate(
+            total=models.Count("pk"),
+            not_processed=models.Count(
+                "pk", filter=models.Q(status__message="not processed")
+            ),
+            processed=models.Count("pk", filter=models.Q(status__message="processed")),
+            failed=models.Count(
+                "pk",
+                filter=models.Q(status__type="error")
+                & ~models.Q(status__message=cls.SKIPPED_STATUS),
+            ),
+        )
+        rows = {row["transient_id"]: row for row in rows}
+
+        all_counts = []
+        for transient_id in transients.values_list("pk", flat=True):
+            row = rows.get(transient_id, {})
+            all_counts.append(
+                cls(
+                    transient_id=transient_id,
+                    total=row.get("total", 0),
+                    not_processed=row.get("not_processed", 0),
+                    processed=row.get("processed", 0),
+                    failed=row.get("failed", 0),
+                )
+            )
+
+        with transaction.atomic():
+            cls.objects.filter(transient__in=transients).delete()
+            cls.objects.bulk_create(all_counts)
+            Transient.objects.bulk_update(
+                [
+                    Transient(
+                        pk=counts.transient_id,
+                        progress=counts.progress,
+                        processing_status=counts.processing_status,
+                    )
+                    for counts in all_counts
+                ],
+                ["progress", "processing_status"],
+                batch_size=1000,
+            )
+            SciencePayloadVersion.bump(transients.values("pk"))
+        return len(all_counts)
+
+
+# transient ids collected by SciencePayloadVersion.deferred_bumps in this thread
+_deferred_bumps = threading.local()
+
+
+class SciencePayloadVersion(models.Model):
+    """
+    Version of the science payload of a transient, bumped whenever data in the
+    payload is written so that cached payloads and their ETags can be checked
+    with a single lookup. Saves and deletes of the models in the payload bump
+    it through signals (see api.signals). Writes that send no signals are
+    followed by a task status change, which bumps it through the task counts.
+
+    Attributes:
+        transient (models.OneToOneField): Transient the version belongs to.
+        version (models.IntegerField): Version of the science payload.
+    """
+
+    transient = models.OneToOneField(
+        Transient, on_delete=models.CASCADE, related_name="payload_version"
+    )
+    version = models.IntegerField(default=0)
+
+    @classmethod
+    def bump(cls, transient_ids):
+        """
+        Bump the payload versions of transients. Rows are only updated, never
+        created, so this is safe while the transients are being deleted.
+        Inside :meth:`deferred_bumps`, transients given by a list of primary
+        keys are bumped when the context exits.
+
+        Parameters:
+            transient_ids (list or QuerySet): primary keys of the transients.
+        """
+        deferred_ids = getattr(_deferred_bumps, "transient_ids", None)
+        if deferred_ids is not None and isinstance(transient_ids, list):
+            deferred_ids.update(transient_ids)
+            return
+        cls.objects.filter(transient_id__in=transient_ids).update(
+            version=models.F("version") + 1
+        )
+
+    @classmethod
+    @contextmanager
+    def deferred_bumps(cls):
+        """
+        Collect the bumps made in the context and apply them with one update
+        when it exits, e.g. around bulk deletes, which send a signal and so
+        bump once per deleted object.
+        """
+        if getattr(_deferred_bumps, "transient_ids", None) is not None:
+            # already collected by an enclosing context
+            yield
+            return
+
+        _deferred_bumps.transient_ids = set()
+        try:
+            yield
+        finally:
+            transient_ids = _deferred_bumps.transient_ids
+            _deferred_bumps.transient_ids = None
+        if transient_ids:
+            cls.bump(list(transient_ids))
+
+    @classmethod
+    def bump_all(cls):
+        """Bump the payload versions of all transients, e.g. for a new filter."""
+        cls.objects.update(version=models.F("version") + 1)
+
+
 class ExternalResourceCall(models.Model):
     """
     A model to represent a call to a call to an external resource.
@@ -295,41 +594,13 @@ class Filter(models.Model):
         """
         Returns the transmission curve of the filter
         """
-        curve_name = f"{settings.TRANSMISSION_CURVES_ROOT}/{self.name}.txt"
-
-        try:
-            transmission_curve = pd.read_csv(curve_name, sep="\s+", header=None)
-        except Exception as err:
-            raise ValueError(
-                f"{self.name}: Problem loading filter transmission curve from {curve_name}: {err}"
-            )
-
-        wavelength = transmission_curve[0].to_numpy()
-        transmission = transmission_curve[1].to_numpy()
-        return observate.Filter(
-            kname=self.name, nick=self.name, data=(wavelength, transmission)
-        )
+        return filter_curves.transmission_curve(self.name)
 
     def correlation_model(self):
         """
         Returns the model for correlated errors of the filter, if it exists
         """
-        corr_model_name = (
-            f"{settings.TRANSMISSION_CURVES_ROOT}/{self.name}_corrmodel.txt"
-        )
-        if not os.path.exists(corr_model_name):
-            return None, None
-
-        try:
-            corr_model = pd.read_csv(corr_model_name, sep="\s+", header=None)
-        except Exception as err:
-            raise ValueError(
-                f"{self.name}: Problem loading filter correlation model from {corr_model_name}: {err}"
-            )
-
-        app_radius = corr_model[0].to_numpy()
-        error_adjust = corr_model[1].to_numpy() ** (1 / 2.0)
-        return app_radius, error_adjust
+        return filter_curves.correlation_model(self.name)
 
 
 class Catalog(models.Model):
@@ -21,9 +21,11 @@ from bokeh.palettes import Category20
 from bokeh.plotting import ColumnDataSource
 from bokeh.plotting import figure
 from bokeh.transform import cumsum
-from host.models import Filter
+from host.filter_curves import transmission_curve
 from host.photometric_calibration import maggies_to_mJy
 from host.prospector import build_obs
+from host.sed_output import is_sed_output
+from host.sed_output import SEDOutput
 
 # import extinction
 # from bokeh.models import Circle
@@ -303,20 +305,29 @@ def plot_sed(transient=None, sed_results_file=None, type=""):
 
     # second check on SED file
     # long-term shouldn't be necessary, just a result of debugging
-    if sed_results_file is not None and os.path.exists(
+    model_data = None
+    if is_sed_output(sed_results_file):
+        with SEDOutput(sed_results_file) as sed_output:
+            redshift = sed_output.redshift
+            # only the model spectrum and photometry are read
+            model_data = sed_output.model_data(
+                ["rest_wavelength", "spec", "spec_16", "spec_84", "phot"]
+            )
+    elif sed_results_file is not None and os.path.exists(
         sed_results_file.replace(".h5", "_modeldata.npz")
     ):
         result, obs, _ = reader.results_from(sed_results_file, dangerous=False)
+        redshift = result["obs"]["redshift"]
         model_data = np.load(
             sed_results_file.replace(".h5", "_modeldata.npz"), allow_pickle=True
         )
 
+    if model_data is not None:
         # best = result["bestfit"]
         if transient.best_redshift < 0.015:
-            a = result["obs"]["redshift"] - 0.015 + 1
+            a = redshift - 0.015 + 1
             mag_off = (
-                cosmo.distmod(result["obs"]["redshift"]).value
-                - cosmo.distmod(result["obs"]["redshift"] - 0.015).value
+                cosmo.distmod(redshift).value - cosmo.distmod(redshift - 0.015).value
             )
             print(f"mag off: {mag_off}")
             fig.line(
@@ -337,7 +348,7 @@ def plot_sed(transient=None, sed_results_file=None, type=""):
             )
         else:
             mag_off = 0
-            a = result["obs"]["redshift"] + 1
+            a = redshift + 1
             fig.line(
                 a * model_data["rest_wavelength"],
                 maggies_to_mJy(model_data["spec"]),
@@ -358,10 +369,7 @@ def plot_sed(transient=None, sed_results_file=None, type=""):
         #  pre-SBI++ version: fig.line(a * best["restframe_wavelengths"], maggies_to_mJy(best["spectrum"]))
         if obs["filters"] is not None:
             try:
-                pwave = [
-                    Filter.objects.get(name=f).transmission_curve().wave_effective
-                    for f in obs["filters"]
-                ]
+                pwave = [transmission_curve(f).wave_effective for f in obs["filters"]]
             except:
                 pwave = [f.wave_effective for f in obs["filters"]]
 
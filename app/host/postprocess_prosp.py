@@ -11,6 +11,7 @@ To use this script on SBI posteriors, replace that block that reads in a Prospec
 
 If you train the SBI on the stellar mass, instead the total mass formed (the default from prospector), then there is no need to run the block that does this transformation in run_all().
 """
+import multiprocessing
 import os
 import random
 import sys
@@ -21,7 +22,6 @@ from astropy.cosmology import WMAP9 as cosmo
 from astropy.io import fits
 from astropy.table import Table
 from dynesty.utils import resample_equal
-from prospect.models.transforms import logsfr_ratios_to_masses
 from prospect.plotting.corner import quantile
 
 
@@ -133,54 +133,53 @@ def getSFH(
     sfr : 3 x npix x n_sfrtimes -- 16/50/84% SFR over each timescale
     """
 
-    # run the transforms to get the SFH at each step in the chain for every pixel:
-    # (pixel, agebin, chain step)
-    nsamples = chain.shape[0]
-    allsfhs = np.zeros((nsamples, nagebins))
-    allagebins = np.zeros((nsamples, nagebins, 2))
-    allMWA = np.zeros((nsamples))
-
-    # make the SFR for each draw in each pixel
-    for iteration in range(nsamples):
-        # get agebins and time spacing
-        allagebins[iteration, :, :] = z_to_agebins(
-            zred=zred
-        )  # chain[:,theta_index['zred']][iteration][0])
-        dt = 10 ** allagebins[iteration, :, 1] - 10 ** allagebins[iteration, :, 0]
-
-        # get mass per bin
-        masses = logsfr_ratios_to_masses(
-            logsfr_ratios=chain[:, theta_index["logsfr_ratios"]][iteration, :],
-            agebins=allagebins[iteration, :, :],
-            logmass=chain[:, theta_index["logmass"]][iteration][0],
-        )
-
-        # convert to sfr
-        allsfhs[iteration, :] = masses / dt
-
-        # go ahead and get the mass-weighted age too
-        allMWA[iteration] = get_mwa(allagebins[iteration, :, :], allsfhs[iteration, :])
+    # every sample shares the redshift, so the agebins are the same for all
+    agebins = z_to_agebins(zred=zred)[:nagebins]
+    dt = 10 ** agebins[:, 1] - 10 ** agebins[:, 0]
+
+    # get mass per bin for all samples at once, as in
+    # prospect.models.transforms.logsfr_ratios_to_masses:
+    # M_i is proportional to dt_i / dt_0 / prod_{j<i} SFR_j / SFR_{j+1}
+    logmass = chain[:, theta_index["logmass"]][:, 0]
+    sratios = 10 ** np.clip(chain[:, theta_index["logsfr_ratios"]], -100, 100)
+    sratio_prods = np.ones((chain.shape[0], nagebins))
+    sratio_prods[:, 1:] = np.cumprod(sratios, axis=1)[:, : nagebins - 1]
+    coeffs = (dt / dt[0]) / sratio_prods
+    masses = (10**logmass / coeffs.sum(axis=1))[:, None] * coeffs
+
+    # convert to sfr
+    allsfhs = masses / dt
+
+    # go ahead and get the mass-weighted age too, in Gyr
+    mean_ages = np.mean(10**agebins, axis=1)
+    allMWA = (
+        np.sum(mean_ages * allsfhs * dt, axis=1) / np.sum(allsfhs * dt, axis=1) / 1e9
+    )
 
     # interpolate everything onto the same time grid
     # define the grid as going from lookback time = 0 to the oldest time in all the samples
-    # with 1000 log-spaced samples in between (might want to update this later!)
-    allagebins_ago = 10**allagebins / 1e9
+    # with tbins log-spaced samples in between
+    agebins_ago = 10**agebins / 1e9
     age_interp = (
-        np.logspace(1, np.log10(np.max(allagebins_ago * 1e9)), tbins) / 1e9
+        np.logspace(1, np.log10(np.max(agebins_ago * 1e9)), tbins) / 1e9
     )  # lookback time in Gyr
-    allsfhs_interp = np.zeros((nsamples, len(age_interp)))
-    allsfrs = np.zeros((nsamples, len(sfrtimes)))
-    dt = (age_interp - np.insert(age_interp, 0, 0)[:-1]) * 1e9  # in *years* to calc sfr
-    for iteration in range(nsamples):
-        allsfhs_interp[iteration, :] = stepInterp(
-            allagebins_ago[iteration, :], allsfhs[iteration, :], age_interp
-        )
 
-        # also get SFR averaged over all the timescales we want
-        for i, time in enumerate(sfrtimes):
-            allsfrs[iteration, i] = np.mean(
-                allsfhs_interp[iteration, (age_interp <= time * 1e-9)]
-            )
+    # step interpolation: the agebin each interpolated time falls in
+    bin_index = np.full(len(age_interp), -1)
+    for i in range(nagebins):
+        in_bin = (age_interp >= agebins_ago[i, 0]) & (age_interp < agebins_ago[i, 1])
+        bin_index[in_bin] = i
+    allsfhs_interp = np.where(bin_index >= 0, allsfhs[:, bin_index], np.nan)
+    allsfhs_interp[:, -1] = 0
+
+    # also get SFR averaged over all the timescales we want
+    allsfrs = np.stack(
+        [
+            np.mean(allsfhs_interp[:, age_interp <= time * 1e-9], axis=1)
+            for time in sfrtimes
+        ],
+        axis=1,
+    )
 
     if rtn_chains:
         return (age_interp, allsfhs_interp, allMWA, allsfrs, allsfhs)
@@ -193,6 +192,97 @@ def getSFH(
         return (age_interp, sfh.T, mwa, sfr.T, allsfh_nointerp.T)
 
 
+# model, sps and obs used by _predict_draw, inherited by forked worker processes
+_predict_state = {}
+
+
+def _predict_draw(theta):
+    return _predict_state["mod_fsps"].predict(
+        theta, sps=_predict_state["sps"], obs=_predict_state["obs"]
+    )
+
+
+def posterior_predictive(
+    chain,
+    mod_fsps,
+    sps,
+    obs,
+    ndraws=100,
+    zred=None,
+    stellar_mass=False,
+    processes=1,
+    seed=None,
+):
+    """model spectra and photometry for random draws from an equally
+    weighted chain, computed once so that they can be reused for the
+    best-fit model and for the percentiles.
+
+    Parameters
+    ___________
+
+    chain : nsamples x nparams equally weighted posterior samples
+    mod_fsps, sps : prospector model and sps object
+    obs : observations dictionary
+    ndraws : number of posterior draws
+    zred : if given, the redshift of every draw is fixed to this value
+    stellar_mass : if True, the mass in the chain is the surviving stellar
+        mass and the predictions are rescaled to the total mass formed
+    processes : number of forked worker processes to predict with,
+        1 predicts serially in this process. Daemonic processes, such as
+        the children of a celery prefork worker, cannot fork workers, so
+        there it must be 1 unless the worker runs with a threads or solo
+        pool
+    seed : seed of the random draws
+
+    Returns
+    __________
+
+    dictionary with the chain indices of the draws ('draws'), their
+    parameters ('theta'), and ndraws x nwave model spectra ('spec'),
+    ndraws x nfilters model photometry ('phot') and surviving mass
+    fractions ('mfrac')
+    """
+    rng = np.random.default_rng(seed)
+    nsamples = chain.shape[0]
+    draws = rng.choice(nsamples, size=ndraws, replace=ndraws > nsamples)
+    thetas = np.array(chain[draws], dtype=float)
+    if zred is not None:
+        thetas[:, theta_index()["zred"]] = zred
+
+    if processes > 1 and multiprocessing.current_process().daemon:
+        raise RuntimeError(
+            f"cannot predict with {processes} processes in the daemonic process "
+            f"{multiprocessing.current_process().name}, e.g. a celery prefork "
+            "worker: set SED_PREDICTIVE_PROCESSES=1, or run the worker with "
+            "--pool threads or --pool solo"
+        )
+
+    _predict_state.update(mod_fsps=mod_fsps, sps=sps, obs=obs)
+    if processes > 1:
+        with multiprocessing.get_context("fork").Pool(processes) as pool:
+            predictions = pool.map(_predict_draw, thetas)
+    else:
+        predictions = (_predict_draw(theta) for theta in thetas)
+
+    spec = phot = None
+    mfrac = np.zeros(ndraws)
+    for i, (modspec, modphot, modmfrac) in enumerate(predictions):
+        if spec is None:
+            spec = np.zeros((ndraws, len(modspec)))
+            phot = np.zeros((ndraws, len(modphot)))
+        spec[i] = modspec
+        phot[i] = modphot
+        mfrac[i] = modmfrac
+
+    if stellar_mass:
+        # model fluxes scale linearly with the total mass formed, which is
+        # the stellar mass divided by the surviving mass fraction
+        spec /= mfrac[:, None]
+        phot /= mfrac[:, None]
+
+    return {"draws": draws, "theta": thetas, "spec": spec, "phot": phot, "mfrac": mfrac}
+
+
 def get_all_outputs_and_chains(
     res=None,
     keys=None,
@@ -277,10 +367,8 @@ def get_all_outputs_and_chains(
     return percentiles, chains, sub_idx
 
 
-def run_all(
-    fname,
-    unw_fname,
-    perc_fname,
+def postprocess(
+    res,
     zred,
     prior="p-alpha",
     mod_fsps=None,
@@ -288,14 +376,14 @@ def run_all(
     percents=[15.9, 50, 84.1],
     use_weights=True,
     obs=None,
-    **extra
+    predictive=None,
 ):
-    # XXX read in prospector outputs
-    if obs is None:
-        res, obs, _ = reader.results_from(fname, dangerous=False)
-    else:
-        res, _, _ = reader.results_from(fname, dangerous=False)
-
+    """postprocess a prospector or SBI++ posterior into percentiles and sub-sampled chains.
+    res: dict with the "chain", its "theta_labels" and, for weighted samples, its "weights".
+    If ``predictive`` (from ``posterior_predictive``) is given, its model photometry and
+    spectra are used for the model percentiles instead of predicting again.
+    returns the percentiles and the chains as dicts of arrays"""
+    res = dict(res)
     res["theta_index"] = theta_index(prior)
     # If sampling using dynesty, we resample the chains so that each has an equal weight.
     if use_weights:
@@ -324,35 +412,71 @@ def run_all(
     percentiles, chains, sub_idx = get_all_outputs_and_chains(res, keys=keys, zred=zred)
 
     # ---------- total mass formed -> stellar mass
-    stellarmass = []
-    ssfr = []
-    modphots_all = []
-    modspecs_all = []
-
-    for i, _subidx in enumerate(sub_idx):
-        modspec, modmags, sm = mod_fsps.predict(
-            res["chain"][int(_subidx)], sps=sps, obs=obs
-        )
-        modphots_all.append(modmags)  # model photometry
-        modspecs_all.append(modspec)  # model spectrum
-        _mass = res["chain"][int(_subidx)][mass_idx]
-
-        stellarmass.append(
-            _mass
-        )  ## mass is already converted to surviving mass in training
-
-        ssfr.append(
-            chains["sfr"][i] / 10 ** stellarmass[-1]
-        )  # sfr chains are already sub-sampled
-    stellarmass = np.array(stellarmass)
-    ssfr = np.array(ssfr)
-    modphots_all = np.array(modphots_all)
+    ## mass is already converted to surviving mass in training
+    stellarmass = res["chain"][sub_idx, mass_idx]
+    # sfr chains are already sub-sampled
+    ssfr = chains["sfr"] / 10 ** stellarmass[:, None]
+
+    if predictive is None:
+        modphots_all, modspecs_all = [], []
+        for _subidx in sub_idx:
+            modspec, modmags, sm = mod_fsps.predict(
+                res["chain"][int(_subidx)], sps=sps, obs=obs
+            )
+            modphots_all.append(modmags)  # model photometry
+            modspecs_all.append(modspec)  # model spectrum
+        modphots_all = np.array(modphots_all)
+        modspecs_all = np.array(modspecs_all)
+    else:
+        # reuse the posterior predictive draws of the best-fit model
+        modphots_all = predictive["phot"]
+        modspecs_all = predictive["spec"]
 
     percentiles["stellar_mass"] = np.percentile(stellarmass, percents)
     percentiles["ssfr"] = np.percentile(ssfr, percents, axis=0).T
     percentiles["modphot"] = np.percentile(modphots_all, percents, axis=0).T
     percentiles["modspec"] = np.percentile(modspecs_all, percents, axis=0).T
 
+    chains["stellar_mass"] = stellarmass
+    chains["ssfr"] = ssfr
+
+    return percentiles, chains
+
+
+def run_all(
+    fname,
+    unw_fname,
+    perc_fname,
+    zred,
+    prior="p-alpha",
+    mod_fsps=None,
+    sps=None,
+    percents=[15.9, 50, 84.1],
+    use_weights=True,
+    obs=None,
+    predictive=None,
+    **extra,
+):
+    """postprocess a prospector or SBI++ posterior file and save the percentiles and
+    sub-sampled chains to npz files, see postprocess."""
+    # XXX read in prospector outputs
+    if obs is None:
+        res, obs, _ = reader.results_from(fname, dangerous=False)
+    else:
+        res, _, _ = reader.results_from(fname, dangerous=False)
+
+    percentiles, chains = postprocess(
+        res,
+        zred,
+        prior=prior,
+        mod_fsps=mod_fsps,
+        sps=sps,
+        percents=percents,
+        use_weights=use_weights,
+        obs=obs,
+        predictive=predictive,
+    )
+
     # XXX save percentiles to files
     # perc_fname = fname.replace('mcmc', 'perc')
     # perc_fname = perc_fname.replace('.h5', '.npz')
@@ -361,8 +485,6 @@ def run_all(
     # XXX save chains to files
     # unw_fname = fname.replace('mcmc', 'chain')
     # unw_fname = unw_fname.replace('.h5', '.npz')
-    chains["stellar_mass"] = stellarmass
-    chains["ssfr"] = ssfr
     np.savez(unw_fname, chains=chains)
 
     # load as
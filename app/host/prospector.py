@@ -1,23 +1,17 @@
 # Utils and wrappers for the prospector SED fitting code
-import copy
-import json
 import os
 import time
 
 import extinction
-import h5py
 import numpy as np
-import prospect.io.read_results as reader
 from astropy.cosmology import WMAP9 as cosmo
 from django.conf import settings
 from django.db.models import Q
 from django.db.utils import ProgrammingError
+from dynesty.utils import resample_equal
 from host import postprocess_prosp as pp
 from prospect.fitting import fit_model as fit_model_prospect
 from prospect.fitting import lnprobfn
-from prospect.io import write_results as writer
-from prospect.io.write_results import write_h5_header
-from prospect.io.write_results import write_obs_to_h5
 from prospect.models import priors
 from prospect.models import SpecModel
 from prospect.models.sedmodel import PolySpecModel
@@ -33,12 +27,13 @@ from scipy.special import gammainc
 from .host_utils import get_dust_maps
 from .models import AperturePhotometry
 from .models import Filter
-from .models import hdf5_file_path
 from .photometric_calibration import mJy_to_maggies  ##jansky_to_maggies
+from .sed_output import LEGACY_SUFFIXES
+from .sed_output import sed_output_path
+from .sed_output import write_sed_output
 
 try:
     all_filters = [filt for filt in Filter.objects.all().select_related()]
-    trans_curves = [f.transmission_curve() for f in all_filters]
 except ProgrammingError:
     pass
 
@@ -120,7 +115,7 @@ def build_obs(transient, aperture_type, use_mag_offset=True):
 
     filters, flux_maggies, flux_maggies_error = [], [], []
 
-    for filter, trans_curve in zip(all_filters, trans_curves):
+    for filter in all_filters:
         try:
             if filter.name in filter_names:
                 datapoint = photometry.get(filter=filter)
@@ -148,6 +143,7 @@ def build_obs(transient, aperture_type, use_mag_offset=True):
                 f"aperture_type must be 'global' or 'local', currently set to {aperture_type}"
             )
 
+        trans_curve = filter.transmission_curve()
         wave_eff = trans_curve.wave_effective
         ext_corr = extinction.fitzpatrick99(np.array([wave_eff]), mwebv * 3.1, r_v=3.1)[
             0
@@ -771,131 +767,60 @@ def prospector_result_to_blast(
     parametric_sfh=False,
     sbipp=False,
 ):
-    # write the results
-    hdf5_file_name = (
-        f"{sed_output_root}/{transient.name}/{transient.name}_{aperture.type}.h5"
-    )
-    hdf5_file = hdf5_file_name
-
-    if not os.path.exists(f"{sed_output_root}/{transient.name}"):
-        os.makedirs(f"{sed_output_root}/{transient.name}/")
-    if os.path.exists(hdf5_file):
-        # prospector won't overwrite, which causes problems
-        os.remove(hdf5_file)
-
-    if sbipp:
-        hf = h5py.File(hdf5_file_name, "w")
-
-        sdat = hf.create_group("sampling")
-        sdat.create_dataset("chain", data=prospector_output["sampling"][0]["samples"])
-        sdat.attrs["theta_labels"] = json.dumps(
-            list(model_components["model"].theta_labels())
-        )
-
-        # High level parameter and version info
-        write_h5_header(hf, {}, model_components["model"])
-
-        # ----------------------
-        # Observational data
-        write_obs_to_h5(hf, observations)
-        hf.flush()
+    sed_file = sed_output_path(sed_output_root, transient.name, aperture.type)
+    theta_labels = list(model_components["model"].theta_labels())
+
+    use_weights = not sbipp
+    if use_weights:
+        # dynesty samples are weighted, draw from the equally weighted chain
+        dynesty_output = prospector_output["sampling"][0]
+        posterior_chain = dynesty_output["samples"]
+        weights = np.exp(dynesty_output["logwt"] - dynesty_output["logz"][-1])
+        chain = resample_equal(posterior_chain, weights)
     else:
-        writer.write_hdf5(
-            hdf5_file,
-            {},
-            model_components["model"],
-            observations,
-            prospector_output["sampling"][0],
-            None,
-            sps=model_components["sps"],
-            tsample=prospector_output["sampling"][1],
-            toptimize=0.0,
-        )
+        posterior_chain = prospector_output["sampling"][0]["samples"]
+        weights = None
+        chain = posterior_chain
 
-    # load up the hdf5 file to get the results
-    resultpars, obs, _ = reader.results_from(hdf5_file, dangerous=False)
-
-    # if sbipp:
-    #     theta_max = resultpars["chain"][100] #np.mean(resultpars["chain"], axis=0) # + np.std(resultpars["chain"], axis=0)
-    # else:
-    #    imax = np.argmax(resultpars["lnprobability"])
-    #    csz = resultpars["chain"].shape
-    #    if resultpars["chain"].ndim > 2:
-    # emcee
-    #        i, j = np.unravel_index(imax, resultpars["lnprobability"].shape)
-    #        theta_max = resultpars["chain"][i, j, :].copy()
-    #    else:
-    # dynesty
-    #        theta_max = resultpars["chain"][imax, :].copy()
-
-    model_init = copy.deepcopy(model_components["model"])
     tstart = time.time()
-    ### take the mean of 50 random samples to get the "best fit" model
-    # best_phot_store = np.array([])
-    for i in range(50):
-        theta = resultpars["chain"][
-            np.random.choice(np.arange(np.shape(resultpars["chain"])[0])), :
-        ]
-        theta[0] = observations["redshift"]
-        if i == 0:
-            best_spec, best_phot, mfrac = model_components["model"].predict(
-                theta, obs=observations, sps=model_components["sps"]
-            )
-
-            theta[1] -= np.log10(mfrac)
-            ### we need our mass to be conv to total \
-            ###    formed mass for the model to be accurate
-            best_spec, best_phot, mfrac = model_init.predict(
-                theta, obs=observations, sps=model_components["sps"]
-            )
-            best_phot_store = best_phot[:]
-            best_spec_store = best_spec[:]
-        else:
-            best_spec_single, best_phot_single, mfrac_single = model_components[
-                "model"
-            ].predict(theta, obs=observations, sps=model_components["sps"])
-            theta[1] -= np.log10(mfrac)
-            ### we need our mass to be conv to total \
-            ###    formed mass for the model to be accurate
-            best_spec_single, best_phot_single, mfrac_single = model_init.predict(
-                theta, obs=observations, sps=model_components["sps"]
-            )
-
-            # iteratively update the mean
-            best_spec = (best_spec * i + best_spec_single) / (i + 1)
-            best_phot = (best_phot * i + best_phot_single) / (i + 1)
-            mfrac = (mfrac * i + mfrac_single) / (i + 1)
-            best_phot_store = np.vstack([best_phot_store, best_phot_single])
-            best_spec_store = np.vstack([best_spec_store, best_spec_single])
-    best_phot = np.median(best_phot_store, axis=0)
-    best_spec = np.median(best_spec_store, axis=0)
-    phot_16, phot_84 = np.percentile(best_phot_store, [16, 84], axis=0)
-    spec_16, spec_84 = np.percentile(best_spec_store, [16, 84], axis=0)
+    ### the "best fit" model is the median of the posterior predictive draws
+    ### we need our mass to be conv to total formed mass for the model to be
+    ### accurate
+    predictive = pp.posterior_predictive(
+        chain,
+        model_components["model"],
+        model_components["sps"],
+        observations,
+        ndraws=settings.SED_PREDICTIVE_DRAWS,
+        zred=observations["redshift"],
+        stellar_mass=True,
+        processes=settings.SED_PREDICTIVE_PROCESSES,
+    )
+    best_phot = np.median(predictive["phot"], axis=0)
+    best_spec = np.median(predictive["spec"], axis=0)
+    phot_16, phot_84 = np.percentile(predictive["phot"], [16, 84], axis=0)
+    spec_16, spec_84 = np.percentile(predictive["spec"], [16, 84], axis=0)
+    mfrac = np.mean(predictive["mfrac"])
     tfin = time.time()
     print(f"sampling chains to get best-fit model took {tfin-tstart:.0f} seconds")
 
     if not parametric_sfh:
-        use_weights = not sbipp
-
-        pp.run_all(
-            hdf5_file_name,
-            hdf5_file_name.replace(".h5", "_chain.npz"),
-            hdf5_file_name.replace(".h5", "_perc.npz"),
-            model_components["model"]._zred[0],
+        perc, chains = pp.postprocess(
+            {
+                "chain": posterior_chain,
+                "weights": weights,
+                "theta_labels": theta_labels,
+            },
+            observations["redshift"],
             prior="p-alpha",
             mod_fsps=model_components["model"],
             sps=model_components["sps"],
             percents=[15.9, 50, 84.1],
             use_weights=use_weights,
-            sbipp=sbipp,
             obs=observations,
+            predictive=predictive,
         )
 
-        percentiles = np.load(
-            hdf5_file_name.replace(".h5", "_perc.npz"), allow_pickle=True
-        )
-        perc = np.atleast_1d(percentiles["percentiles"])[0]
-
     logmass16, logmass50, logmass84 = perc["stellar_mass"]
     age16, age50, age84 = perc["mwa"]
     logsfr16, logsfr50, logsfr84 = np.log10(perc["sfr"][0])
@@ -933,18 +858,17 @@ def prospector_result_to_blast(
         ]
 
     if parametric_sfh:
-        tau = resultpars["chain"][
-            ..., np.where(np.array(resultpars["theta_labels"]) == "tau")[0][0]
-        ]
+        tau = posterior_chain[..., np.where(np.array(theta_labels) == "tau")[0][0]]
         tau16, tau50, tau84 = get_CI(tau)
 
     prosp_results = {
         "transient": transient,
         "aperture": aperture,
-        "posterior": hdf5_file,
-        "chains_file": hdf5_file_name.replace(".h5", "_chain.npz"),
-        "percentiles_file": hdf5_file_name.replace(".h5", "_perc.npz"),
-        "model_file": hdf5_file_name.replace(".h5", "_modeldata.npz"),
+        "posterior": sed_file,
+        # everything is in the output container, see host.sed_output
+        "chains_file": None,
+        "percentiles_file": None,
+        "model_file": None,
         "log_mass_16": logmass16,
         "log_mass_50": logmass50,
         "log_mass_84": logmass84,
@@ -994,15 +918,34 @@ def prospector_result_to_blast(
         prosp_results["log_tau_50"] = (tau50,)
         prosp_results["log_tau_84"] = (tau84,)
         
-    np.savez(
-        hdf5_file_name.replace(".h5", "_modeldata.npz"),
-        rest_wavelength=model_components["sps"].wavelengths,
-        spec=best_spec,
-        phot=best_phot,
-        spec_16=spec_16,
-        spec_84=spec_84,
-        phot_16=phot_16,
-        phot_84=phot_84,
+    write_sed_output(
+        sed_file,
+        chain=posterior_chain,
+        theta_labels=theta_labels,
+        observations=observations,
+        percentiles=perc,
+        chains=chains,
+        model_data={
+            "rest_wavelength": model_components["sps"].wavelengths,
+            "spec": best_spec,
+            "phot": best_phot,
+            "spec_16": spec_16,
+            "spec_84": spec_84,
+            "phot_16": phot_16,
+            "phot_84": phot_84,
+        },
+        weights=weights,
+        percents=[15.9, 50, 84.1],
+        attrs={
+            "transient": transient.name,
+            "aperture_type": aperture.type,
+            "sampler": "dynesty" if use_weights else "sbi++",
+        },
     )
+    # files of the previous output format, from an earlier fit
+    for suffix in LEGACY_SUFFIXES.values():
+        legacy_file = sed_file.replace(".h5", suffix)
+        if os.path.exists(legacy_file):
+            os.remove(legacy_file)
 
     return prosp_results,sfh_results
@@ -0,0 +1,240 @@
+"""
+Micro-batched SBI++ inference for the host SED fitting tasks.
+
+SBI++ uses an amortized posterior, so one call can fit many transients for
+little more than the cost of one, and the slow SBI++ set-up is paid once per
+batch instead of once per celery task. When ``settings.SED_BATCH_INFERENCE``
+is set, the workflow scheduler leaves ready "Local host SED inference" and
+"Global host SED inference" tasks as "queued" instead of dispatching them
+(see :mod:`host.dag`). :func:`run_sed_batches` then collects the queued tasks
+into batches of up to ``settings.SED_BATCH_SIZE`` transients, waiting at most
+``settings.SED_BATCH_MAX_WAIT_SECONDS`` for a batch to fill, fits each batch
+with :func:`~host.SBI.run_sbi_blast.fit_sbi_pp_batch` and saves the results
+of every transient as the single-transient tasks would.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.utils import timezone
+
+from .dag import claim
+from .dag import dispatch_ready
+from .models import Status
+from .models import TaskRegister
+from .sps_pool import borrow_model_components
+from .transient_tasks import GlobalHostSEDFitting
+from .transient_tasks import LocalHostSEDFitting
+
+# task name to the runner of the task and the aperture type it fits
+BATCH_TASKS = {
+    "Local host SED inference": (LocalHostSEDFitting, "local"),
+    "Global host SED inference": (GlobalHostSEDFitting, "global"),
+}
+
+_stats = {"batches": 0, "transients": 0, "seconds": 0.0}
+_lock = threading.Lock()
+
+
+def queued_register_items(task_name):
+    """Queued register items of a task, oldest first."""
+    return TaskRegister.objects.filter(
+        task__name__exact=task_name, status__message__exact="queued"
+    ).order_by("last_modified")
+
+
+def batch_due(task_name, batch_size=None, max_wait_seconds=None):
+    """
+    Whether a batch of a task should be run now.
+
+    Parameters
+    ----------
+    :task_name : str
+        Name of the batched task.
+    :batch_size : int, optional
+        Defaults to ``settings.SED_BATCH_SIZE``.
+    :max_wait_seconds : float, optional
+        Defaults to ``settings.SED_BATCH_MAX_WAIT_SECONDS``.
+    Returns
+    -------
+    :due : bool
+        True if a full batch is queued, or if the oldest queued item has
+        waited for at least ``max_wait_seconds``.
+    """
+    batch_size = batch_size or settings.SED_BATCH_SIZE
+    if max_wait_seconds is None:
+        max_wait_seconds = settings.SED_BATCH_MAX_WAIT_SECONDS
+
+    queued = queued_register_items(task_name)
+    if queued.count() >= batch_size:
+        return True
+    oldest = queued.values_list("last_modified", flat=True).first()
+    if oldest is None:
+        return False
+    return (timezone.now() - oldest).total_seconds() >= max_wait_seconds
+
+
+def claim_batch(task_name, batch_size=None):
+    """
+    Move up to ``batch_size`` of the oldest queued items of a task to
+    processing.
+
+    Returns
+    -------
+    :register_items : list[:class:`~host.models.TaskRegister`]
+        The claimed items.
+    """
+    batch_size = batch_size or settings.SED_BATCH_SIZE
+    queued = Status.objects.get(message__exact="queued")
+    processing = Status.objects.get(message__exact="processing")
+
+    candidates = queued_register_items(task_name).values(
+        "pk", "transient_id", "task_id"
+    )[:batch_size]
+    claimed = [
+        register_item["pk"]
+        for register_item in candidates
+        if claim(register_item, queued, processing)
+    ]
+    return list(TaskRegister.objects.filter(pk__in=claimed).select_related("transient"))
+
+
+def _record(n_transients, seconds):
+    with _lock:
+        _stats["batches"] += 1
+        _stats["transients"] += n_transients
+        _stats["seconds"] += seconds
+
+
+def run_sed_batch(task_name, register_items):
+    """
+    Fit the transients of a batch together and fan the results back out to
+    their register items and SED fitting results.
+
+    Parameters
+    ----------
+    :task_name : str
+        Name of the batched task.
+    :register_items : list[:class:`~host.models.TaskRegister`]
+        Register items claimed with :func:`claim_batch`.
+    Returns
+    -------
+    :statuses : dict[str: str]
+        Transient name to the status message its task ended with.
+    """
+    # The "run_sbi_blast" module import is very slow, so only do it when
+    # actually necessary when a task requires it.
+    from host.SBI.run_sbi_blast import fit_sbi_pp_batch
+
+    runner_class, aperture_type = BATCH_TASKS[task_name]
+    start_time = time.monotonic()
+    statuses = {}
+    fits = []
+
+    try:
+        for register_item in register_items:
+            transient = register_item.transient
+            runner = runner_class(transient.name)
+            try:
+                aperture, observations, status_message = runner._sed_observations(
+                    transient, aperture_type
+                )
+            except Exception as err:
+                print(f"{task_name} failed for {transient.name}: {err}")
+                status_message = runner._failed_status_message()
+            if status_message is not None:
+                statuses[transient.name] = status_message
+            else:
+                fits.append((transient, runner, aperture, observations))
+
+        outputs = []
+        if len(fits):
+            outputs = fit_sbi_pp_batch(
+                [observations for _, _, _, observations in fits],
+                fit_type=aperture_type,
+            )
+
+        for (transient, runner, aperture, observations), (posterior, errflag) in zip(
+            fits, outputs
+        ):
+            if errflag:
+                statuses[transient.name] = "not enough filters"
+                continue
+            try:
+                with borrow_model_components(
+                    observations, label=aperture_type
+                ) as model_components:
+                    runner._save_sed_results(
+                        transient, aperture, posterior, model_components, observations
+                    )
+                statuses[transient.name] = "processed"
+            except Exception as err:
+                print(f"{task_name} failed for {transient.name}: {err}")
+                statuses[transient.name] = runner._failed_status_message()
+    finally:
+        seconds = time.monotonic() - start_time
+        status_objects = {status.message: status for status in Status.objects.all()}
+        for register_item in register_items:
+            # a batch that failed as a whole fails all of its transients
+            status_message = statuses.get(register_item.transient.name, "failed")
+            previous_status_id = register_item.status_id
+            register_item.status = status_objects[status_message]
+            register_item.last_modified = timezone.now()
+            register_item.last_processing_time_seconds = round(
+                seconds / len(register_items), 2
+            )
+            register_item.save(previous_status_id=previous_status_id)
+            dispatch_ready(register_item.transient.name)
+
+        _record(len(register_items), seconds)
+        print(
+            f"{task_name}: {len(register_items)} transients in {seconds:.1f} s "
+            f"({60 * len(register_items) / max(seconds, 1e-6):.1f} "
+            "transients per minute)"
+        )
+
+    return statuses
+
+
+def run_sed_batches(batch_size=None, max_wait_seconds=None):
+    """
+    Run every batch of SED inference that is due.
+
+    Parameters
+    ----------
+    :batch_size : int, optional
+        Defaults to ``settings.SED_BATCH_SIZE``.
+    :max_wait_seconds : float, optional
+        Defaults to ``settings.SED_BATCH_MAX_WAIT_SECONDS``.
+    Returns
+    -------
+    :n_transients : int
+        Number of transients fit.
+    """
+    n_transients = 0
+    for task_name in BATCH_TASKS:
+        while batch_due(task_name, batch_size, max_wait_seconds):
+            register_items = claim_batch(task_name, batch_size)
+            if not register_items:
+                break
+            run_sed_batch(task_name, register_items)
+            n_transients += len(register_items)
+    return n_transients
+
+
+def batch_stats():
+    """
+    Throughput of the batched SED inference in this process.
+
+    Returns
+    -------
+    :stats : dict
+        Number of ``batches`` and ``transients``, the ``seconds`` spent
+        fitting them and the throughput in ``transients_per_minute``.
+    """
+    with _lock:
+        stats = dict(_stats)
+    stats["transients_per_minute"] = (
+        60 * stats["transients"] / stats["seconds"] if stats["seconds"] else 0.0
+    )
+    return stats
@@ -0,0 +1,296 @@
+"""
+Self-describing output container of an SED fit.
+
+Each SED fit is written once to a single HDF5 file,
+``SED_OUTPUT_ROOT/<transient>/<transient>_<aperture type>.h5``, with the
+groups
+
+* ``posterior``: the posterior ``chain`` (and the sample ``weights`` for
+  nested sampling), with the ``theta_labels`` as an attribute,
+* ``percentiles``: the percentiles of the physical parameters, the star
+  formation history and the model photometry and spectra,
+* ``chains``: the sub-sampled chains of the physical parameters and SFHs,
+* ``model``: the best-fit model spectrum and photometry and their 68%
+  intervals,
+* ``obs``: the observed photometry that was fit.
+
+Arrays are stored as chunked, compressed datasets and nothing is pickled, so
+readers can open the file with plain h5py and load only the slices they need.
+:func:`convert_legacy_output` converts the outputs written before this format
+(a prospector ``.h5`` file next to ``_chain.npz``, ``_perc.npz`` and
+``_modeldata.npz`` files).
+"""
+import io
+import json
+import os
+
+import h5py
+import numpy as np
+from django.utils import timezone
+
+from .filter_curves import transmission_curve
+
+FORMAT_NAME = "blast-sed-output"
+FORMAT_VERSION = 1
+
+# suffixes of the files written before this format
+LEGACY_SUFFIXES = {
+    "chains": "_chain.npz",
+    "percentiles": "_perc.npz",
+    "model": "_modeldata.npz",
+}
+
+
+def sed_output_path(sed_output_root, transient_name, aperture_type):
+    """Path of the output container of a fit."""
+    return f"{sed_output_root}/{transient_name}/{transient_name}_{aperture_type}.h5"
+
+
+def _write_dataset(group, name, data):
+    data = np.asarray(data)
+    if data.dtype.kind == "U":
+        data = data.astype("S")
+    if data.ndim and data.size > 1:
+        group.create_dataset(
+            name,
+            data=data,
+            chunks=True,
+            compression="gzip",
+            compression_opts=4,
+            shuffle=True,
+        )
+    else:
+        group.create_dataset(name, data=data)
+
+
+def _write_group(output_file, name, arrays):
+    group = output_file.create_group(name)
+    for key, value in arrays.items():
+        _write_dataset(group, key, value)
+    return group
+
+
+def write_sed_output(
+    path,
+    chain,
+    theta_labels,
+    observations,
+    percentiles,
+    chains,
+    model_data,
+    weights=None,
+    percents=[15.9, 50, 84.1],
+    attrs={},
+):
+    """
+    Write the output container of an SED fit.
+
+    Parameters
+    ----------
+    :path : str
+        Path of the container, see :func:`sed_output_path`.
+    :chain : np.ndarray
+        Posterior samples, one row per sample.
+    :theta_labels : list[str]
+        Names of the columns of the chain.
+    :observations : dict
+        Observations from :func:`~host.prospector.build_obs`.
+    :percentiles : dict[str: np.ndarray]
+        Percentiles from :func:`~host.postprocess_prosp.postprocess`.
+    :chains : dict[str: np.ndarray]
+        Sub-sampled chains from :func:`~host.postprocess_prosp.postprocess`.
+    :model_data : dict[str: np.ndarray]
+        Best-fit model spectrum and photometry.
+    :weights : np.ndarray, optional
+        Weights of the samples, for nested sampling.
+    :percents : list[float]
+        The percentiles that were computed.
+    :attrs : dict, optional
+        Extra metadata, e.g. the transient name and aperture type.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # write to a temporary file first so readers never see a partial file
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with h5py.File(tmp_path, "w") as output_file:
+        output_file.attrs["format"] = FORMAT_NAME
+        output_file.attrs["version"] = FORMAT_VERSION
+        output_file.attrs["created"] = timezone.now().isoformat()
+        output_file.attrs["redshift"] = float(observations["redshift"])
+        for key, value in attrs.items():
+            output_file.attrs[key] = value
+
+        posterior = output_file.create_group("posterior")
+        posterior.attrs["theta_labels"] = json.dumps(list(theta_labels))
+        _write_dataset(posterior, "chain", chain)
+        if weights is not None:
+            _write_dataset(posterior, "weights", weights)
+
+        _write_group(output_file, "percentiles", percentiles).attrs[
+            "percents"
+        ] = percents
+        _write_group(output_file, "chains", chains)
+        _write_group(output_file, "model", model_data)
+
+        obs = {
+            key: [] if observations.get(key) is None else observations[key]
+            for key in ["filters", "maggies", "maggies_unc"]
+        }
+        _write_group(
+            output_file,
+            "obs",
+            {
+                "filternames": [f.name for f in obs["filters"]],
+                "wave_effective": [f.wave_effective for f in obs["filters"]],
+                "maggies": obs["maggies"],
+                "maggies_unc": obs["maggies_unc"],
+            },
+        ).attrs["redshift"] = float(observations["redshift"])
+    os.replace(tmp_path, path)
+
+
+def is_sed_output(path):
+    """Whether path is an output container, rather than a legacy output."""
+    if not path or not os.path.exists(path) or not h5py.is_hdf5(path):
+        return False
+    with h5py.File(path, "r") as output_file:
+        return output_file.attrs.get("format") == FORMAT_NAME
+
+
+class SEDOutput:
+    """
+    Read access to an output container. Datasets are only read from disk when
+    they are requested, so e.g. the plots never load the posterior chain.
+
+    Use as a context manager,
+
+    .. code:: python
+
+        with SEDOutput(path) as output:
+            spec = output.model_data(["rest_wavelength", "spec"])
+            first_samples = output.chain(slice(0, 100))
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = h5py.File(path, "r")
+        if self.file.attrs.get("format") != FORMAT_NAME:
+            self.file.close()
+            raise ValueError(f"{path} is not an SED output container")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.file.close()
+
+    @property
+    def redshift(self):
+        return float(self.file.attrs["redshift"])
+
+    @property
+    def theta_labels(self):
+        return json.loads(self.file["posterior"].attrs["theta_labels"])
+
+    def dataset(self, name):
+        """The h5py dataset, e.g. ``"chains/sfh"``, to read slices from."""
+        return self.file[name]
+
+    def chain(self, rows=slice(None)):
+        """Rows of the posterior chain."""
+        return self.file["posterior/chain"][rows]
+
+    def _group(self, name, keys=None):
+        group = self.file[name]
+        return {key: group[key][()] for key in (keys or group.keys())}
+
+    def percentiles(self, keys=None):
+        return self._group("percentiles", keys)
+
+    def chains(self, keys=None):
+        return self._group("chains", keys)
+
+    def model_data(self, keys=None):
+        return self._group("model", keys)
+
+    def obs(self):
+        obs = self._group("obs")
+        obs["filternames"] = obs["filternames"].astype(str)
+        obs["redshift"] = self.redshift
+        return obs
+
+    def to_npz(self, group):
+        """A group as the contents of an .npz file, which loads without pickle."""
+        buffer = io.BytesIO()
+        np.savez(buffer, **self._group(group))
+        return buffer.getvalue()
+
+
+def read_legacy_output(path):
+    """
+    Read an output written before this format.
+
+    Returns
+    -------
+    :contents : dict
+        Keyword arguments of :func:`write_sed_output`, apart from the path.
+    """
+    # only the legacy files need prospector's reader and pickle
+    import prospect.io.read_results as reader
+
+    res, obs, _ = reader.results_from(path, dangerous=False)
+    base = path[: -len(".h5")]
+    percentiles = np.load(base + LEGACY_SUFFIXES["percentiles"], allow_pickle=True)
+    chains = np.load(base + LEGACY_SUFFIXES["chains"], allow_pickle=True)
+    model_data = np.load(base + LEGACY_SUFFIXES["model"])
+
+    filters = obs.get("filters")
+    if filters is not None:
+        # prospector stores the names of filters that sedpy doesn't know
+        filters = [transmission_curve(f) if isinstance(f, str) else f for f in filters]
+
+    return {
+        "chain": res["chain"],
+        "theta_labels": res["theta_labels"],
+        "weights": res.get("weights"),
+        "observations": {
+            "redshift": obs["redshift"],
+            "filters": filters,
+            "maggies": obs.get("maggies"),
+            "maggies_unc": obs.get("maggies_unc"),
+        },
+        "percentiles": np.atleast_1d(percentiles["percentiles"])[0],
+        "chains": np.atleast_1d(chains["chains"])[0],
+        "model_data": {key: model_data[key] for key in model_data.files},
+    }
+
+
+def convert_legacy_output(path, attrs={}, remove=False):
+    """
+    Convert a legacy output to an output container at the same path.
+
+    Parameters
+    ----------
+    :path : str
+        Path of the legacy prospector ``.h5`` file.
+    :attrs : dict, optional
+        Extra metadata, e.g. the transient name and aperture type.
+    :remove : bool
+        Remove the legacy ``.npz`` files after converting.
+    Returns
+    -------
+    :converted : bool
+        False if path already is an output container.
+    """
+    if is_sed_output(path):
+        return False
+
+    write_sed_output(path, attrs=attrs, **read_legacy_output(path))
+    if remove:
+        for suffix in LEGACY_SUFFIXES.values():
+            legacy_path = path[: -len(".h5")] + suffix
+            if os.path.exists(legacy_path):
+                os.remove(legacy_path)
+    return True
@@ -0,0 +1,19 @@
+"""
+Signal receivers of the host models.
+"""
+from django.db.models.signals import pre_save
+from django.dispatch import receiver
+
+from .models import Aperture
+from .models import Host
+from .models import Transient
+
+
+@receiver(pre_save, sender=Aperture)
+@receiver(pre_save, sender=Host)
+@receiver(pre_save, sender=Transient)
+def set_healpix_index(sender, instance, raw=False, **kwargs):
+    # raw saves, e.g. loaddata, skip SkyObject.save, which sets the HEALPix
+    # pixel otherwise
+    if raw:
+        instance.update_healpix_index()
@@ -0,0 +1,108 @@
+"""
+HEALPix index of sky positions and cone searches over it.
+
+Every sky object stores the nested HEALPix pixel of its position at order
+HEALPIX_ORDER (pixels of about 0.2 arcsec) in an indexed column. In the
+nested scheme a pixel at a coarser order k covers the contiguous range of
+order HEALPIX_ORDER pixels ``[p * 4**(HEALPIX_ORDER - k), (p + 1) *
+4**(HEALPIX_ORDER - k))``, so a cone is searched by covering it with a few
+coarse pixels about the size of the cone, reading the objects in their index
+ranges and keeping those within the radius.
+"""
+import numpy as np
+from astropy import units as u
+from astropy.coordinates import angular_separation
+from astropy_healpix import HEALPix
+from django.db.models import Q
+
+HEALPIX_ORDER = 20
+
+
+def healpix_index(ra_deg, dec_deg, order=HEALPIX_ORDER):
+    """
+    Nested HEALPix pixel of sky positions.
+
+    Parameters:
+        ra_deg (float or np.ndarray): Right Ascension in decimal degrees.
+        dec_deg (float or np.ndarray): Declination in decimal degrees.
+        order (int): HEALPix order, the number of pixels is 12 * 4**order.
+    Returns:
+        index (int or np.ndarray): pixel index of each position.
+    """
+    healpix = HEALPix(nside=2**order, order="nested")
+    index = healpix.lonlat_to_healpix(
+        np.asarray(ra_deg, dtype=float) * u.deg,
+        np.asarray(dec_deg, dtype=float) * u.deg,
+    )
+    return int(index) if np.ndim(index) == 0 else index.astype(np.int64)
+
+
+def cone_search_order(radius_deg):
+    """Coarsest order whose pixels are still at least as large as the cone."""
+    # pixels at order k are about 58.6 / 2**k degrees across
+    order = np.floor(np.log2(np.degrees(np.sqrt(np.pi / 3)) / radius_deg))
+    return int(np.clip(order, 0, HEALPIX_ORDER))
+
+
+def cone_search_ranges(ra_deg, dec_deg, radius_deg):
+    """
+    Ranges of HEALPIX_ORDER pixel indices that cover a cone.
+
+    Parameters:
+        ra_deg (float): Right Ascension of the center in decimal degrees.
+        dec_deg (float): Declination of the center in decimal degrees.
+        radius_deg (float): radius of the cone in degrees.
+    Returns:
+        ranges (list[tuple[int, int]]): first and last pixel index of each
+            range, merged where they touch.
+    """
+    order = cone_search_order(radius_deg)
+    healpix = HEALPix(nside=2**order, order="nested")
+    pixels = np.sort(
+        healpix.cone_search_lonlat(ra_deg * u.deg, dec_deg * u.deg, radius_deg * u.deg)
+    )
+    shift = 2 * (HEALPIX_ORDER - order)
+
+    ranges = []
+    for pixel in pixels.tolist():
+        first, last = pixel << shift, ((pixel + 1) << shift) - 1
+        if ranges and ranges[-1][1] + 1 == first:
+            ranges[-1] = (ranges[-1][0], last)
+        else:
+            ranges.append((first, last))
+    return ranges
+
+
+def cone_search(queryset, ra_deg, dec_deg, radius_deg):
+    """
+    Objects of a queryset within a cone, reading only the candidates in the
+    pixels that cover it.
+
+    Parameters:
+        queryset (QuerySet): sky objects to search, e.g. Transient.objects.all().
+        ra_deg (float): Right Ascension of the center in decimal degrees.
+        dec_deg (float): Declination of the center in decimal degrees.
+        radius_deg (float): radius of the cone in degrees.
+    Returns:
+        matches (list[tuple]): each object within the cone and its separation
+            from the center in degrees, closest first.
+    """
+    in_pixels = Q()
+    for first, last in cone_search_ranges(ra_deg, dec_deg, radius_deg):
+        in_pixels |= Q(healpix_index__range=(first, last))
+    candidates = list(queryset.filter(in_pixels))
+    if not candidates:
+        return []
+
+    separations = angular_separation(
+        np.array([candidate.ra_deg for candidate in candidates], dtype=float) * u.deg,
+        np.array([candidate.dec_deg for candidate in candidates], dtype=float) * u.deg,
+        ra_deg * u.deg,
+        dec_deg * u.deg,
+    ).to_value(u.deg)
+    order = np.argsort(separations)
+    return [
+        (candidates[i], float(separations[i]))
+        for i in order
+        if separations[i] <= radius_deg
+    ]
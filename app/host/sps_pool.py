@@ -0,0 +1,145 @@
+"""
+Process-resident pool of pre-initialised SPS objects and model templates.
+
+Building a :class:`~prospect.sources.FastStepBasis` initialises FSPS, which
+is expensive, and the prospector model does not depend on the transient
+apart from its redshift. SED fitting tasks therefore borrow model
+components from a pool kept by each worker process, reset the per-object
+parameters and give them back afterwards, keeping up to ``SPS_POOL_SIZE``
+sets. If the pool is empty (the first fit of the process, or all entries in
+use) the components are built from scratch and join the pool when the fit
+is done.
+
+The pool is filled lazily rather than when the worker process starts:
+celery kills a child process whose worker_process_init handlers run longer
+than worker_proc_alive_timeout (4 seconds by default), and loading FSPS
+takes longer than that. It also keeps processes that only serve other
+queues from loading FSPS at all.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+from queue import Empty
+from queue import LifoQueue
+
+import numpy as np
+
+from .prospector import build_model
+from .prospector import zred_to_agebins
+
+SPS_POOL_SIZE = int(os.environ.get("SPS_POOL_SIZE", "1"))
+
+_pool = LifoQueue()
+_timings = {}
+_lock = threading.Lock()
+
+
+def warm_up(size=SPS_POOL_SIZE):
+    """
+    Fill the pool with pre-initialised model components.
+
+    Parameters
+    ----------
+    :size : int
+        Number of entries the pool should hold.
+    Returns
+    -------
+    :seconds : float
+        Time spent building the new entries.
+    """
+    start_time = time.monotonic()
+    while _pool.qsize() < size:
+        _pool.put(build_model(None))
+    return time.monotonic() - start_time
+
+
+def reset_model_components(model_components, redshift):
+    """
+    Reset the model parameters to their initial values for a new transient.
+    Only the per-object parameters, the redshift and the age bins that depend
+    on it, differ between fits.
+
+    Parameters
+    ----------
+    :model_components : dict
+        Components returned by :func:`~host.prospector.build_model`.
+    :redshift : float
+        Redshift of the transient.
+    """
+    model = model_components["model"]
+    model.configure()
+    model.params["zred"] = np.atleast_1d(redshift)
+    model.params["agebins"] = zred_to_agebins(zred=np.atleast_1d(redshift))
+
+
+def _record(label, warm, seconds):
+    with _lock:
+        label_timings = _timings.setdefault(label, {"warm": [], "cold": []})
+        label_timings["warm" if warm else "cold"].append(seconds)
+
+
+@contextmanager
+def borrow_model_components(observations, label="sed"):
+    """
+    Borrow model components from the pool for the duration of a fit.
+
+    Parameters
+    ----------
+    :observations : dict
+        Observations from :func:`~host.prospector.build_obs`.
+    :label : str
+        Name under which the set-up time is recorded, e.g. the aperture type.
+    Yields
+    ------
+    :model_components : dict
+        Model components reset for the redshift of the observations.
+    """
+    start_time = time.monotonic()
+    try:
+        model_components = _pool.get_nowait()
+        warm = True
+    except Empty:
+        model_components = build_model(observations)
+        warm = False
+    reset_model_components(model_components, observations["redshift"])
+    seconds = time.monotonic() - start_time
+    _record(label, warm, seconds)
+    print(
+        f"{label} SED model set-up: {'warm' if warm else 'cold'} start "
+        f"took {seconds:.2f} seconds"
+    )
+
+    try:
+        yield model_components
+    finally:
+        if _pool.qsize() < SPS_POOL_SIZE:
+            _pool.put(model_components)
+
+
+def pool_stats():
+    """
+    Model set-up timings recorded in this process.
+
+    Returns
+    -------
+    :stats : dict[str: dict]
+        Keyed by label. Each entry has the number of ``warm`` and ``cold``
+        starts and their mean set-up time in seconds.
+    """
+    with _lock:
+        timings = {
+            label: {start: list(seconds) for start, seconds in label_timings.items()}
+            for label, label_timings in _timings.items()
+        }
+
+    stats = {}
+    for label, label_timings in timings.items():
+        stats[label] = {"pool_size": _pool.qsize()}
+        for start in ("warm", "cold"):
+            seconds = label_timings[start]
+            stats[label][f"{start}_starts"] = len(seconds)
+            stats[label][f"{start}_mean_seconds"] = (
+                float(np.mean(seconds)) if seconds else None
+            )
+    return stats
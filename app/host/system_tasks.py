@@ -5,7 +5,6 @@ import shutil
 from celery import shared_task
 from dateutil import parser
 from django.conf import settings
-from django.db.models import Q
 from django.utils import timezone
 from host.base_tasks import initialise_all_tasks_status
 from host.base_tasks import SystemTaskRunner
@@ -17,6 +16,8 @@ from .models import Status
 from .models import TaskRegister
 from .models import TaskRegisterSnapshot
 from .models import Transient
+from .sed_batch import batch_stats
+from .sed_batch import run_sed_batches
 from .transient_name_server import get_daily_tns_staging_csv
 from .transient_name_server import get_tns_credentials
 from .transient_name_server import get_transients_from_tns
@@ -58,6 +59,7 @@ class TNSDataIngestion(SystemTaskRunner):
                         t.save()
 
                 # update info
+                transient.update_healpix_index()
                 new_transient_dict = transient.__dict__
                 if "host_id" in new_transient_dict.keys():
                     if saved_transient.host_id is not None:
@@ -215,48 +217,21 @@ class SnapshotTaskRegister(SystemTaskRunner):
 class LogTransientProgress(SystemTaskRunner):
     def run_process(self):
         """
-        Updates the processing status for all transients.
+        Updates the processing status task of all transients from the
+        processing status kept up to date by their task counts.
         """
-        transients = Transient.objects.all()
-
-        for transient in transients:
-            tasks = TaskRegister.objects.filter(
-                Q(transient__name__exact=transient.name) & ~Q(
-                    task__name=self.task_name)
-            )
-            processing_task_qs = TaskRegister.objects.filter(
-                transient__name__exact=transient.name, task__name=self.task_name
-            )
-
-            total_tasks = len(tasks)
-            completed_tasks = len(
-                [task for task in tasks if task.status.message == "processed"]
+        for processing_status, message in (
+            ("processing", "processing"),
+            ("blocked", "blocked"),
+            ("completed", "processed"),
+        ):
+            TaskRegister.objects.filter(
+                task__name=self.task_name,
+                transient__processing_status=processing_status,
+            ).exclude(status__message=message).update(
+                status=Status.objects.get(message=message),
+                last_modified=timezone.now(),
             )
-            blocked = len(
-                [task for task in tasks if task.status.type == "error"])
-
-            progress = "processing"
-
-            if total_tasks == 0:
-                progress = "processing"
-            elif total_tasks == completed_tasks:
-                progress = "completed"
-            elif total_tasks < completed_tasks:
-                progress = "processing"
-            elif blocked > 0:
-                progress = "blocked"
-
-            # save task
-            if len(processing_task_qs) == 1:
-                processing_task = processing_task_qs[0]
-                processing_task.status = Status.objects.get(
-                    message=progress if progress != "completed" else "processed"
-                )
-                processing_task.save()
-
-            # save transient progress
-            transient.processing_status = progress
-            transient.save()
 
     @property
     def task_name(self):
@@ -267,6 +242,34 @@ class LogTransientProgress(SystemTaskRunner):
         return False
 
 
+class BatchHostSEDInference(SystemTaskRunner):
+    def run_process(self):
+        """
+        Runs the queued host SED inference tasks in micro-batches.
+        """
+        n_transients = run_sed_batches()
+        if n_transients:
+            stats = batch_stats()
+            print(
+                f"Batch SED inference: {stats['transients']} transients in "
+                f"{stats['batches']} batches, "
+                f"{stats['transients_per_minute']:.1f} transients per minute"
+            )
+
+    @property
+    def task_name(self):
+        return "Batch host SED inference"
+
+    @property
+    def task_frequency_seconds(self):
+        # check twice per maximum wait, so no batch waits much longer
+        return max(settings.SED_BATCH_MAX_WAIT_SECONDS // 2, 1)
+
+    @property
+    def task_initially_enabled(self):
+        return settings.SED_BATCH_INFERENCE
+
+
 # Periodic tasks
 
 @shared_task(
@@ -315,3 +318,11 @@ def delete_ghost_files():
 )
 def ingest_missed_tns_transients():
     IngestMissedTNSTransients().run_process()
+
+
+@shared_task(
+    time_limit=task_time_limit,
+    soft_time_limit=task_soft_time_limit,
+)
+def batch_host_sed_inference():
+    BatchHostSEDInference().run_process()
@@ -4,8 +4,9 @@ from __future__ import unicode_literals
 from celery import shared_task
 from host.base_tasks import task_soft_time_limit
 from host.base_tasks import task_time_limit
-from host.workflow import transient_workflow
+from host.workflow import queue_transient_workflows
 from .models import Transient
+from host.system_tasks import BatchHostSEDInference
 from host.system_tasks import DeleteGHOSTFiles
 from host.system_tasks import IngestMissedTNSTransients
 from host.system_tasks import InitializeTransientTasks
@@ -22,6 +23,7 @@ periodic_tasks = [
     LogTransientProgress(),
     DeleteGHOSTFiles(),
     IngestMissedTNSTransients(),
+    BatchHostSEDInference(),
 ]
 
 
@@ -31,31 +33,33 @@ periodic_tasks = [
     soft_time_limit=task_soft_time_limit,
 )
 def import_transient_list(transient_names, retrigger=False):
-    def process_transient(transient_name):
-        transient_workflow.delay(transient_name)
-    existing_transients = []
-    new_transient_names = []
-    for transient_name in transient_names:
-        transient = Transient.objects.filter(name__exact=transient_name)
-        print(f'Querying transient "{transient_name}"...')
-        if transient:
-            print(f'Transient already saved: "{transient_name}"')
-            existing_transients.append(transient[0])
-        else:
-            print(f'New transient detected: "{transient_name}"')
-            new_transient_names.append(transient_name)
+    # look up all the names with one query, keeping the order they were given in
+    transient_names = list(dict.fromkeys(transient_names))
+    existing_transient_names = set(
+        Transient.objects.filter(name__in=transient_names).values_list(
+            "name", flat=True
+        )
+    )
+    new_transient_names = [
+        transient_name
+        for transient_name in transient_names
+        if transient_name not in existing_transient_names
+    ]
+    print(
+        f"{len(new_transient_names)} new transients, "
+        f"{len(existing_transient_names)} already saved"
+    )
+    queued_transient_names = list(new_transient_names)
     # Re-trigger workflows for existing transients
-    for transient in existing_transients:
-        if retrigger:
-            print(f'Retriggering workflow for transient "{transient.name}"')
-            process_transient(transient.name)
-        else:
-            print(f'Skipping existing transient "{transient.name}"')
-    # Process new transients
-    uploaded_transient_names = []
-    if new_transient_names:
-        for transient_name in new_transient_names:
-            print(f'Triggering workflow for new transient "{transient_name}"...')
-            process_transient(transient_name)
-            uploaded_transient_names += [transient_name]
-    return uploaded_transient_names
+    if retrigger:
+        print(f"Retriggering workflows of {len(existing_transient_names)} transients")
+        queued_transient_names += [
+            transient_name
+            for transient_name in transient_names
+            if transient_name in existing_transient_names
+        ]
+    elif existing_transient_names:
+        print(f"Skipping existing transients: {sorted(existing_transient_names)}")
+    # New transients are downloaded from TNS by their workflows
+    queue_transient_workflows(queued_transient_names)
+    return new_transient_names
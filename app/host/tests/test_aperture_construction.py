@@ -1,14 +1,29 @@
+import os
+import tempfile
+
 import numpy as np
 from astropy.io import fits
+from django.test import override_settings
 from django.test import TestCase
 
+from .. import host_utils
+from ..host_utils import background_sidecar_path
 from ..host_utils import build_source_catalog
+from ..host_utils import cached_source_catalog
 from ..host_utils import estimate_background
+from ..host_utils import file_hash
+from ..host_utils import remove_cutout_sidecars
+from ..host_utils import segmentation_sidecar_path
 from ..models import Transient
 from ..transient_tasks import GlobalApertureConstruction
 
 
 class TestApertureConstruction(TestCase):
+    def setUp(self):
+        # keep the cached backgrounds out of the fixture cutout directories
+        sidecar_root = tempfile.TemporaryDirectory()
+        self.addCleanup(sidecar_root.cleanup)
+        self.enterContext(override_settings(CUTOUT_SIDECAR_ROOT=sidecar_root.name))
 
     def test_aperture_construction(self):
         transient = Transient.objects.get(name="2010H")
@@ -28,3 +43,86 @@ class TestApertureConstruction(TestCase):
         catalog = build_source_catalog(hdulist, background)
 
         assert catalog is None
+
+    def test_background_cache(self):
+        rng = np.random.default_rng(0)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "image.fits")
+            fits.writeto(path, rng.normal(10.0, 1.0, size=(200, 200)))
+
+            with fits.open(path) as image:
+                background = estimate_background(image)
+            assert os.path.exists(background_sidecar_path(path, "sextractor"))
+
+            with fits.open(path) as image:
+                cached_background = estimate_background(image)
+            assert np.array_equal(background.background, cached_background.background)
+
+            # a new download must not reuse the old estimate
+            fits.writeto(path, rng.normal(20.0, 1.0, size=(200, 200)), overwrite=True)
+            with fits.open(path) as image:
+                new_background = estimate_background(image)
+            assert np.median(new_background.background) > 15
+
+    def test_failed_sidecar_write(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            sidecar_path = os.path.join(tmp_dir, "image.sextractor.bkg.npz")
+            # a directory in the way makes the final rename fail
+            os.mkdir(sidecar_path)
+            host_utils._save_sidecar(sidecar_path, background=np.zeros(3))
+            assert os.listdir(tmp_dir) == ["image.sextractor.bkg.npz"]
+
+    def write_image_with_sources(self, path, centers, shape=(200, 200)):
+        rng = np.random.default_rng(len(centers))
+        y, x = np.mgrid[: shape[0], : shape[1]]
+        data = rng.normal(10.0, 1.0, size=shape)
+        for x_center, y_center in centers:
+            data += 50.0 * np.exp(
+                -((x - x_center) ** 2 + (y - y_center) ** 2) / (2 * 3.0**2)
+            )
+        fits.writeto(path, data, overwrite=True)
+
+    def assert_catalogs_equal(self, catalog, expected):
+        assert np.array_equal(catalog.labels, expected.labels)
+        assert np.array_equal(catalog.area, expected.area)
+        assert np.allclose(catalog.xcentroid, expected.xcentroid)
+        assert np.allclose(catalog.ycentroid, expected.ycentroid)
+        assert np.allclose(catalog.segment_flux, expected.segment_flux)
+
+    def test_source_catalog_cache(self):
+        host_utils._source_catalog_memo.clear()
+        self.addCleanup(host_utils._source_catalog_memo.clear)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "image.fits")
+            sidecar_path = segmentation_sidecar_path(path, 3.0, 10)
+            self.write_image_with_sources(path, [(50, 50), (150, 120)])
+
+            with fits.open(path) as image:
+                catalog = cached_source_catalog(image)
+                fresh_catalog = build_source_catalog(image, estimate_background(image))
+            assert os.path.exists(sidecar_path)
+            assert len(catalog) == 2
+            self.assert_catalogs_equal(catalog, fresh_catalog)
+
+            # a new process has an empty memo and reads the sidecar
+            host_utils._source_catalog_memo.clear()
+            with fits.open(path) as image:
+                self.assert_catalogs_equal(cached_source_catalog(image), fresh_catalog)
+
+            # a new download with a different size and modification time
+            # must not reuse the old segmentation map
+            self.write_image_with_sources(
+                path, [(40, 60), (100, 100), (180, 30)], shape=(210, 210)
+            )
+            with fits.open(path) as image:
+                new_catalog = cached_source_catalog(image)
+                fresh_catalog = build_source_catalog(image, estimate_background(image))
+            assert len(new_catalog) == 3
+            self.assert_catalogs_equal(new_catalog, fresh_catalog)
+            with np.load(sidecar_path) as sidecar:
+                assert str(sidecar["fits_hash"]) == file_hash(path)
+
+            remove_cutout_sidecars(path)
+            assert not os.path.exists(sidecar_path)
+            assert not os.path.exists(background_sidecar_path(path, "sextractor"))
+            assert os.path.exists(path)
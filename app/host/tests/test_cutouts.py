@@ -1,11 +1,23 @@
+import contextlib
+import io
 import os
+import tempfile
+import threading
+import time
+from unittest import mock
 
 from astropy.coordinates import SkyCoord
 from astropy.io import fits
 from django.test import TestCase
 from django.test import tag
 
+from .. import cutouts
+from .. import frame_cache
 from ..cutouts import cutout
+from ..cutouts import download_cutouts_concurrently
+from ..frame_cache import fetch_frame
+from ..frame_cache import frame_cache_path
+from ..frame_cache import frame_cache_stats
 from ..models import Filter
 
 sn = ["2010ag", "2010ai", "2010y", "2010H", ""]
@@ -36,3 +48,140 @@ class CutoutDownloadTest(TestCase):
                 fits.writeto(path_to_fits, cutout_data[0].data, overwrite=True)
 
         self.assertTrue(1 == 1)
+
+
+class ConcurrentCutoutDownloadTest(TestCase):
+    def setUp(self):
+        self.position = SkyCoord(ra=355.53628555, dec=48.70907059166666, unit="deg")
+        self.filters = list(Filter.objects.select_related("survey"))
+        self.lock = threading.Lock()
+        self.in_flight = {}
+        self.max_in_flight = {}
+
+    def fake_cutout(self, position, filter, fov, clear_cache):
+        survey_name = filter.survey.name
+        with self.lock:
+            self.in_flight[survey_name] = self.in_flight.get(survey_name, 0) + 1
+            self.max_in_flight[survey_name] = max(
+                self.max_in_flight.get(survey_name, 0), self.in_flight[survey_name]
+            )
+        try:
+            time.sleep(0.05)
+            if survey_name == "WISE":
+                raise ConnectionError("WISE is down")
+            return f"{filter.name} image", 0, None
+        finally:
+            with self.lock:
+                self.in_flight[survey_name] -= 1
+
+    def test_per_survey_limit(self):
+        output = io.StringIO()
+        with mock.patch.object(
+            cutouts, "cutout", side_effect=self.fake_cutout
+        ), contextlib.redirect_stdout(output):
+            downloads = download_cutouts_concurrently(
+                self.position, self.filters, max_workers=8, max_per_survey=2
+            )
+
+        # surveys have up to five filters and eight workers are available, but
+        # no more than two downloads ran against any survey at once
+        self.assertTrue(max(self.max_in_flight.values()) == 2)
+
+        self.assertTrue(set(downloads) == {filter.name for filter in self.filters})
+        for filter in self.filters:
+            fits_image, status, err = downloads[filter.name]
+            if filter.survey.name == "WISE":
+                self.assertTrue(fits_image is None and status == 1)
+                self.assertIsInstance(err, ConnectionError)
+            else:
+                self.assertTrue(fits_image == f"{filter.name} image" and status == 0)
+
+        # the wall time of every survey is reported, failed downloads included
+        for survey_name in {filter.survey.name for filter in self.filters}:
+            n_filters = sum(
+                filter.survey.name == survey_name for filter in self.filters
+            )
+            self.assertRegex(
+                output.getvalue(),
+                rf"{survey_name}: downloaded {n_filters} cutouts in \d+\.\d\d seconds",
+            )
+
+
+class FrameCacheTest(TestCase):
+    def setUp(self):
+        cache_root = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_root.cleanup)
+        self.cache_root = cache_root.name
+        self.downloads = []
+        patcher = mock.patch.object(frame_cache, "http_get", side_effect=self.http_get)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def http_get(self, url):
+        self.downloads.append(url)
+        return mock.Mock(content=b"\0" * 1000)
+
+    def fetch(self, url, max_bytes=10000):
+        return fetch_frame(url, cache_root=self.cache_root, max_bytes=max_bytes)
+
+    def files(self, suffix):
+        return [
+            filename
+            for _, _, filenames in os.walk(self.cache_root)
+            for filename in filenames
+            if filename.endswith(suffix)
+        ]
+
+    def test_hit_and_miss(self):
+        stats = frame_cache_stats()
+        path = self.fetch("https://frames/a.fits")
+        self.assertTrue(
+            path == frame_cache_path("https://frames/a.fits", self.cache_root)
+        )
+        self.assertTrue(os.path.getsize(path) == 1000)
+        self.assertTrue(self.fetch("https://frames/a.fits") == path)
+
+        self.assertTrue(self.downloads == ["https://frames/a.fits"])
+        new_stats = frame_cache_stats()
+        self.assertTrue(new_stats["misses"] - stats["misses"] == 1)
+        self.assertTrue(new_stats["hits"] - stats["hits"] == 1)
+
+    def test_least_recently_used_eviction(self):
+        path_a = self.fetch("https://frames/a.fits", max_bytes=2500)
+        path_b = self.fetch("https://frames/b.fits", max_bytes=2500)
+        os.utime(path_a, (1000, 1000))
+        os.utime(path_b, (2000, 2000))
+        # a hit makes a the most recently used frame
+        self.fetch("https://frames/a.fits", max_bytes=2500)
+
+        path_c = self.fetch("https://frames/c.fits", max_bytes=2500)
+        self.assertTrue(os.path.exists(path_a) and os.path.exists(path_c))
+        self.assertFalse(os.path.exists(path_b))
+
+    def test_scan_only_over_budget(self):
+        with mock.patch.object(frame_cache.os, "walk", wraps=os.walk) as walk:
+            # the first download counts the existing cache
+            self.fetch("https://frames/a.fits", max_bytes=2500)
+            self.assertTrue(walk.call_count == 1)
+            self.fetch("https://frames/b.fits", max_bytes=2500)
+            self.assertTrue(walk.call_count == 1)
+            self.fetch("https://frames/c.fits", max_bytes=2500)
+            self.assertTrue(walk.call_count == 2)
+        self.assertTrue(len(self.files(".fits")) == 2)
+
+    def test_temporary_files_removed(self):
+        with mock.patch.object(frame_cache.os, "replace", side_effect=OSError):
+            with self.assertRaises(OSError):
+                self.fetch("https://frames/a.fits")
+        self.assertTrue(self.files(".tmp") == [])
+
+        # temporary files of a worker killed during a download are removed
+        # by the next scan
+        os.makedirs(os.path.join(self.cache_root, "ab"))
+        stale_path = os.path.join(self.cache_root, "ab", "stale.tmp")
+        with open(stale_path, "wb") as stale_file:
+            stale_file.write(b"\0")
+        old = time.time() - 2 * frame_cache.STALE_TMP_SECONDS
+        os.utime(stale_path, (old, old))
+        self.fetch("https://frames/b.fits")
+        self.assertFalse(os.path.exists(stale_path))
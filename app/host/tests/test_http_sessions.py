@@ -0,0 +1,87 @@
+import threading
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from types import SimpleNamespace
+from unittest import mock
+
+import requests
+from django.test import TestCase
+
+from .. import http_sessions
+from ..http_sessions import get_session
+from ..http_sessions import http_get
+from ..http_sessions import reset_session_stats
+from ..http_sessions import session_stats
+from ..http_sessions import use_shared_session
+
+
+class SurveyHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.requests.append((self.path, dict(self.headers)))
+        n_requests = sum(path == self.path for path, _ in self.server.requests)
+        # the flaky endpoint is unavailable the first time it is asked
+        status = 503 if self.path == "/flaky" and n_requests == 1 else 200
+        body = b"frame"
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class HTTPSessionsTest(TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), SurveyHandler)
+        self.server.requests = []
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        self.host = f"127.0.0.1:{self.server.server_port}"
+        patcher = mock.patch.object(http_sessions, "HTTP_BACKOFF_FACTOR", 0.0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        reset_session_stats()
+        self.addCleanup(reset_session_stats)
+
+    def test_requests_counted(self):
+        for _ in range(3):
+            response = http_get(f"{self.url}/frame")
+            self.assertTrue(response.status_code == 200)
+
+        stats = session_stats()[self.host]
+        self.assertTrue(stats["requests"] == 3)
+        self.assertTrue(stats["bytes"] == 3 * len(b"frame"))
+        self.assertTrue(sum(stats["latency_histogram"]) == 3)
+        # keep-alive connections are reused
+        self.assertTrue(stats["connections"] == 1)
+
+    def test_retry_policy(self):
+        adapter = get_session(self.url).get_adapter(self.url)
+        self.assertTrue(adapter.max_retries.total == http_sessions.HTTP_MAX_RETRIES)
+        self.assertIn(503, adapter.max_retries.status_forcelist)
+
+        response = http_get(f"{self.url}/flaky")
+        self.assertTrue(response.status_code == 200)
+        # the adapter sends one request, which is retried after the 503
+        self.assertTrue([path for path, _ in self.server.requests] == ["/flaky"] * 2)
+        self.assertTrue(session_stats()[self.host]["requests"] == 1)
+
+    def test_shared_session_keeps_headers(self):
+        own_session = requests.Session()
+        own_session.headers["User-Agent"] = "astroquery/0.4.7"
+        query_class = SimpleNamespace(_session=own_session)
+
+        use_shared_session(query_class, self.url)
+        self.assertIs(query_class._session, get_session(self.url))
+        query_class._session.get(f"{self.url}/query")
+
+        _, headers = self.server.requests[-1]
+        self.assertTrue(headers["User-Agent"] == "astroquery/0.4.7")
+        self.assertTrue(session_stats()[self.host]["requests"] == 1)
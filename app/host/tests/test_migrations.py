@@ -0,0 +1,33 @@
+from django.core.management import call_command
+from django.test import TestCase
+
+from ..models import SciencePayloadVersion
+from ..models import Transient
+
+
+class MigrationsTest(TestCase):
+    """
+    The test database is built by running the migrations, which load the
+    example transients from the fixtures.
+    """
+
+    def test_example_transients_loaded(self):
+        transients = Transient.objects.filter(name__in=["2010H", "2010ai", "2010ag"])
+        self.assertTrue(transients.count() == 3)
+        for transient in transients:
+            self.assertTrue(
+                SciencePayloadVersion.objects.filter(transient=transient).exists()
+            )
+
+    def test_loaddata_skips_payload_versions(self):
+        versions = dict(
+            SciencePayloadVersion.objects.values_list("transient_id", "version")
+        )
+        call_command(
+            "loaddata", "../fixtures/test/setup_test_transient.yaml", verbosity=0
+        )
+        self.assertTrue(
+            dict(SciencePayloadVersion.objects.values_list("transient_id", "version"))
+            == versions
+        )
+        self.assertTrue(Transient.objects.filter(name="2022testone").exists())
@@ -1,6 +1,22 @@
-from django.test import TestCase
+import tempfile
 
+import numpy as np
+from django.db import connection
+from django.db.models import Q
+from django.test import override_settings
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from photutils.aperture import aperture_photometry
+from photutils.aperture import EllipticalAperture
+
+from ..host_utils import aperture_sum
+from ..host_utils import do_aperture_photometry
+from ..host_utils import do_aperture_photometry_batch
+from ..host_utils import open_image
+from ..models import Aperture
 from ..models import AperturePhotometry
+from ..models import Cutout
+from ..models import Filter
 from ..models import Transient
 from ..transient_tasks import GlobalAperturePhotometry
 from ..transient_tasks import LocalAperturePhotometry
@@ -13,6 +29,12 @@ class TestValidatePhotometry(TestCase):
         "../fixtures/test/test_2010H_onefilter.yaml",
     ]
 
+    def setUp(self):
+        # keep the cached backgrounds out of the fixture cutout directories
+        sidecar_root = tempfile.TemporaryDirectory()
+        self.addCleanup(sidecar_root.cleanup)
+        self.enterContext(override_settings(CUTOUT_SIDECAR_ROOT=sidecar_root.name))
+
     def test_validate_local_photometry(self):
         transient = Transient.objects.get(name="2010H")
         vlp_cls = ValidateLocalPhotometry(transient_name=transient.name)
@@ -63,3 +85,98 @@ class TestValidatePhotometry(TestCase):
         status_message = apphot_cls._run_process(transient)
 
         assert status_message == "failed"
+
+    def write_photometry(self, transient, aperture, filters):
+        apphot_cls = GlobalAperturePhotometry(transient_name=transient.name)
+        photometry_data = [
+            {"aperture": aperture, "transient": transient, "filter": f, "flux": 1.0}
+            for f in filters
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            apphot_cls._bulk_overwrite_or_create_objects(
+                AperturePhotometry, ["aperture", "transient", "filter"], photometry_data
+            )
+        return len(queries)
+
+    def test_bulk_photometry_query_count(self):
+        transient = Transient.objects.get(name="2010H")
+        aperture = Aperture.objects.get(name="2010H_PanSTARRS_g_global")
+        filters = list(Filter.objects.all())
+        assert len(filters) >= 12
+
+        query_counts = []
+        for n_filters in [2, 6, 12]:
+            self.write_photometry(transient, aperture, filters[:n_filters])
+            # rewriting replaces every row, deleting them first
+            query_counts.append(
+                self.write_photometry(transient, aperture, filters[:n_filters])
+            )
+            assert (
+                AperturePhotometry.objects.filter(
+                    transient=transient, aperture=aperture
+                ).count()
+                == n_filters
+            )
+
+        assert len(set(query_counts)) == 1, query_counts
+
+    def test_validate_photometry_query_count(self):
+        transient = Transient.objects.get(name="2010H")
+        aperture = Aperture.objects.get(name="2010H_local")
+        filters = list(Filter.objects.all())
+        vlp_cls = ValidateLocalPhotometry(transient_name=transient.name)
+
+        query_counts = []
+        for n_filters in [2, 6, 12]:
+            self.write_photometry(transient, aperture, filters[:n_filters])
+            transient = Transient.objects.get(name="2010H")
+            with CaptureQueriesContext(connection) as queries:
+                vlp_cls._run_process(transient)
+            query_counts.append(len(queries))
+
+        assert len(set(query_counts)) == 1, query_counts
+
+
+class TestBatchPhotometry(TestCase):
+    def setUp(self):
+        # keep the cached backgrounds out of the fixture cutout directories
+        sidecar_root = tempfile.TemporaryDirectory()
+        self.addCleanup(sidecar_root.cleanup)
+        self.enterContext(override_settings(CUTOUT_SIDECAR_ROOT=sidecar_root.name))
+
+    def test_aperture_sum(self):
+        rng = np.random.default_rng(1)
+        data = rng.normal(10.0, 2.0, size=(60, 80))
+        data[30, 40] = np.nan
+        error = rng.uniform(0.5, 1.5, size=data.shape)
+        aperture = EllipticalAperture((40.3, 29.7), 12.5, 7.2, theta=0.4)
+
+        phot_table = aperture_photometry(data, aperture, error=error)
+        bbox_slices = aperture.bbox.slices
+        flux, flux_error = aperture_sum(
+            aperture.to_mask(method="exact").data,
+            data[bbox_slices],
+            error[bbox_slices],
+        )
+        assert np.isclose(flux, phot_table["aperture_sum"].value[0], rtol=1e-10)
+        assert np.isclose(
+            flux_error, phot_table["aperture_sum_err"].value[0], rtol=1e-10
+        )
+
+    def test_batch_matches_per_filter(self):
+        transient = Transient.objects.get(name="2010H")
+        cutouts = Cutout.objects.filter(transient=transient).filter(~Q(fits=""))
+        cutouts = list(cutouts.select_related("filter"))
+        sky_aperture = Aperture.objects.filter(transient=transient)[0].sky_aperture
+        assert len(cutouts) > 1
+
+        batch_photometry = do_aperture_photometry_batch(cutouts, sky_aperture)
+        for cutout in cutouts:
+            with open_image(cutout.fits.name) as image:
+                photometry = do_aperture_photometry(image, sky_aperture, cutout.filter)
+            for key, value in photometry.items():
+                batch_value = batch_photometry[cutout.name][key]
+                if value is None:
+                    assert batch_value is None
+                else:
+                    assert np.isclose(batch_value, value, rtol=1e-6, atol=0.0)
@@ -0,0 +1,133 @@
+import numpy as np
+from django.test import TestCase
+from prospect.models.transforms import logsfr_ratios_to_masses
+
+from .. import postprocess_prosp as pp
+
+
+def getSFH_per_sample(chain, theta_index, zred, sfrtimes=[10, 30, 100], tbins=100):
+    """Per-sample reference implementation of getSFH."""
+    nsamples = chain.shape[0]
+    allsfhs = np.zeros((nsamples, 7))
+    allagebins = np.zeros((nsamples, 7, 2))
+    allMWA = np.zeros(nsamples)
+    for iteration in range(nsamples):
+        allagebins[iteration] = pp.z_to_agebins(zred=zred)
+        dt = 10 ** allagebins[iteration, :, 1] - 10 ** allagebins[iteration, :, 0]
+        masses = logsfr_ratios_to_masses(
+            logsfr_ratios=chain[iteration, theta_index["logsfr_ratios"]],
+            agebins=allagebins[iteration],
+            logmass=chain[iteration, theta_index["logmass"]][0],
+        )
+        allsfhs[iteration] = masses / dt
+        allMWA[iteration] = pp.get_mwa(allagebins[iteration], allsfhs[iteration])
+
+    allagebins_ago = 10**allagebins / 1e9
+    age_interp = np.logspace(1, np.log10(np.max(allagebins_ago * 1e9)), tbins) / 1e9
+    allsfhs_interp = np.zeros((nsamples, len(age_interp)))
+    allsfrs = np.zeros((nsamples, len(sfrtimes)))
+    for iteration in range(nsamples):
+        allsfhs_interp[iteration] = pp.stepInterp(
+            allagebins_ago[iteration], allsfhs[iteration], age_interp
+        )
+        for i, time in enumerate(sfrtimes):
+            allsfrs[iteration, i] = np.mean(
+                allsfhs_interp[iteration, (age_interp <= time * 1e-9)]
+            )
+    return age_interp, allsfhs_interp, allMWA, allsfrs, allsfhs
+
+
+class GetSFHTest(TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(42)
+        self.theta_index = pp.theta_index()
+        self.chain = np.zeros((500, 18))
+        self.chain[:, self.theta_index["logmass"]] = rng.uniform(7, 12.5, (500, 1))
+        self.chain[:, self.theta_index["logsfr_ratios"]] = rng.normal(0, 0.5, (500, 6))
+
+    def test_matches_per_sample_implementation(self):
+        for zred in [0.01, 0.1, 0.2]:
+            expected = getSFH_per_sample(self.chain, self.theta_index, zred)
+            result = pp.getSFH(
+                self.chain, theta_index=self.theta_index, rtn_chains=True, zred=zred
+            )
+            for expected_array, result_array in zip(expected, result):
+                np.testing.assert_allclose(
+                    result_array, expected_array, rtol=1e-10, equal_nan=True
+                )
+
+    def test_percentiles(self):
+        age_interp, sfh, mwa, sfr, sfh_binned = pp.getSFH(
+            self.chain, theta_index=self.theta_index, zred=0.05
+        )
+        self.assertEqual(sfh.shape, (len(age_interp), 3))
+        self.assertEqual(sfr.shape, (3, 3))
+        self.assertEqual(sfh_binned.shape, (7, 3))
+        self.assertTrue(mwa[0] <= mwa[1] <= mwa[2])
+
+
+class LinearMassModel:
+    """
+    Stub prospector model whose fluxes are linear in the total mass formed
+    and whose surviving mass fraction does not depend on the mass, as for
+    the FSPS models.
+    """
+
+    def __init__(self):
+        rng = np.random.default_rng(7)
+        self.spec_shape = rng.uniform(0.5, 2.0, 40)
+        self.phot_shape = rng.uniform(0.5, 2.0, 5)
+
+    def predict(self, theta, sps=None, obs=None):
+        index = pp.theta_index()
+        flux = 10 ** theta[index["logmass"]][0] * (1 + 0.1 * theta[index["logzsol"]][0])
+        mfrac = 0.6 + 0.05 * np.tanh(theta[index["dust2"]][0])
+        return flux * self.spec_shape, flux * self.phot_shape, mfrac
+
+
+class PosteriorPredictiveTest(TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(42)
+        self.theta_index = pp.theta_index()
+        self.chain = rng.normal(0.0, 0.3, (200, 18))
+        self.chain[:, self.theta_index["zred"]] = rng.uniform(0.01, 0.2, (200, 1))
+        self.chain[:, self.theta_index["logmass"]] = rng.uniform(8, 11, (200, 1))
+        self.model = LinearMassModel()
+
+    def test_stellar_mass_rescaling(self):
+        predictive = pp.posterior_predictive(
+            self.chain, self.model, None, {}, ndraws=20, zred=0.05, stellar_mass=True
+        )
+        mass = self.theta_index["logmass"]
+        for theta, spec, phot, mfrac in zip(
+            predictive["theta"],
+            predictive["spec"],
+            predictive["phot"],
+            predictive["mfrac"],
+        ):
+            self.assertEqual(theta[self.theta_index["zred"]][0], 0.05)
+            # predicting with the total mass formed instead of the stellar mass
+            total_mass_theta = np.copy(theta)
+            total_mass_theta[mass] -= np.log10(mfrac)
+            expected_spec, expected_phot, _ = self.model.predict(total_mass_theta)
+            np.testing.assert_allclose(spec, expected_spec, rtol=1e-10)
+            np.testing.assert_allclose(phot, expected_phot, rtol=1e-10)
+
+    def test_postprocess_with_predictive(self):
+        res = {"chain": self.chain}
+        percentiles, _ = pp.postprocess(
+            res, 0.05, mod_fsps=self.model, obs={}, use_weights=False
+        )
+        predictive = pp.posterior_predictive(
+            self.chain, self.model, None, {}, ndraws=20, zred=0.05, stellar_mass=True
+        )
+        reused_percentiles, _ = pp.postprocess(
+            res, 0.05, obs={}, use_weights=False, predictive=predictive
+        )
+
+        self.assertEqual(set(reused_percentiles), set(percentiles))
+        self.assertEqual(reused_percentiles["modphot"].shape, (5, 3))
+        self.assertEqual(reused_percentiles["modspec"].shape, (40, 3))
+        for key in ["modphot", "modspec"]:
+            self.assertEqual(reused_percentiles[key].shape, percentiles[key].shape)
+            self.assertTrue(np.all(np.diff(reused_percentiles[key], axis=1) >= 0))
@@ -1,14 +1,25 @@
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 
+from ..base_tasks import get_progress
 from ..base_tasks import initialise_all_tasks_status
 from ..base_tasks import TransientTaskRunner
 from ..base_tasks import update_status
+from ..dag import descendants
+from ..dag import node_states
+from ..dag import rerun_subgraph
+from ..dag import topological_order
+from ..dag import workflow_graph
 from ..models import Cutout
 from ..models import Filter
 from ..models import Status
 from ..models import Task
 from ..models import TaskRegister
 from ..models import Transient
+from ..models import TransientTaskCounts
+from ..sed_batch import batch_due
+from ..sed_batch import claim_batch
 from ..tasks import periodic_tasks
 from ..transient_tasks import Ghost
 from ..transient_tasks import ImageDownload
@@ -374,3 +385,187 @@ class TestAllRegisteredTaskRunners(TestCase):
                 self.assertTrue(isinstance(failed_message, str))
                 db_status = Status.objects.get(message__exact=failed_message)
                 self.assertTrue(db_status.message == failed_message)
+
+
+class WorkflowGraphTest(TestCase):
+    fixtures = [
+        "../fixtures/test/setup_test_transient.yaml",
+        "../fixtures/test/setup_test_task_register.yaml",
+    ]
+
+    def test_graph_is_acyclic(self):
+        graph = workflow_graph()
+        order = topological_order()
+        self.assertEqual(set(order), set(graph))
+        for task_name, dependencies in graph.items():
+            for dependency in dependencies:
+                self.assertTrue(order.index(dependency) < order.index(task_name))
+
+    def test_descendants(self):
+        downstream = descendants("Host match")
+        self.assertIn("Global host SED inference", downstream)
+        self.assertIn("Local aperture photometry", downstream)
+        self.assertNotIn("Transient information", downstream)
+
+    def test_node_states(self):
+        statuses = {task_name: "not processed" for task_name in workflow_graph()}
+        ready, finished = node_states(statuses)
+        self.assertEqual(ready, ["Cutout download"])
+        self.assertEqual(finished, set())
+
+        # a failed host match skips everything needing a host, but local
+        # photometry only waits on the host information
+        statuses["Cutout download"] = "processed"
+        statuses["Transient information"] = "processed"
+        statuses["Transient MWEBV"] = "processed"
+        statuses["Host match"] = "no GHOST match"
+        ready, finished = node_states(statuses)
+        self.assertEqual(ready, ["Local aperture photometry"])
+        self.assertIn("Host information", finished)
+        self.assertIn("Global host SED inference", finished)
+        self.assertNotIn("Local host SED inference", finished)
+
+    def test_rerun_subgraph(self):
+        transient = Transient.objects.get(name="2022testone")
+        processed = Status.objects.get(message="processed")
+        for task_name in ["Transient information", "Transient MWEBV"]:
+            TaskRegister(
+                transient=transient,
+                task=Task.objects.get(name=task_name),
+                status=processed,
+            ).save()
+        register = TaskRegister.objects.filter(transient=transient)
+        update_status(register.get(task__name="Cutout download"), processed)
+        update_status(
+            register.get(task__name="Host match"),
+            Status.objects.get(message="failed"),
+        )
+
+        dispatched = rerun_subgraph("2022testone", "Host match")
+
+        # host match is reset and straight away claimed by the scheduler
+        self.assertEqual(dispatched, ["Host match"])
+        self.assertEqual(
+            register.get(task__name="Host match").status.message, "processing"
+        )
+        self.assertEqual(
+            register.get(task__name="Cutout download").status.message, "processed"
+        )
+
+
+class TransientTaskCountsTest(TestCase):
+    fixtures = [
+        "../fixtures/test/setup_test_transient.yaml",
+        "../fixtures/test/setup_test_task_register.yaml",
+    ]
+
+    def setUp(self):
+        TransientTaskCounts.rebuild()
+
+    def test_rebuild(self):
+        counts = TransientTaskCounts.objects.get(transient__name="2022testone")
+        self.assertEqual(counts.total, 2)
+        self.assertEqual(counts.not_processed, 2)
+        self.assertEqual(get_progress("2022testone"), 0)
+
+    def test_counts_follow_status_changes(self):
+        transient = Transient.objects.get(name="2022testone")
+        register = TaskRegister.objects.filter(transient=transient)
+        update_status(
+            register.get(task__name="Cutout download"),
+            Status.objects.get(message="processed"),
+        )
+        transient.refresh_from_db()
+        self.assertEqual(transient.progress, 50)
+        self.assertEqual(transient.processing_status, "processing")
+
+        update_status(
+            register.get(task__name="Host match"),
+            Status.objects.get(message="failed"),
+        )
+        transient.refresh_from_db()
+        self.assertEqual(transient.progress, 100)
+        self.assertEqual(transient.processing_status, "blocked")
+
+        # incremental counts agree with a rebuild from scratch
+        counts = TransientTaskCounts.objects.get(transient=transient)
+        TransientTaskCounts.rebuild(Transient.objects.filter(pk=transient.pk))
+        rebuilt = TransientTaskCounts.objects.get(transient=transient)
+        for field in ["total", "not_processed", "processed", "failed"]:
+            self.assertEqual(getattr(counts, field), getattr(rebuilt, field))
+
+    def test_skipped_tasks_are_not_failures(self):
+        transient = Transient.objects.get(name="2022testone")
+        register = TaskRegister.objects.filter(transient=transient)
+        update_status(
+            register.get(task__name="Cutout download"),
+            Status.objects.get(message="failed"),
+        )
+        # the scheduler marks the tasks that can no longer run as blocked
+        update_status(
+            register.get(task__name="Host match"),
+            Status.objects.get(message="blocked"),
+        )
+
+        counts = TransientTaskCounts.objects.get(transient=transient)
+        self.assertEqual(counts.failed, 1)
+        self.assertEqual(counts.not_processed, 0)
+        transient.refresh_from_db()
+        self.assertEqual(transient.progress, 100)
+        self.assertEqual(transient.processing_status, "blocked")
+
+        TransientTaskCounts.rebuild(Transient.objects.filter(pk=transient.pk))
+        rebuilt = TransientTaskCounts.objects.get(transient=transient)
+        self.assertEqual(rebuilt.failed, 1)
+
+    def test_status_update_does_not_reread(self):
+        register = TaskRegister.objects.filter(transient__name="2022testone")
+        update_status(
+            register.get(task__name="Cutout download"),
+            Status.objects.get(message="processing"),
+        )
+        register_item = register.get(task__name="Host match")
+        processed = Status.objects.get(message="processed")
+
+        with CaptureQueriesContext(connection) as queries:
+            update_status(register_item, processed)
+        selects = [
+            query["sql"]
+            for query in queries.captured_queries
+            if query["sql"].startswith("SELECT")
+        ]
+        # only the locked read of the task counts
+        self.assertEqual(len(selects), 1)
+        self.assertIn("host_transienttaskcounts", selects[0])
+
+
+class SEDBatchQueueTest(TestCase):
+    fixtures = [
+        "../fixtures/test/setup_test_transient.yaml",
+        "../fixtures/test/setup_test_task_register.yaml",
+    ]
+
+    def setUp(self):
+        self.register_item = TaskRegister(
+            transient=Transient.objects.get(name="2022testone"),
+            task=Task.objects.get(name="Local host SED inference"),
+            status=Status.objects.get(message="queued"),
+        )
+        self.register_item.save()
+
+    def test_batch_due(self):
+        task_name = "Local host SED inference"
+        self.assertTrue(batch_due(task_name, batch_size=1, max_wait_seconds=3600))
+        self.assertFalse(batch_due(task_name, batch_size=2, max_wait_seconds=3600))
+        # a partial batch is run once it has waited long enough
+        self.assertTrue(batch_due(task_name, batch_size=2, max_wait_seconds=0))
+        self.assertFalse(batch_due("Global host SED inference", batch_size=1))
+
+    def test_claim_batch(self):
+        claimed = claim_batch("Local host SED inference", batch_size=4)
+        self.assertEqual([item.pk for item in claimed], [self.register_item.pk])
+        self.register_item.refresh_from_db()
+        self.assertEqual(self.register_item.status.message, "processing")
+
+        # claimed items are not claimed again
+        self.assertEqual(claim_batch("Local host SED inference", batch_size=4), [])
@@ -0,0 +1,61 @@
+import numpy as np
+from django.test import TestCase
+
+from ..SBI.nn_index import chi2dof
+from ..SBI.nn_index import TrainingSetIndex
+
+
+def within_chi2_brute_force(
+    y_train, bands, obsphot, obsphot_unc, k, ini_chi2, max_chi2
+):
+    """Reference implementation, widening the threshold over the whole training set."""
+    chi2_nei = chi2dof(mags=y_train[:, bands], obsphot=obsphot, obsphot_unc=obsphot_unc)
+    _chi2_thres = ini_chi2 * 1
+    while _chi2_thres <= max_chi2:
+        idx_chi2_selected = np.where(chi2_nei <= _chi2_thres)[0]
+        if len(idx_chi2_selected) >= k:
+            return idx_chi2_selected, _chi2_thres
+        _chi2_thres += 5
+    return None, _chi2_thres
+
+
+class TrainingSetIndexTest(TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(42)
+        mags = rng.normal(loc=20.0, scale=2.0, size=(2000, 22))
+        mags[rng.random(mags.shape) < 0.05] = np.nan
+        mags_unc = rng.uniform(0.01, 0.3, size=(2000, 22))
+        redshift = rng.uniform(0.0, 0.2, size=(2000, 1))
+        self.y_train = np.concatenate([mags, mags_unc, redshift], axis=1)
+        self.index = TrainingSetIndex(self.y_train)
+        self.rng = rng
+
+    def test_within_chi2_matches_brute_force(self):
+        for row in self.rng.choice(len(self.y_train), size=50):
+            nbands = self.rng.integers(3, 23)
+            bands = np.sort(self.rng.choice(22, size=nbands, replace=False))
+            obsphot_unc = self.rng.uniform(0.02, 0.5, size=len(bands))
+            obsphot = self.y_train[row, bands] + self.rng.normal(scale=obsphot_unc)
+            obsphot[self.rng.random(len(bands)) < 0.1] = np.nan
+            for k in [10, 30, 200]:
+                expected, expected_chi2 = within_chi2_brute_force(
+                    self.y_train, bands, obsphot, obsphot_unc, k, 5, 5000
+                )
+                selected, selected_chi2 = self.index.within_chi2(
+                    bands, obsphot, obsphot_unc, k=k, ini_chi2=5, max_chi2=5000
+                )
+                self.assertEqual(selected_chi2, expected_chi2)
+                if expected is None:
+                    self.assertIsNone(selected)
+                else:
+                    np.testing.assert_array_equal(selected, expected)
+
+    def test_within_chi2_not_enough_neighbours(self):
+        bands = np.arange(22)
+        obsphot = np.full(22, 50.0)
+        obsphot_unc = np.full(22, 0.01)
+        selected, selected_chi2 = self.index.within_chi2(
+            bands, obsphot, obsphot_unc, k=30, ini_chi2=5, max_chi2=5000
+        )
+        self.assertIsNone(selected)
+        self.assertGreater(selected_chi2, 5000)
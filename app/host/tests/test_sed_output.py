@@ -0,0 +1,92 @@
+import io
+import os
+import tempfile
+from types import SimpleNamespace
+
+import numpy as np
+from django.test import TestCase
+
+from ..sed_output import is_sed_output
+from ..sed_output import SEDOutput
+from ..sed_output import sed_output_path
+from ..sed_output import write_sed_output
+
+
+class SEDOutputTest(TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(42)
+        self.chain = rng.normal(size=(500, 18))
+        self.percentiles = {
+            "stellar_mass": np.array([9.5, 10.0, 10.5]),
+            "sfh": rng.normal(size=(100, 3)),
+        }
+        self.chains = {"stellar_mass": rng.normal(size=500)}
+        self.model_data = {
+            "rest_wavelength": np.linspace(1e3, 1e5, 2000),
+            "spec": rng.random(2000),
+            "phot": rng.random(2),
+        }
+        self.observations = {
+            "redshift": 0.05,
+            "filters": [
+                SimpleNamespace(name="SDSS_g", wave_effective=4700.0),
+                SimpleNamespace(name="SDSS_r", wave_effective=6200.0),
+            ],
+            "maggies": np.array([1e-9, 2e-9]),
+            "maggies_unc": np.array([1e-10, 2e-10]),
+        }
+
+    def write(self, directory):
+        path = sed_output_path(directory, "2010H", "global")
+        write_sed_output(
+            path,
+            chain=self.chain,
+            theta_labels=[f"theta_{i}" for i in range(18)],
+            observations=self.observations,
+            percentiles=self.percentiles,
+            chains=self.chains,
+            model_data=self.model_data,
+            attrs={"transient": "2010H", "aperture_type": "global"},
+        )
+        return path
+
+    def test_round_trip(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = self.write(directory)
+            self.assertTrue(is_sed_output(path))
+            self.assertEqual(os.listdir(os.path.dirname(path)), ["2010H_global.h5"])
+
+            with SEDOutput(path) as sed_output:
+                self.assertEqual(sed_output.redshift, 0.05)
+                self.assertEqual(sed_output.theta_labels[0], "theta_0")
+                np.testing.assert_array_equal(sed_output.chain(), self.chain)
+                np.testing.assert_array_equal(
+                    sed_output.chain(slice(10, 20)), self.chain[10:20]
+                )
+                np.testing.assert_array_equal(
+                    sed_output.percentiles(["sfh"])["sfh"], self.percentiles["sfh"]
+                )
+                np.testing.assert_array_equal(
+                    sed_output.dataset("model/spec")[:10], self.model_data["spec"][:10]
+                )
+                self.assertEqual(
+                    list(sed_output.obs()["filternames"]), ["SDSS_g", "SDSS_r"]
+                )
+
+                # downloads load without pickle
+                with np.load(
+                    io.BytesIO(sed_output.to_npz("model")), allow_pickle=False
+                ) as model_data:
+                    np.testing.assert_array_equal(
+                        model_data["phot"], self.model_data["phot"]
+                    )
+
+    def test_not_an_sed_output(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "legacy.h5")
+            self.assertFalse(is_sed_output(path))
+            with open(path, "w") as legacy_file:
+                legacy_file.write("not hdf5")
+            self.assertFalse(is_sed_output(path))
+            with self.assertRaises(OSError):
+                SEDOutput(path)
@@ -1,6 +1,11 @@
+import os
+import tempfile
+
+from django.test import override_settings
 from django.test import TestCase
 from sedpy.observate import Filter as SedpyFilter
 
+from .. import filter_curves
 from ..models import Filter
 
 
@@ -22,6 +27,41 @@ class FilterTest(TestCase):
             # assert_array_equal(sedpy_filter.transmission, raw_transmission)
 
 
+class FilterCurveRegistryTest(TestCase):
+    def write_curve(self, directory, name, transmission):
+        with open(os.path.join(directory, f"{name}.txt"), "w") as curve_file:
+            for wavelength in range(4000, 6001, 100):
+                print(f"{wavelength} {transmission}", file=curve_file)
+
+    def test_transmission_curve_cached(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(TRANSMISSION_CURVES_ROOT=directory):
+                self.write_curve(directory, "test_filter", 0.5)
+                curve = filter_curves.transmission_curve("test_filter")
+                self.assertIs(filter_curves.transmission_curve("test_filter"), curve)
+                self.assertEqual(curve.nick, "test_filter")
+
+                # an updated file is parsed again
+                self.write_curve(directory, "test_filter", 0.8)
+                path = filter_curves.transmission_curve_path("test_filter")
+                mtime = os.path.getmtime(path) + 10
+                os.utime(path, (mtime, mtime))
+                updated_curve = filter_curves.transmission_curve("test_filter")
+                self.assertIsNot(updated_curve, curve)
+                self.assertGreater(
+                    updated_curve.transmission.max(), curve.transmission.max()
+                )
+
+    def test_missing_curves(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(TRANSMISSION_CURVES_ROOT=directory):
+                with self.assertRaises(ValueError):
+                    filter_curves.transmission_curve("missing_filter")
+                self.assertEqual(
+                    filter_curves.correlation_model("missing_filter"), (None, None)
+                )
+
+
 class PropsectorBuildObsTest(TestCase):
 
     def test_build_obs(self):
@@ -0,0 +1,113 @@
+import numpy as np
+from astropy import units as u
+from astropy.coordinates import angular_separation
+from django.core.management import call_command
+from django.test import TestCase
+
+from ..models import Host
+from ..models import SkyObject
+from ..models import Transient
+from ..sky_index import cone_search
+from ..sky_index import cone_search_ranges
+from ..sky_index import healpix_index
+
+
+class SkyIndexTest(TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(42)
+        # clustered around a few centers, including across RA = 0 and near
+        # the pole, so the cones have many candidates
+        centers = [(0.0, 0.0), (150.0, -30.0), (45.0, 89.5)]
+        transients = []
+        for i in range(600):
+            ra, dec = centers[i % len(centers)]
+            transients.append(
+                Transient(
+                    name=f"2024sky{i}",
+                    ra_deg=(ra + rng.normal(scale=1.0)) % 360,
+                    dec_deg=float(np.clip(dec + rng.normal(scale=1.0), -90, 90)),
+                    tns_id=i,
+                    tns_prefix="SN",
+                )
+            )
+        SkyObject.update_healpix_indices(transients)
+        Transient.objects.bulk_create(transients)
+        self.centers = centers
+
+    def test_healpix_index_set_on_save(self):
+        transient = Transient.objects.create(
+            name="2024skysave", ra_deg=12.0, dec_deg=13.0, tns_id=1, tns_prefix="SN"
+        )
+        self.assertTrue(transient.healpix_index == healpix_index(12.0, 13.0))
+
+        transient.ra_deg = 200.0
+        transient.save(update_fields=["ra_deg"])
+        transient.refresh_from_db()
+        self.assertTrue(transient.healpix_index == healpix_index(200.0, 13.0))
+
+        host = Host.objects.create(name="skyhost", ra_deg=12.0, dec_deg=13.0)
+        self.assertTrue(host.healpix_index == healpix_index(12.0, 13.0))
+
+    def test_healpix_index_set_on_raw_save(self):
+        # the example transients are loaded by a migration before the pixels
+        # existed and filled in by the migration adding them
+        for transient in Transient.objects.filter(name__in=["2010H", "2010ai"]):
+            self.assertTrue(
+                transient.healpix_index
+                == healpix_index(transient.ra_deg, transient.dec_deg)
+            )
+
+        call_command(
+            "loaddata", "../fixtures/test/setup_test_transient.yaml", verbosity=0
+        )
+        transient = Transient.objects.get(name="2022testone")
+        self.assertTrue(
+            transient.healpix_index
+            == healpix_index(transient.ra_deg, transient.dec_deg)
+        )
+        matches = cone_search(
+            Transient.objects.all(), transient.ra_deg, transient.dec_deg, 1 / 3600
+        )
+        self.assertTrue([match.name for match, _ in matches] == ["2022testone"])
+
+    def test_cone_search_ranges_cover_cone(self):
+        for ra, dec in self.centers:
+            ranges = cone_search_ranges(ra, dec, 0.5)
+            for transient in Transient.objects.all():
+                separation = angular_separation(
+                    transient.ra_deg * u.deg,
+                    transient.dec_deg * u.deg,
+                    ra * u.deg,
+                    dec * u.deg,
+                ).to_value(u.deg)
+                if separation <= 0.5:
+                    self.assertTrue(
+                        any(
+                            first <= transient.healpix_index <= last
+                            for first, last in ranges
+                        )
+                    )
+
+    def test_cone_search_matches_brute_force(self):
+        transients = list(Transient.objects.all())
+        for (ra, dec), radius in zip(self.centers, [0.3, 1.0, 2.0]):
+            separations = angular_separation(
+                np.array([t.ra_deg for t in transients]) * u.deg,
+                np.array([t.dec_deg for t in transients]) * u.deg,
+                ra * u.deg,
+                dec * u.deg,
+            ).to_value(u.deg)
+            expected = {
+                transient.name
+                for transient, separation in zip(transients, separations)
+                if separation <= radius
+            }
+
+            matches = cone_search(Transient.objects.all(), ra, dec, radius)
+            self.assertTrue(len(expected) > 0)
+            self.assertTrue({transient.name for transient, _ in matches} == expected)
+            match_separations = [separation for _, separation in matches]
+            self.assertTrue(match_separations == sorted(match_separations))
+
+    def test_cone_search_empty(self):
+        self.assertTrue(cone_search(Transient.objects.all(), 270.0, 10.0, 0.1) == [])
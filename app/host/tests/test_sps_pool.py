@@ -0,0 +1,49 @@
+import numpy as np
+from django.test import TestCase
+
+from .. import sps_pool
+from ..prospector import zred_to_agebins
+
+
+class SPSPoolTest(TestCase):
+    def setUp(self):
+        # the pool is kept by the process, start every test with an empty one
+        while not sps_pool._pool.empty():
+            sps_pool._pool.get_nowait()
+        sps_pool._timings.clear()
+        pool_size = sps_pool.SPS_POOL_SIZE
+        sps_pool.SPS_POOL_SIZE = 1
+        self.addCleanup(setattr, sps_pool, "SPS_POOL_SIZE", pool_size)
+
+    def test_borrow_and_return(self):
+        with sps_pool.borrow_model_components({"redshift": 0.05}, "test") as first:
+            self.assertTrue(sps_pool._pool.qsize() == 0)
+        self.assertTrue(sps_pool._pool.qsize() == 1)
+
+        with sps_pool.borrow_model_components({"redshift": 0.05}, "test") as second:
+            self.assertIs(second, first)
+            # the pooled entry is in use, so another fit builds its own
+            with sps_pool.borrow_model_components({"redshift": 0.05}, "test") as third:
+                self.assertIsNot(third, first)
+        # no more than SPS_POOL_SIZE entries are kept
+        self.assertTrue(sps_pool._pool.qsize() == 1)
+
+        stats = sps_pool.pool_stats()["test"]
+        self.assertTrue(stats["cold_starts"] == 2 and stats["warm_starts"] == 1)
+
+    def test_reset_for_new_transient(self):
+        with sps_pool.borrow_model_components({"redshift": 0.05}) as components:
+            model = components["model"]
+            initial = {name: np.copy(model.params[name]) for name in model.free_params}
+            # a fit leaves the model at the parameters it last evaluated
+            model.set_parameters(model.theta * 1.1 + 0.01)
+
+        with sps_pool.borrow_model_components({"redshift": 0.1}) as components:
+            self.assertIs(components["model"], model)
+            for name in model.free_params:
+                if name != "zred":
+                    np.testing.assert_array_equal(model.params[name], initial[name])
+            np.testing.assert_array_equal(model.params["zred"], [0.1])
+            np.testing.assert_array_equal(
+                model.params["agebins"], zred_to_agebins(zred=np.atleast_1d(0.1))
+            )
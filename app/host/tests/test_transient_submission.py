@@ -0,0 +1,77 @@
+from unittest import mock
+
+from django.db import transaction
+from django.test import TestCase
+
+from .. import transient_submission
+from ..models import SciencePayloadVersion
+from ..models import Transient
+from ..transient_submission import submit_transients
+
+
+def submission_row(name, ra="10.0", dec="20.0"):
+    return {
+        "name": name,
+        "ra": ra,
+        "dec": dec,
+        "redshift": "None",
+        "spectroscopic_class": "",
+    }
+
+
+class TransientSubmissionTest(TestCase):
+    def test_report(self):
+        report = submit_transients(
+            [
+                submission_row("2024new"),
+                submission_row("2010H"),
+                submission_row("2024new"),
+                submission_row("2024bad", dec="95"),
+            ],
+            queue_workflows=False,
+        )
+        self.assertTrue(
+            [row["status"] for row in report]
+            == ["created", "exists", "duplicate", "invalid"]
+        )
+        transient = Transient.objects.get(name="2024new")
+        self.assertTrue(
+            SciencePayloadVersion.objects.filter(transient=transient).exists()
+        )
+        self.assertFalse(Transient.objects.filter(name="2024bad").exists())
+
+    def test_concurrent_submission(self):
+        create_transients = transient_submission._create_transients
+
+        def race(new_transients):
+            # another submission inserts one of the names after they were
+            # checked against the database
+            Transient.objects.create(
+                name="2024race", ra_deg=1.0, dec_deg=2.0, tns_id=0, tns_prefix=""
+            )
+            return create_transients(new_transients)
+
+        with mock.patch.object(
+            transient_submission, "_create_transients", side_effect=race
+        ):
+            report = submit_transients(
+                [submission_row("2024race"), submission_row("2024other")],
+                queue_workflows=False,
+            )
+
+        self.assertTrue([row["status"] for row in report] == ["exists", "created"])
+        self.assertTrue(Transient.objects.get(name="2024race").ra_deg == 1.0)
+        self.assertTrue(Transient.objects.filter(name="2024other").exists())
+
+    def test_create_transients_skips_existing_names(self):
+        with transaction.atomic():
+            inserted_names = transient_submission._create_transients(
+                [
+                    Transient(
+                        name=name, ra_deg=3.0, dec_deg=4.0, tns_id=0, tns_prefix=""
+                    )
+                    for name in ["2010H", "2024fresh"]
+                ]
+            )
+        self.assertTrue(inserted_names == {"2024fresh"})
+        self.assertTrue(Transient.objects.get(name="2010H").ra_deg != 3.0)
@@ -0,0 +1,241 @@
+"""
+Bulk submission of transients given by name and coordinates.
+
+All rows of a submission are validated together with vectorized pandas and
+numpy operations, checked against the existing transients with a single query
+and inserted with bulk_create. The workflows of the new transients are queued
+in celery groups once the transaction that created them has committed.
+"""
+import csv
+import io
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+from django.db import IntegrityError
+from django.db import transaction
+
+from . import sky_index
+from .models import SciencePayloadVersion
+from .models import Transient
+from .workflow import queue_transient_workflows
+
+# name, RA and Dec in decimal degrees, and the optional redshift and
+# spectroscopic classification, "None" or blank if unknown
+SUBMISSION_COLUMNS = ["name", "ra", "dec", "redshift", "spectroscopic_class"]
+
+
+def read_submission_csv(text):
+    """
+    Read the rows of a CSV submission.
+
+    Parameters:
+        text (str): CSV with a header naming the SUBMISSION_COLUMNS, of which
+            redshift and spectroscopic_class are optional.
+    Returns:
+        rows (list[dict]): one dictionary per row.
+    """
+    return list(csv.DictReader(io.StringIO(text)))
+
+
+def _text(column):
+    """Stripped strings of a column, missing for blank and "None" values."""
+    text = column.astype("string").str.strip()
+    return text.mask(text.isna() | (text == "") | (text.str.lower() == "none"))
+
+
+def _mask(condition):
+    return np.asarray(pd.Series(condition).fillna(False), dtype=bool)
+
+
+def validate_transients(rows):
+    """
+    Validate the rows of a submission in one vectorized pass.
+
+    Parameters:
+        rows (list[dict]): rows with the SUBMISSION_COLUMNS as keys.
+    Returns:
+        transients (pd.DataFrame): the name, ra_deg, dec_deg, redshift and
+            spectroscopic_class of each row, and a message saying why the row
+            is invalid, None for valid rows.
+    """
+    frame = pd.DataFrame.from_records(rows, columns=SUBMISSION_COLUMNS)
+    names = _text(frame["name"])
+    ra = pd.to_numeric(frame["ra"], errors="coerce").astype(float)
+    dec = pd.to_numeric(frame["dec"], errors="coerce").astype(float)
+    redshift_text = _text(frame["redshift"])
+    redshift = pd.to_numeric(
+        redshift_text.astype(object).where(redshift_text.notna(), np.nan),
+        errors="coerce",
+    ).astype(float)
+    classes = _text(frame["spectroscopic_class"])
+
+    max_name_length = Transient._meta.get_field("name").max_length
+    max_class_length = Transient._meta.get_field("spectroscopic_class").max_length
+    checks = [
+        (names.isna(), "missing name"),
+        (
+            names.str.len() > max_name_length,
+            f"name is longer than {max_name_length} characters",
+        ),
+        (~np.isfinite(ra), "ra is not a number"),
+        (~np.isfinite(dec), "dec is not a number"),
+        (dec.abs() > 90, "dec is not between -90 and 90 degrees"),
+        (redshift_text.notna() & redshift.isna(), "redshift is not a number"),
+        (
+            classes.str.len() > max_class_length,
+            f"spectroscopic class is longer than {max_class_length} characters",
+        ),
+    ]
+    # the first failed check of a row is reported
+    messages = pd.Series([None] * len(frame), dtype=object)
+    for invalid, message in reversed(checks):
+        messages[_mask(invalid)] = message
+
+    return pd.DataFrame(
+        {
+            "name": names.astype(object).where(names.notna(), None),
+            "ra_deg": ra,
+            "dec_deg": dec,
+            "redshift": redshift.astype(object).where(redshift.notna(), None),
+            "spectroscopic_class": classes.astype(object).where(classes.notna(), None),
+            "message": messages,
+        }
+    )
+
+
+def _create_transients(new_transients):
+    """
+    Insert new transients, which must be done inside a transaction.
+
+    Parameters:
+        new_transients (list[Transient]): transients whose names did not exist
+            when they were checked.
+    Returns:
+        inserted_names (set[str]): names of the inserted transients. Names a
+            concurrent submission inserted since they were checked are left
+            out.
+    """
+    try:
+        with transaction.atomic():
+            Transient.objects.bulk_create(new_transients, batch_size=1000)
+        return {transient.name for transient in new_transients}
+    except IntegrityError:
+        pass
+
+    # Some names were inserted concurrently. Insert the rows one at a time to
+    # find out which ones this submission created, as the names of all rows
+    # exist afterwards whichever submission inserted them.
+    inserted_names = set()
+    for transient in new_transients:
+        try:
+            with transaction.atomic():
+                Transient.objects.bulk_create([transient])
+            inserted_names.add(transient.name)
+        except IntegrityError:
+            continue
+    return inserted_names
+
+
+def submit_transients(rows, added_by=None, retrigger=False, queue_workflows=True):
+    """
+    Add many transients to blast at once.
+
+    Parameters:
+        rows (list[dict]): rows with the SUBMISSION_COLUMNS as keys.
+        added_by (User, optional): user submitting the transients.
+        retrigger (bool): also queue the workflows of submitted transients that
+            already exist, e.g. to resume aborted workflows.
+        queue_workflows (bool): queue the workflows of the new transients.
+    Returns:
+        report (list[dict]): the row number, name, status and message of each
+            row. The status is "created", "exists", "retriggered", "duplicate"
+            (the name appeared in an earlier row) or "invalid".
+    """
+    transients = validate_transients(rows)
+    valid = _mask(transients["message"].isna())
+    duplicate = valid & _mask(transients["name"].where(valid).duplicated())
+    candidate = valid & ~duplicate
+
+    candidate_names = list(transients["name"][candidate])
+    existing_names = set(
+        Transient.objects.filter(name__in=candidate_names).values_list(
+            "name", flat=True
+        )
+    )
+    exists = candidate & _mask(transients["name"].isin(existing_names))
+    new = candidate & ~exists
+
+    new_transients = transients[new]
+    new_names = list(new_transients["name"])
+    # bulk_create does not call save, which sets the HEALPix pixels
+    healpix_indices = sky_index.healpix_index(
+        new_transients["ra_deg"].to_numpy(), new_transients["dec_deg"].to_numpy()
+    ).tolist()
+    with transaction.atomic():
+        # a concurrent submission of the same name wins rather than failing
+        # the whole batch
+        inserted_names = _create_transients(
+            [
+                Transient(
+                    name=row.name,
+                    ra_deg=row.ra_deg,
+                    dec_deg=row.dec_deg,
+                    healpix_index=index,
+                    redshift=row.redshift,
+                    spectroscopic_class=row.spectroscopic_class,
+                    tns_id=0,
+                    tns_prefix="",
+                    added_by=added_by,
+                )
+                for row, index in zip(new_transients.itertuples(), healpix_indices)
+            ]
+        )
+        # bulk_create sends no signals, so create the payload versions here
+        SciencePayloadVersion.objects.bulk_create(
+            [
+                SciencePayloadVersion(transient_id=transient_id)
+                for transient_id in Transient.objects.filter(
+                    name__in=inserted_names
+                ).values_list("pk", flat=True)
+            ],
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+
+    # rows that lost the race against a concurrent submission already exist
+    lost = new & ~_mask(transients["name"].isin(inserted_names))
+    new = new & ~lost
+    exists = exists | lost
+    new_names = [name for name in new_names if name in inserted_names]
+
+    queued_names = new_names
+    if retrigger:
+        queued_names = queued_names + list(transients["name"][exists])
+    if queue_workflows and queued_names:
+        # the workers must be able to see the new transients
+        transaction.on_commit(lambda: queue_transient_workflows(queued_names))
+
+    statuses = np.select(
+        [new, exists, duplicate],
+        ["created", "retriggered" if retrigger else "exists", "duplicate"],
+        default="invalid",
+    )
+    messages = transients["message"].where(~duplicate, "name appears in an earlier row")
+    messages = messages.where(~exists, "transient already exists in the database")
+    return [
+        {
+            "row": row,
+            "name": name,
+            "status": status,
+            "message": message if isinstance(message, str) else None,
+        }
+        for row, (name, status, message) in enumerate(
+            zip(transients["name"], statuses.tolist(), messages)
+        )
+    ]
+
+
+def summarize_submission(report):
+    """Number of rows of each status in a submission report."""
+    return dict(Counter(row["status"] for row in report))
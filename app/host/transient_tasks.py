@@ -1,21 +1,24 @@
 import math
 
 import numpy as np
-from astropy.io import fits
 from celery import shared_task
+from django.conf import settings
 from django.db.models import Q
 from host.base_tasks import task_soft_time_limit
 from host.base_tasks import task_time_limit
 
 from .base_tasks import TransientTaskRunner
+from .dag import register_node
+from .dag import run_node
 from .cutouts import download_and_save_cutouts
 from .ghost import run_ghost
 from .host_utils import check_global_contamination
 from .host_utils import check_local_radius
 from .host_utils import construct_aperture
-from .host_utils import do_aperture_photometry
+from .host_utils import do_aperture_photometry_batch
 from .host_utils import get_dust_maps
 from .host_utils import get_local_aperture_size
+from .host_utils import open_image
 from .host_utils import query_ned
 from .host_utils import query_sdss
 from .host_utils import select_cutout_aperture
@@ -25,10 +28,10 @@ from .models import Cutout
 from .models import SEDFittingResult
 from .models import StarFormationHistoryResult
 from .models import Transient
-from .prospector import build_model
 from .prospector import build_obs
 from .prospector import fit_model
 from .prospector import prospector_result_to_blast
+from .sps_pool import borrow_model_components
 
 """This module contains all of the TransientTaskRunners in blast."""
 
@@ -255,8 +258,8 @@ class GlobalApertureConstruction(TransientTaskRunner):
         aperture = None
         while aperture is None and choice <= 8:
             aperture_cutout = select_cutout_aperture(cutouts, choice=choice)
-            image = fits.open(aperture_cutout[0].fits.name)
-            aperture = construct_aperture(image, transient.host.sky_coord)
+            with open_image(aperture_cutout[0].fits.name) as image:
+                aperture = construct_aperture(image, transient.host.sky_coord)
             choice += 1
         if aperture is None:
             return "failed"
@@ -290,6 +293,13 @@ class LocalAperturePhotometry(TransientTaskRunner):
             "Local aperture photometry": "not processed",
         }
 
+    def _dependencies(self):
+        """
+        The local aperture size depends on the redshift, so wait for the host
+        information that may provide it.
+        """
+        return super()._dependencies() + ["Host information"]
+
     @property
     def task_name(self):
         """
@@ -327,36 +337,29 @@ class LocalAperturePhotometry(TransientTaskRunner):
         aperture = Aperture.objects.get(**query)
         print(aperture)
         cutouts = Cutout.objects.filter(transient=transient).filter(~Q(fits=""))
+        cutouts = list(cutouts.select_related("filter"))
+        all_photometry = do_aperture_photometry_batch(cutouts, aperture.sky_aperture)
 
+        photometry_data = []
         for cutout in cutouts:
-            image = fits.open(cutout.fits.name)
-
-            try:
-                photometry = do_aperture_photometry(
-                    image, aperture.sky_aperture, cutout.filter
-                )
-
-                query = {
-                    "aperture": aperture,
-                    "transient": transient,
-                    "filter": cutout.filter,
-                }
-
-                data = {
-                    "aperture": aperture,
-                    "transient": transient,
-                    "filter": cutout.filter,
-                    "flux": photometry["flux"],
-                    "flux_error": photometry["flux_error"],
-                }
-
-                if photometry["flux"] is not None and photometry["flux"] > 0:
-                    data["magnitude"] = photometry["magnitude"]
-                    data["magnitude_error"] = photometry["magnitude_error"]
-
-                self._overwrite_or_create_object(AperturePhotometry, query, data)
-            except Exception:
-                raise
+            photometry = all_photometry[cutout.name]
+
+            data = {
+                "aperture": aperture,
+                "transient": transient,
+                "filter": cutout.filter,
+                "flux": photometry["flux"],
+                "flux_error": photometry["flux_error"],
+            }
+
+            if photometry["flux"] is not None and photometry["flux"] > 0:
+                data["magnitude"] = photometry["magnitude"]
+                data["magnitude_error"] = photometry["magnitude_error"]
+            photometry_data += [data]
+
+        self._bulk_overwrite_or_create_objects(
+            AperturePhotometry, ["aperture", "transient", "filter"], photometry_data
+        )
         return "processed"
 
 
@@ -400,72 +403,80 @@ class GlobalAperturePhotometry(TransientTaskRunner):
             if aperture.exists():
                 aperture = aperture[0]
                 break
-        query = {"name": f"{cutout_for_aperture.name}_global"}
-        for cutout in cutouts:
-            image = fits.open(cutout.fits.name)
-
-            # make new aperture
-            # adjust semi-major/minor axes for size
-            if f"{cutout.name}_global" != aperture.name:
-                if not len(
-                    Aperture.objects.filter(cutout__name=f"{cutout.name}_global")
-                ):
-                    semi_major_axis = (
-                        aperture.semi_major_axis_arcsec
-                        - aperture.cutout.filter.image_fwhm_arcsec  # / 2.354
-                        + cutout.filter.image_fwhm_arcsec  # / 2.354
-                    )
-                    semi_minor_axis = (
-                        aperture.semi_minor_axis_arcsec
-                        - aperture.cutout.filter.image_fwhm_arcsec  # / 2.354
-                        + cutout.filter.image_fwhm_arcsec  # / 2.354
-                    )
-
-                    query = {"name": f"{cutout.name}_global"}
-                    data = {
-                        "name": f"{cutout.name}_global",
-                        "cutout": cutout,
-                        "orientation_deg": aperture.orientation_deg,
-                        "ra_deg": aperture.ra_deg,
-                        "dec_deg": aperture.dec_deg,
-                        "semi_major_axis_arcsec": semi_major_axis,
-                        "semi_minor_axis_arcsec": semi_minor_axis,
-                        "transient": transient,
-                        "type": "global",
-                    }
-
-                    self._overwrite_or_create_object(Aperture, query, data)
-                    aperture = Aperture.objects.get(
-                        transient=transient, name=f"{cutout.name}_global"
-                    )
+        cutouts = list(cutouts.select_related("filter"))
 
-            try:
-                photometry = do_aperture_photometry(
-                    image, aperture.sky_aperture, cutout.filter
-                )
-                if photometry["flux"] is None:
-                    continue
-
-                query = {
-                    "aperture": aperture,
+        # make new apertures for the other cutouts,
+        # adjusting the semi-major/minor axes for the image size
+        aperture_fwhm_arcsec = aperture.cutout.filter.image_fwhm_arcsec
+        apertures_data = []
+        for cutout in cutouts:
+            if f"{cutout.name}_global" == aperture.name:
+                continue
+            semi_major_axis = (
+                aperture.semi_major_axis_arcsec
+                - aperture_fwhm_arcsec  # / 2.354
+                + cutout.filter.image_fwhm_arcsec  # / 2.354
+            )
+            semi_minor_axis = (
+                aperture.semi_minor_axis_arcsec
+                - aperture_fwhm_arcsec  # / 2.354
+                + cutout.filter.image_fwhm_arcsec  # / 2.354
+            )
+            apertures_data += [
+                {
+                    "name": f"{cutout.name}_global",
+                    "cutout": cutout,
+                    "orientation_deg": aperture.orientation_deg,
+                    "ra_deg": aperture.ra_deg,
+                    "dec_deg": aperture.dec_deg,
+                    "semi_major_axis_arcsec": semi_major_axis,
+                    "semi_minor_axis_arcsec": semi_minor_axis,
                     "transient": transient,
-                    "filter": cutout.filter,
+                    "type": "global",
                 }
+            ]
+        self._bulk_overwrite_or_create_objects(Aperture, ["name"], apertures_data)
 
-                data = {
-                    "aperture": aperture,
-                    "transient": transient,
-                    "filter": cutout.filter,
-                    "flux": photometry["flux"],
-                    "flux_error": photometry["flux_error"],
-                }
-                if photometry["flux"] > 0:
-                    data["magnitude"] = photometry["magnitude"]
-                    data["magnitude_error"] = photometry["magnitude_error"]
+        apertures = {
+            a.name: a
+            for a in Aperture.objects.filter(
+                transient=transient, name__in=[d["name"] for d in apertures_data]
+            )
+        }
+        apertures[aperture.name] = aperture
+        cutout_apertures = {
+            cutout.name: apertures[f"{cutout.name}_global"] for cutout in cutouts
+        }
 
-                self._overwrite_or_create_object(AperturePhotometry, query, data)
-            except Exception:
-                raise
+        all_photometry = do_aperture_photometry_batch(
+            cutouts,
+            {
+                name: aperture.sky_aperture
+                for name, aperture in cutout_apertures.items()
+            },
+        )
+
+        photometry_data = []
+        for cutout in cutouts:
+            photometry = all_photometry[cutout.name]
+            if photometry["flux"] is None:
+                continue
+
+            data = {
+                "aperture": cutout_apertures[cutout.name],
+                "transient": transient,
+                "filter": cutout.filter,
+                "flux": photometry["flux"],
+                "flux_error": photometry["flux_error"],
+            }
+            if photometry["flux"] > 0:
+                data["magnitude"] = photometry["magnitude"]
+                data["magnitude_error"] = photometry["magnitude_error"]
+            photometry_data += [data]
+
+        self._bulk_overwrite_or_create_objects(
+            AperturePhotometry, ["aperture", "transient", "filter"], photometry_data
+        )
 
         return "processed"
 
@@ -511,10 +522,11 @@ class ValidateLocalPhotometry(TransientTaskRunner):
 
         # we can't measure the local aperture if we don't know the redshift
         if redshift is None:
-            for local_aperture_phot in local_aperture_photometry:
-                local_aperture_phot.is_validated = "false"
-                local_aperture_phot.save()
+            local_aperture_photometry.update(is_validated="false")
 
+        local_aperture_photometry = list(
+            local_aperture_photometry.select_related("filter")
+        )
         if not len(local_aperture_photometry):
             return "phot valid failed"
 
@@ -524,7 +536,9 @@ class ValidateLocalPhotometry(TransientTaskRunner):
                 local_aperture_phot.filter.image_fwhm_arcsec,
             )
             local_aperture_phot.is_validated = is_validated
-            local_aperture_phot.save()
+        AperturePhotometry.objects.bulk_update(
+            local_aperture_photometry, ["is_validated"]
+        )
 
         validated_local_aperture_photometry = AperturePhotometry.objects.filter(
             transient=transient, aperture__type="local", is_validated="true"
@@ -575,8 +589,10 @@ class ValidateGlobalPhotometry(TransientTaskRunner):
             cutout__name=cutout_for_aperture.name, type="global"
         )
 
-        global_aperture_photometry = AperturePhotometry.objects.filter(
-            transient=transient, aperture__type="global"
+        global_aperture_photometry = list(
+            AperturePhotometry.objects.filter(
+                transient=transient, aperture__type="global"
+            ).select_related("aperture__cutout")
         )
 
         if not len(global_aperture_photometry):
@@ -613,7 +629,9 @@ class ValidateGlobalPhotometry(TransientTaskRunner):
             else:
                 contam_message = "false" if is_contam else "true"
             global_aperture_phot.is_validated = contam_message
-            global_aperture_phot.save()
+        AperturePhotometry.objects.bulk_update(
+            global_aperture_photometry, ["is_validated"]
+        )
 
         return "processed"
 
@@ -708,11 +726,11 @@ class HostInformation(TransientTaskRunner):
 class HostSEDFitting(TransientTaskRunner):
     """Task Runner to run host galaxy inference with prospector"""
 
-    def _run_process(
-        self, transient, aperture_type="global", mode="fast", sbipp=True, save=True
-    ):
-        """Run the SED-fitting task"""
-
+    def _sed_observations(self, transient, aperture_type):
+        """
+        Aperture and prospector observations of a transient, or the status
+        message if the transient can't be fit.
+        """
         query = {
             "transient__name__exact": f"{transient.name}",
             "type__exact": aperture_type,
@@ -720,14 +738,77 @@ class HostSEDFitting(TransientTaskRunner):
 
         if transient.best_redshift is None or transient.best_redshift > 0.2:
             # training sample doesn't work here
-            return "redshift too high"
+            return None, None, "redshift too high"
 
         aperture = Aperture.objects.filter(**query)
         if len(aperture) == 0:
             raise RuntimeError(f"no apertures found for transient {transient.name}")
 
         observations = build_obs(transient, aperture_type)
-        model_components = build_model(observations)
+        return aperture[0], observations, None
+
+    def _save_sed_results(
+        self,
+        transient,
+        aperture,
+        posterior,
+        model_components,
+        observations,
+        mode="fast",
+        sbipp=True,
+        save=True,
+    ):
+        """Write the posterior to disk and save the SED fitting results"""
+        if mode == "test":
+            prosp_results, sfh_results = prospector_result_to_blast(
+                transient,
+                aperture,
+                posterior,
+                model_components,
+                observations,
+                sed_output_root="/tmp",
+            )
+        else:
+            prosp_results, sfh_results = prospector_result_to_blast(
+                transient,
+                aperture,
+                posterior,
+                model_components,
+                observations,
+                sbipp=sbipp,
+            )
+        if save:
+            pr = SEDFittingResult.objects.filter(
+                transient=transient, aperture__type=aperture.type
+            )
+            if len(pr):
+                pr.update(**prosp_results)
+                pr = pr[0]
+            else:
+                pr = SEDFittingResult.objects.create(**prosp_results)
+            for sfh_r in sfh_results:
+                ps = pr.logsfh.filter(logsfr_tmin=sfh_r["logsfr_tmin"])
+                sfh_r["transient"] = transient
+                sfh_r["aperture"] = aperture
+                if len(ps):
+                    ps.update(**sfh_r)
+                else:
+                    ps = StarFormationHistoryResult.objects.create(**sfh_r)
+                    pr.logsfh.add(ps)
+        else:
+            print("printing results")
+            print(prosp_results)
+
+    def _run_process(
+        self, transient, aperture_type="global", mode="fast", sbipp=True, save=True
+    ):
+        """Run the SED-fitting task"""
+
+        aperture, observations, status_message = self._sed_observations(
+            transient, aperture_type
+        )
+        if status_message is not None:
+            return status_message
 
         if mode == "test" and not sbipp:
             # garbage results but the test runs
@@ -758,58 +839,30 @@ class HostSEDFitting(TransientTaskRunner):
                 nested_target_n_effective=10000,
             )
 
-        print("starting model fit")
-        posterior, errflag = fit_model(
-            observations,
-            model_components,
-            fitting_settings,
-            sbipp=sbipp,
-            fit_type=aperture_type,
-        )
-        if errflag:
-            return "not enough filters"
-
-        if mode == "test":
-            prosp_results,sfh_results = prospector_result_to_blast(
-                transient,
-                aperture[0],
-                posterior,
-                model_components,
+        with borrow_model_components(
+            observations, label=aperture_type
+        ) as model_components:
+            print("starting model fit")
+            posterior, errflag = fit_model(
                 observations,
-                sed_output_root="/tmp",
+                model_components,
+                fitting_settings,
+                sbipp=sbipp,
+                fit_type=aperture_type,
             )
-        else:
-            prosp_results,sfh_results = prospector_result_to_blast(
+            if errflag:
+                return "not enough filters"
+
+            self._save_sed_results(
                 transient,
-                aperture[0],
+                aperture,
                 posterior,
                 model_components,
                 observations,
+                mode=mode,
                 sbipp=sbipp,
+                save=save,
             )
-        if save:
-            pr = SEDFittingResult.objects.filter(
-                transient=transient, aperture__type=aperture_type
-            )
-            if len(pr):
-                pr.update(**prosp_results)
-                pr = pr[0]
-            else:
-                pr = SEDFittingResult.objects.create(**prosp_results)
-            for sfh_r in sfh_results:
-                ps = pr.logsfh.filter(
-                    logsfr_tmin=sfh_r['logsfr_tmin']
-                )
-                sfh_r['transient'] = transient
-                sfh_r['aperture'] = aperture[0]
-                if len(ps):
-                    ps.update(**sfh_r)
-                else:
-                    ps = StarFormationHistoryResult.objects.create(**sfh_r)
-                    pr.logsfh.add(ps)
-        else:
-            print("printing results")
-            print(prosp_results)
         return "processed"
 
 
@@ -898,15 +951,15 @@ class GlobalHostSEDFitting(HostSEDFitting):
     time_limit=task_time_limit,
     soft_time_limit=task_soft_time_limit,
 )
-def transient_information(transient_name):
-    TransientInformation(transient_name).run_process()
+def transient_information(transient_name, scheduled=False):
+    run_node(TransientInformation(transient_name), scheduled=scheduled)
 
 
 @shared_task(
     name="Host Match", time_limit=task_time_limit, soft_time_limit=task_soft_time_limit
 )
-def host_match(transient_name):
-    Ghost(transient_name).run_process()
+def host_match(transient_name, scheduled=False):
+    run_node(Ghost(transient_name), scheduled=scheduled)
 
 
 @shared_task(
@@ -914,8 +967,8 @@ def host_match(transient_name):
     time_limit=task_time_limit,
     soft_time_limit=task_soft_time_limit,
 )
-def global_aperture_construction(transient_name):
-    GlobalApertureConstruction(transient_name).run_process()
+def global_aperture_construction(transient_name, scheduled=False):
+    run_node(GlobalApertureConstruction(transient_name), scheduled=scheduled)
 
 
 @shared_task(
@@ -923,8 +976,8 @@ def global_aperture_construction(transient_name):
     time_limit=task_time_limit,
     soft_time_limit=task_soft_time_limit,
 )
-def global_aperture_photometry(transient_name):
-    GlobalAperturePhotometry(transient_name).run_process()
+def global_aperture_photometry(transient_name, scheduled=False):
+    run_node(GlobalAperturePhotometry(transient_name), scheduled=scheduled)
 
 
 @shared_task(
@@ -932,8 +985,8 @@ def global_aperture_photometry(transient_name):
     time_limit=task_time_limit,
     soft_time_limit=task_soft_time_limit,
 )
-def global_host_sed_fitting(transient_name):
-    GlobalHostSEDFitting(transient_name).run_process()
+def global_host_sed_fitting(transient_name, scheduled=False):
+    run_node(GlobalHostSEDFitting(transient_name), scheduled=scheduled)
 
 
 @shared_task(
@@ -941,8 +994,8 @@ def global_host_sed_fitting(transient_name):
     time_limit=task_time_limit,
     soft_time_limit=task_soft_time_limit,
 )
-def host_information(transient_name):
-    HostInformation(transient_name).run_process()
+def host_information(transient_name, scheduled=False):
+    run_node(HostInformation(transient_name), scheduled=scheduled)
 
 
 @shared_task(
@@ -950,8 +1003,8 @@ def host_information(transient_name):
     time_limit=task_time_limit,
     soft_time_limit=task_soft_time_limit,
 )
-def image_download(transient_name):
-    ImageDownload(transient_name).run_process()
+def image_download(transient_name, scheduled=False):
+    run_node(ImageDownload(transient_name), scheduled=scheduled)
 
 
 @shared_task(
@@ -959,8 +1012,8 @@ def image_download(transient_name):
     time_limit=task_time_limit,
     soft_time_limit=task_soft_time_limit,
 )
-def local_aperture_photometry(transient_name):
-    LocalAperturePhotometry(transient_name).run_process()
+def local_aperture_photometry(transient_name, scheduled=False):
+    run_node(LocalAperturePhotometry(transient_name), scheduled=scheduled)
 
 
 @shared_task(
@@ -968,15 +1021,15 @@ def local_aperture_photometry(transient_name):
     time_limit=task_time_limit,
     soft_time_limit=task_soft_time_limit,
 )
-def local_host_sed_fitting(transient_name):
-    LocalHostSEDFitting(transient_name).run_process()
+def local_host_sed_fitting(transient_name, scheduled=False):
+    run_node(LocalHostSEDFitting(transient_name), scheduled=scheduled)
 
 
 @shared_task(
     name="MWEBV Host", time_limit=task_time_limit, soft_time_limit=task_soft_time_limit
 )
-def mwebv_host(transient_name):
-    MWEBV_Host(transient_name).run_process()
+def mwebv_host(transient_name, scheduled=False):
+    run_node(MWEBV_Host(transient_name), scheduled=scheduled)
 
 
 @shared_task(
@@ -984,8 +1037,8 @@ def mwebv_host(transient_name):
     time_limit=task_time_limit,
     soft_time_limit=task_soft_time_limit,
 )
-def mwebv_transient(transient_name):
-    MWEBV_Transient(transient_name).run_process()
+def mwebv_transient(transient_name, scheduled=False):
+    run_node(MWEBV_Transient(transient_name), scheduled=scheduled)
 
 
 @shared_task(
@@ -993,8 +1046,8 @@ def mwebv_transient(transient_name):
     time_limit=task_time_limit,
     soft_time_limit=task_soft_time_limit,
 )
-def validate_global_photometry(transient_name):
-    ValidateGlobalPhotometry(transient_name).run_process()
+def validate_global_photometry(transient_name, scheduled=False):
+    run_node(ValidateGlobalPhotometry(transient_name), scheduled=scheduled)
 
 
 @shared_task(
@@ -1002,8 +1055,8 @@ def validate_global_photometry(transient_name):
     time_limit=task_time_limit,
     soft_time_limit=task_soft_time_limit,
 )
-def validate_local_photometry(transient_name):
-    ValidateLocalPhotometry(transient_name).run_process()
+def validate_local_photometry(transient_name, scheduled=False):
+    run_node(ValidateLocalPhotometry(transient_name), scheduled=scheduled)
 
 @shared_task(
     name="Get Final Progress",
@@ -1014,3 +1067,26 @@ def final_progress(transient_name):
     transient = Transient.objects.get(name=transient_name)
     transient.progress = 100
     transient.save()
+
+
+register_node(ImageDownload, image_download)
+register_node(TransientInformation, transient_information)
+register_node(MWEBV_Transient, mwebv_transient)
+register_node(Ghost, host_match)
+register_node(HostInformation, host_information)
+register_node(MWEBV_Host, mwebv_host)
+register_node(LocalAperturePhotometry, local_aperture_photometry)
+register_node(ValidateLocalPhotometry, validate_local_photometry)
+register_node(
+    LocalHostSEDFitting,
+    local_host_sed_fitting,
+    queued=settings.SED_BATCH_INFERENCE,
+)
+register_node(GlobalApertureConstruction, global_aperture_construction)
+register_node(GlobalAperturePhotometry, global_aperture_photometry)
+register_node(ValidateGlobalPhotometry, validate_global_photometry)
+register_node(
+    GlobalHostSEDFitting,
+    global_host_sed_fitting,
+    queued=settings.SED_BATCH_INFERENCE,
+)
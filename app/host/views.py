@@ -1,3 +1,5 @@
+import os
+
 import django_filters
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import UserPassesTestMixin
@@ -9,6 +11,7 @@ from django.shortcuts import render
 from django.urls import re_path
 from django.urls import reverse_lazy
 from django_tables2 import RequestConfig
+from host.base_tasks import update_register_statuses
 from host.forms import ImageGetForm
 from host.forms import TransientUploadForm
 from host.host_utils import select_aperture
@@ -27,7 +30,12 @@ from host.plotting_utils import plot_bar_chart
 from host.plotting_utils import plot_cutout_image
 from host.plotting_utils import plot_sed
 from host.plotting_utils import plot_timeseries
+from host.sed_output import is_sed_output
+from host.sed_output import LEGACY_SUFFIXES
+from host.sed_output import SEDOutput
 from host.tables import TransientTable
+from host.transient_submission import submit_transients
+from host.transient_submission import SUBMISSION_COLUMNS
 from host.tasks import import_transient_list
 from revproxy.views import ProxyView
 from silk.profiling.profiler import silk_profile
@@ -153,28 +161,26 @@ def transient_uploads(request):
 
             info = form.cleaned_data["full_info"]
             if info:
-                for line in info.split("\n"):
-                    # name, ra, dec, redshift, type
-                    name, ra, dec, redshift, specclass = line.split(",")
-                    redshift = None if redshift.lower() == "none" else redshift
-                    specclass = None if specclass.lower() == "none" else specclass
-                    info_dict = {
-                        "name": name,
-                        "ra_deg": ra,
-                        "dec_deg": dec,
-                        "redshift": redshift,
-                        "spectroscopic_class": specclass,
-                        "tns_id": 0,
-                        "tns_prefix": "",
-                        "added_by": request.user,
-                    }
-                    # check if exists; if not, add it
-                    try:
-                        Transient.objects.get(name=name)
-                        errors += [f"Transient {name} already exists in the database"]
-                    except Transient.DoesNotExist:
-                        Transient.objects.create(**info_dict)
-                        uploaded_transient_names += [name]
+                # name, ra, dec, redshift, type
+                lines = [
+                    (number, line)
+                    for number, line in enumerate(info.splitlines(), 1)
+                    if line.strip()
+                ]
+                rows = [
+                    dict(zip(SUBMISSION_COLUMNS, line.split(","))) for _, line in lines
+                ]
+                report = submit_transients(rows, added_by=request.user)
+                for row in report:
+                    if row["status"] == "created":
+                        uploaded_transient_names += [row["name"]]
+                    elif row["status"] == "exists":
+                        errors += [
+                            f"Transient {row['name']} already exists in the database"
+                        ]
+                    else:
+                        line_number = lines[row["row"]][0]
+                        errors += [f"Line {line_number}: {row['message']}"]
     else:
         form = TransientUploadForm()
 
@@ -394,49 +400,55 @@ def results(request, slug):
 
 def reprocess_transient(request, slug):
     transient_name = slug
-    tasks = TaskRegister.objects.filter(transient__name=transient_name)
-    for t in tasks:
-        t.status = Status.objects.get(message="not processed")
-        t.save()
+    update_register_statuses(
+        TaskRegister.objects.filter(transient__name=transient_name),
+        Status.objects.get(message="not processed"),
+    )
     transient_workflow.delay(transient_name)
 
     return HttpResponseRedirect(reverse_lazy("results", kwargs={"slug": slug}))
 
 
-def download_chains(request, slug, aperture_type):
-    sed_result = get_object_or_404(
-        SEDFittingResult, transient__name=slug, aperture__type=aperture_type
-    )
+def sed_output_download(sed_result, group, legacy_file):
+    """
+    Download one group of the SED output container of a fit as an .npz file,
+    or the separate file of the group for fits from before the container
+    format.
+    """
+    path = sed_result.posterior.name
+    if is_sed_output(path):
+        with SEDOutput(path) as sed_output:
+            content = sed_output.to_npz(group)
+        filename = os.path.basename(path).replace(".h5", LEGACY_SUFFIXES[group])
+    else:
+        content = legacy_file
+        filename = legacy_file.name.split("/")[-1]
 
-    filename = sed_result.chains_file.name.split("/")[-1]
-    response = HttpResponse(sed_result.chains_file, content_type="text/plain")
+    response = HttpResponse(content, content_type="text/plain")
     response["Content-Disposition"] = f"attachment; filename={filename}"
 
     return response
 
 
-def download_modelfit(request, slug, aperture_type):
+def download_chains(request, slug, aperture_type):
     sed_result = get_object_or_404(
         SEDFittingResult, transient__name=slug, aperture__type=aperture_type
     )
+    return sed_output_download(sed_result, "chains", sed_result.chains_file)
 
-    filename = sed_result.model_file.name.split("/")[-1]
-    response = HttpResponse(sed_result.model_file, content_type="text/plain")
-    response["Content-Disposition"] = f"attachment; filename={filename}"
 
-    return response
+def download_modelfit(request, slug, aperture_type):
+    sed_result = get_object_or_404(
+        SEDFittingResult, transient__name=slug, aperture__type=aperture_type
+    )
+    return sed_output_download(sed_result, "model", sed_result.model_file)
 
 
 def download_percentiles(request, slug, aperture_type):
     sed_result = get_object_or_404(
         SEDFittingResult, transient__name=slug, aperture__type=aperture_type
     )
-
-    filename = sed_result.percentiles_file.name.split("/")[-1]
-    response = HttpResponse(sed_result.percentiles_file, content_type="text/plain")
-    response["Content-Disposition"] = f"attachment; filename={filename}"
-
-    return response
+    return sed_output_download(sed_result, "percentiles", sed_result.percentiles_file)
 
 
 def acknowledgements(request):
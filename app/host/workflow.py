@@ -1,25 +1,13 @@
-from celery import chain
-from celery import chord
 from celery import group
 from celery import shared_task
-from host.transient_tasks import global_aperture_construction
-from host.transient_tasks import global_aperture_photometry
-from host.transient_tasks import global_host_sed_fitting
-from host.transient_tasks import host_information
-from host.transient_tasks import host_match
-from host.transient_tasks import image_download
-from host.transient_tasks import local_aperture_photometry
-from host.transient_tasks import local_host_sed_fitting
-from host.transient_tasks import mwebv_host
-from host.transient_tasks import mwebv_transient
-from host.transient_tasks import final_progress
 from host.base_tasks import task_soft_time_limit
 from host.base_tasks import task_time_limit
-from host.transient_tasks import transient_information
-from host.transient_tasks import validate_global_photometry
-from host.transient_tasks import validate_local_photometry
 
+# importing the transient tasks registers them in the workflow graph
+from . import transient_tasks  # noqa: F401
 from .base_tasks import initialise_all_tasks_status
+from .dag import dispatch_ready
+from .dag import rerun_subgraph
 from .models import Transient
 from .transient_name_server import get_transients_from_tns_by_name
 
@@ -54,33 +42,42 @@ def transient_workflow(transient_name=None):
             initialise_all_tasks_status(transient)
             transient.tasks_initialized = "True"
             transient.save()
-    # Execute the workflow
-    workflow = chain(
-        image_download.si(transient_name),
-        transient_information.si(transient_name),
-        mwebv_transient.si(transient_name),
-        host_match.si(transient_name),
-        host_information.si(transient_name),
-        group(
-            chain(
-                local_aperture_photometry.si(transient_name),
-                validate_local_photometry.si(transient_name),
-                local_host_sed_fitting.si(transient_name),
-            ),
-            chord(
-                (
-                    mwebv_host.si(transient_name),
-                    chain(
-                        global_aperture_construction.si(transient_name),
-                        global_aperture_photometry.si(transient_name),
-                        validate_global_photometry.si(transient_name),
-                    ),
-                ),
-                global_host_sed_fitting.si(transient_name),
-            ),
-        ),
-        final_progress.si(transient_name)
-    )
-    workflow.delay()
+    # Start the workflow, the scheduler dispatches the remaining tasks as
+    # their parents finish
+    dispatch_ready(transient_name)
+
+    return transient_name
+
+
+@shared_task(
+    name="Transient Subgraph Workflow",
+    time_limit=task_time_limit,
+    soft_time_limit=task_soft_time_limit,
+)
+def transient_subgraph_workflow(transient_name=None, task_name=None):
+    """Re-run a task and everything downstream of it for one transient."""
+    assert transient_name and task_name
+    rerun_subgraph(transient_name, task_name)
 
     return transient_name
+
+
+# workflows published to the broker in one go
+WORKFLOW_GROUP_SIZE = 500
+
+
+def queue_transient_workflows(transient_names, group_size=WORKFLOW_GROUP_SIZE):
+    """
+    Queue the workflows of many transients, publishing them in celery groups
+    rather than one message at a time.
+
+    Parameters:
+        transient_names (list[str]): names of the transients.
+        group_size (int): number of workflows published together.
+    """
+    transient_names = list(transient_names)
+    for start in range(0, len(transient_names), group_size):
+        group(
+            transient_workflow.s(transient_name)
+            for transient_name in transient_names[start : start + group_size]
+        ).apply_async()
@@ -1,5 +1,6 @@
 import csv
 import json
+import shutil
 import sys
 import time
 from urllib.request import Request
@@ -11,24 +12,29 @@ def post_transient_from_csv(path_to_input_csv: str, base_url: str) -> None:
     Post transients from csv file to blast for processing.
 
     Parameters
-        path_to_input_csv (str): path to input transient csv file.
-        base_url (str): base url to the api
+        path_to_input_csv (str): path to input transient csv file, with name,
+            ra and dec columns.
+        base_url (str): url of the batch submission endpoint of the api
     returns
         None, prints the status of each posted transient
     """
-    with open(path_to_input_csv, newline="") as csv_file:
-        reader = csv.DictReader(csv_file)
-        for transient in reader:
-            ra, dec = transient["ra"], transient["dec"]
-            name = transient["name"]
-            post_url = f"{base_url}name={name}&ra={ra}&dec={dec}"
-            try:
-                response = urlopen(Request(post_url, method="POST"))
-                data = json.loads(response.read())
-                post_message = data.get("message", "no message returned by blast")
-                print(f"{post_message}")
-            except Exception as e:
-                print(f"{name}: {e}")
+    with open(path_to_input_csv, "rb") as csv_file:
+        request = Request(
+            base_url,
+            data=csv_file.read(),
+            headers={"Content-Type": "text/csv"},
+            method="POST",
+        )
+    try:
+        response = urlopen(request)
+        data = json.loads(response.read())
+    except Exception as e:
+        print(f"could not post {path_to_input_csv}: {e}")
+        return
+
+    for transient in data["transients"]:
+        message = transient["message"] or ""
+        print(f"{transient['name']}: {transient['status']} {message}".strip())
 
 
 def download_data_snapshot(
@@ -39,26 +45,24 @@ def download_data_snapshot(
 
     Parameters
         path_to_input_csv (str): path to input transient csv file.
-        base_url (str): base url to the api
+        path_to_output_csv (str): path to the output csv file.
+        base_url (str): url of the bulk export endpoint of the api
     Returns
         None
     """
-    payloads = []
     with open(path_to_input_csv, newline="") as csv_file:
         reader = csv.DictReader(csv_file)
-        for transient in reader:
-            transient_name = transient["name"]
-            post_url = f"{base_url}{transient_name}?format=json"
-            response = urlopen(Request(post_url, method="GET"))
-            data = json.loads(response.read())
-            payloads.append(data)
+        names = [transient["name"] for transient in reader]
 
-    with open(path_to_output_csv, "w", newline="") as csv_file:
-        fieldnames = payloads[0].keys()
-        writer = csv.DictWriter(csv_file, fieldnames=fieldnames)
-        writer.writeheader()
-        for payload in payloads:
-            writer.writerow(payload)
+    request = Request(
+        base_url,
+        data=json.dumps({"name": names, "file_format": "csv"}).encode(),
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    # the export is streamed, so copy it to disk without holding it in memory
+    with urlopen(request) as response, open(path_to_output_csv, "wb") as csv_file:
+        shutil.copyfileobj(response, csv_file)
 
 
 def transient_processing_progress(path_to_output_csv: str) -> float:
@@ -88,16 +92,18 @@ def transient_processing_progress(path_to_output_csv: str) -> float:
 
 if __name__ == "__main__":
     localhost = "http://0.0.0.0:8000"
-    post_endpoint = "/api/transient/post/"
-    get_endpoint = "/api/transient/get/"
+    post_endpoint = "/api/transient/post/batch"
+    export_endpoint = "/api/transient/export"
 
     input_csv = str(sys.argv[1])
     post_transient_from_csv(input_csv, f"{localhost}{post_endpoint}")
-    download_data_snapshot(input_csv, "/results.csv", f"{localhost}{get_endpoint}")
+    download_data_snapshot(input_csv, "/results.csv", f"{localhost}{export_endpoint}")
     batch_progress = transient_processing_progress("/results.csv")
 
     while batch_progress < 1.0:
         print(batch_progress)
         time.sleep(10)
-        download_data_snapshot(input_csv, "/results.csv", f"{localhost}{get_endpoint}")
+        download_data_snapshot(
+            input_csv, "/results.csv", f"{localhost}{export_endpoint}"
+        )
         batch_progress = transient_processing_progress("/results.csv")